@@ -0,0 +1,632 @@
+# -*- coding: utf8 -*-
+"""Storage backends of lexicon database. A backend provides the small set of
+Redis commands lexicon database uses, with the same names and return values
+as redis-py, so that the database can run on Redis, in memory or on an
+embedded SQLite file
+
+"""
+import sqlite3
+import binascii
+import logging
+import itertools
+import threading
+
+def _encode(value):
+    """Encode a key, member or value as a byte string like Redis does
+
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf8')
+    if not isinstance(value, str):
+        return str(value)
+    return value
+
+def _bitop(operation, values):
+    """Combine byte strings bitwise like Redis BITOP, shorter strings are 
+    padded with zero bytes
+
+    """
+    operation = operation.upper()
+    if operation not in ('AND', 'OR', 'XOR'):
+        raise ValueError('Unsupported bit operation %r' % operation)
+    values = [value or '' for value in values]
+    size = max(len(value) for value in values)
+    if not size:
+        return ''
+    # strings are combined as big integers, which is much faster than byte 
+    # by byte
+    numbers = [int(binascii.hexlify(value.ljust(size, '\x00')), 16) 
+               for value in values]
+    result = numbers[0]
+    for number in numbers[1:]:
+        if operation == 'AND':
+            result &= number
+        elif operation == 'OR':
+            result |= number
+        else:
+            result ^= number
+    return binascii.unhexlify('%0*x' % (size * 2, result))
+
+class Backend(object):
+    """Interface of storage backend
+
+    """
+
+    # commands can be queued in a pipeline
+    commands = ('get', 'set', 'mget', 'incr', 'sadd', 'srem', 'smembers',
+                'scard', 'sscan', 'hset', 'hincrby', 'hmget', 'hgetall',
+                'hlen', 'bitop', 'delete', 'unlink')
+
+    def get(self, key):
+        """Get value of a key, return None if it doesn't exist
+
+        """
+        raise NotImplementedError
+
+    def set(self, key, value):
+        """Set value of a key
+
+        """
+        raise NotImplementedError
+
+    def mget(self, keys):
+        """Get values of keys
+
+        """
+        raise NotImplementedError
+
+    def incr(self, key, amount=1):
+        """Increase value of a key by amount and return the new value
+
+        """
+        raise NotImplementedError
+
+    def sadd(self, key, *members):
+        """Add members to a set, return count of new members
+
+        """
+        raise NotImplementedError
+
+    def srem(self, key, *members):
+        """Remove members from a set, return count of removed members
+
+        """
+        raise NotImplementedError
+
+    def smembers(self, key):
+        """Get all members of a set
+
+        """
+        raise NotImplementedError
+
+    def scard(self, key):
+        """Get count of members of a set
+
+        """
+        raise NotImplementedError
+
+    def sscan(self, key, cursor=0, count=None):
+        """Get a part of members of a set, return (next cursor, members).
+        Iteration starts with cursor 0 and ends when cursor 0 is returned,
+        count is a hint of how many members to return
+
+        """
+        raise NotImplementedError
+
+    def sscan_iter(self, key, count=None):
+        """Iterate members of a set part by part with sscan, members added 
+        or removed during iteration may or may not be returned, and a member
+        may be returned more than once
+
+        """
+        cursor = 0
+        while True:
+            cursor, members = self.sscan(key, cursor, count)
+            for member in members:
+                yield member
+            if not cursor:
+                return
+
+    def hset(self, key, field, value):
+        """Set value of a field in a hash, return 1 if the field is new
+
+        """
+        raise NotImplementedError
+
+    def hincrby(self, key, field, amount=1):
+        """Increase value of a field in a hash by amount and return the new 
+        value
+
+        """
+        raise NotImplementedError
+
+    def hmget(self, key, fields):
+        """Get values of fields in a hash
+
+        """
+        raise NotImplementedError
+
+    def hgetall(self, key):
+        """Get all fields and values of a hash as a dict
+
+        """
+        raise NotImplementedError
+
+    def hlen(self, key):
+        """Get count of fields in a hash
+
+        """
+        raise NotImplementedError
+
+    def bitop(self, operation, dest, *keys):
+        """Combine strings of keys with bitwise operation AND, OR or XOR and
+        store the result in dest, return length of the result
+
+        """
+        raise NotImplementedError
+
+    def delete(self, *keys):
+        """Delete keys, return count of deleted keys
+
+        """
+        raise NotImplementedError
+
+    def unlink(self, *keys):
+        """Delete keys like delete, but memory of the values may be freed
+        later in background, return count of deleted keys
+
+        """
+        return self.delete(*keys)
+
+    def pipeline(self, transaction=False):
+        """Create a pipeline for queuing commands and executing them together
+
+        """
+        return Pipeline(self)
+
+class Pipeline(object):
+    """Pipeline queues commands and executes them in one go, it is for
+    backends which don't have native pipelines
+
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._commands = []
+
+    def __getattr__(self, name):
+        if name not in self.backend.commands:
+            raise AttributeError(name)
+        def queue(*args, **kwargs):
+            self._commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    def __len__(self):
+        return len(self._commands)
+
+    def execute(self):
+        """Execute all queued commands and return their results
+
+        """
+        commands = self._commands
+        self._commands = []
+        return self.backend._execute(commands)
+
+class RedisBackend(Backend):
+    """Backend stores data in Redis
+
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+        # whether the client and server support UNLINK, None for unknown
+        self._unlink = None
+
+    def get(self, key):
+        return self.redis.get(key)
+
+    def set(self, key, value):
+        return self.redis.set(key, value)
+
+    def mget(self, keys):
+        return self.redis.mget(keys)
+
+    def incr(self, key, amount=1):
+        return self.redis.incr(key, amount)
+
+    def sadd(self, key, *members):
+        return self.redis.sadd(key, *members)
+
+    def srem(self, key, *members):
+        return self.redis.srem(key, *members)
+
+    def smembers(self, key):
+        return self.redis.smembers(key)
+
+    def scard(self, key):
+        return self.redis.scard(key)
+
+    def sscan(self, key, cursor=0, count=None):
+        return self.redis.sscan(key, cursor, count=count)
+
+    def sscan_iter(self, key, count=None):
+        return self.redis.sscan_iter(key, count=count)
+
+    def hset(self, key, field, value):
+        return self.redis.hset(key, field, value)
+
+    def hincrby(self, key, field, amount=1):
+        return self.redis.hincrby(key, field, amount)
+
+    def hmget(self, key, fields):
+        return self.redis.hmget(key, fields)
+
+    def hgetall(self, key):
+        return self.redis.hgetall(key)
+
+    def hlen(self, key):
+        return self.redis.hlen(key)
+
+    def bitop(self, operation, dest, *keys):
+        return self.redis.bitop(operation, dest, *keys)
+
+    def delete(self, *keys):
+        return self.redis.delete(*keys)
+
+    def unlink(self, *keys):
+        # UNLINK is available since Redis 4.0, fall back to DEL
+        if self._unlink is not False:
+            try:
+                result = self.redis.unlink(*keys)
+            except AttributeError:
+                pass
+            except Exception, e:
+                if 'unknown command' not in str(e).lower():
+                    raise
+            else:
+                self._unlink = True
+                return result
+            self._unlink = False
+        return self.redis.delete(*keys)
+
+    def pipeline(self, transaction=False):
+        return self.redis.pipeline(transaction=transaction)
+
+class MemoryBackend(Backend):
+    """Backend stores data in a dict of this process, it is for testing and
+    benchmarking
+
+    """
+
+    def __init__(self):
+        self.data = {}
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        value = self.data.get(_encode(key))
+        if value is None:
+            return None
+        return _encode(value)
+
+    def set(self, key, value):
+        with self._lock:
+            self.data[_encode(key)] = _encode(value)
+        return True
+
+    def mget(self, keys):
+        return [self.get(key) for key in keys]
+
+    def incr(self, key, amount=1):
+        key = _encode(key)
+        with self._lock:
+            value = int(self.data.get(key, 0)) + amount
+            self.data[key] = value
+        return value
+
+    def sadd(self, key, *members):
+        with self._lock:
+            members_set = self.data.setdefault(_encode(key), set())
+            size = len(members_set)
+            members_set.update(_encode(member) for member in members)
+            return len(members_set) - size
+
+    def srem(self, key, *members):
+        with self._lock:
+            members_set = self.data.get(_encode(key))
+            if not members_set:
+                return 0
+            size = len(members_set)
+            members_set.difference_update(_encode(member)
+                                          for member in members)
+            if not members_set:
+                del self.data[_encode(key)]
+            return size - len(members_set)
+
+    def smembers(self, key):
+        return set(self.data.get(_encode(key), ()))
+
+    def scard(self, key):
+        return len(self.data.get(_encode(key), ()))
+
+    def sscan(self, key, cursor=0, count=None):
+        # cursor is index of members in iteration order of the set, which 
+        # doesn't change as long as the set is not modified
+        end = cursor + (count or 10)
+        with self._lock:
+            members = self.data.get(_encode(key), ())
+            part = list(itertools.islice(members, cursor, end))
+            if end >= len(members):
+                end = 0
+        return end, part
+
+    def hset(self, key, field, value):
+        field = _encode(field)
+        with self._lock:
+            fields = self.data.setdefault(_encode(key), {})
+            new = field not in fields
+            fields[field] = _encode(value)
+        return int(new)
+
+    def hincrby(self, key, field, amount=1):
+        field = _encode(field)
+        with self._lock:
+            fields = self.data.setdefault(_encode(key), {})
+            value = int(fields.get(field, 0)) + amount
+            fields[field] = value
+        return value
+
+    def hmget(self, key, fields):
+        values = self.data.get(_encode(key), {})
+        return [None if values.get(_encode(field)) is None 
+                else _encode(values[_encode(field)]) for field in fields]
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict((field, _encode(value)) for field, value 
+                        in self.data.get(_encode(key), {}).iteritems())
+
+    def hlen(self, key):
+        return len(self.data.get(_encode(key), ()))
+
+    def bitop(self, operation, dest, *keys):
+        with self._lock:
+            value = _bitop(operation, self.mget(keys))
+            self.set(dest, value)
+        return len(value)
+
+    def delete(self, *keys):
+        count = 0
+        with self._lock:
+            for key in keys:
+                if self.data.pop(_encode(key), None) is not None:
+                    count += 1
+        return count
+
+    def _execute(self, commands):
+        with self._lock:
+            return [getattr(self, name)(*args, **kwargs)
+                    for name, args, kwargs in commands]
+
+class SQLiteBackend(Backend):
+    """Backend stores data in an embedded SQLite database file, it is for
+    single node deployment
+
+    """
+
+    # max count of variables in one SQL statement
+    chunk_size = 500
+
+    def __init__(self, path, logger=None):
+        self.logger = logger
+        if self.logger is None:
+            self.logger = logging.getLogger('lexicon.backend')
+        self.path = path
+        # autocommit mode, transactions are made explicitly
+        self.conn = sqlite3.connect(path, isolation_level=None,
+                                    check_same_thread=False)
+        self.conn.text_factory = str
+        self._lock = threading.RLock()
+        self.conn.execute('CREATE TABLE IF NOT EXISTS kv '
+                          '(key BLOB PRIMARY KEY, value)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS members '
+                          '(key BLOB, member BLOB, PRIMARY KEY (key, member))')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS hashes '
+                          '(key BLOB, field BLOB, value, '
+                          'PRIMARY KEY (key, field))')
+        self.logger.info('Open SQLite backend %s', path)
+
+    def _blob(self, value):
+        return buffer(_encode(value))
+
+    def get(self, key):
+        with self._lock:
+            row = self.conn.execute('SELECT value FROM kv WHERE key = ?',
+                                    (self._blob(key),)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return _encode(row[0])
+
+    def set(self, key, value):
+        with self._lock:
+            self.conn.execute('INSERT OR REPLACE INTO kv VALUES (?, ?)',
+                              (self._blob(key), _encode(value)))
+        return True
+
+    def mget(self, keys):
+        keys = [_encode(key) for key in keys]
+        values = {}
+        with self._lock:
+            for i in xrange(0, len(keys), self.chunk_size):
+                chunk = keys[i:i+self.chunk_size]
+                sql = 'SELECT key, value FROM kv WHERE key IN (%s)' % \
+                    ','.join('?'*len(chunk))
+                for key, value in self.conn.execute(sql, map(buffer, chunk)):
+                    values[str(key)] = value
+        return [None if values.get(key) is None else _encode(values[key])
+                for key in keys]
+
+    def incr(self, key, amount=1):
+        key = self._blob(key)
+        with self._lock:
+            self.conn.execute('INSERT OR IGNORE INTO kv VALUES (?, 0)', (key,))
+            self.conn.execute('UPDATE kv SET value = CAST(value AS INTEGER) + ?'
+                              ' WHERE key = ?', (amount, key))
+            row = self.conn.execute('SELECT value FROM kv WHERE key = ?',
+                                    (key,)).fetchone()
+        return int(row[0])
+
+    def sadd(self, key, *members):
+        key = self._blob(key)
+        with self._lock:
+            cursor = self.conn.executemany(
+                'INSERT OR IGNORE INTO members VALUES (?, ?)',
+                [(key, self._blob(member)) for member in members])
+        return cursor.rowcount
+
+    def srem(self, key, *members):
+        key = self._blob(key)
+        with self._lock:
+            cursor = self.conn.executemany(
+                'DELETE FROM members WHERE key = ? AND member = ?',
+                [(key, self._blob(member)) for member in members])
+        return cursor.rowcount
+
+    def smembers(self, key):
+        with self._lock:
+            rows = self.conn.execute('SELECT member FROM members '
+                                     'WHERE key = ?', (self._blob(key),))
+            return set(str(member) for member, in rows)
+
+    def scard(self, key):
+        with self._lock:
+            row = self.conn.execute('SELECT COUNT(*) FROM members '
+                                    'WHERE key = ?', 
+                                    (self._blob(key),)).fetchone()
+        return row[0]
+
+    def sscan(self, key, cursor=0, count=None):
+        # cursor is the last returned member, members are read in order of 
+        # the primary key index
+        count = count or 10
+        with self._lock:
+            if not cursor:
+                rows = self.conn.execute(
+                    'SELECT member FROM members WHERE key = ? '
+                    'ORDER BY member LIMIT ?', (self._blob(key), count))
+            else:
+                rows = self.conn.execute(
+                    'SELECT member FROM members WHERE key = ? AND member > ? '
+                    'ORDER BY member LIMIT ?', 
+                    (self._blob(key), self._blob(cursor), count))
+            members = [str(member) for member, in rows]
+        if len(members) < count:
+            return 0, members
+        return members[-1], members
+
+    def hset(self, key, field, value):
+        key = self._blob(key)
+        field = self._blob(field)
+        with self._lock:
+            cursor = self.conn.execute('INSERT OR IGNORE INTO hashes '
+                                       'VALUES (?, ?, ?)', 
+                                       (key, field, _encode(value)))
+            if cursor.rowcount:
+                return 1
+            self.conn.execute('UPDATE hashes SET value = ? '
+                              'WHERE key = ? AND field = ?', 
+                              (_encode(value), key, field))
+        return 0
+
+    def hincrby(self, key, field, amount=1):
+        key = self._blob(key)
+        field = self._blob(field)
+        with self._lock:
+            self.conn.execute('INSERT OR IGNORE INTO hashes VALUES (?, ?, 0)', 
+                              (key, field))
+            self.conn.execute('UPDATE hashes SET value = '
+                              'CAST(value AS INTEGER) + ? '
+                              'WHERE key = ? AND field = ?', 
+                              (amount, key, field))
+            row = self.conn.execute('SELECT value FROM hashes '
+                                    'WHERE key = ? AND field = ?',
+                                    (key, field)).fetchone()
+        return int(row[0])
+
+    def hmget(self, key, fields):
+        fields = [_encode(field) for field in fields]
+        values = {}
+        with self._lock:
+            for i in xrange(0, len(fields), self.chunk_size):
+                chunk = fields[i:i+self.chunk_size]
+                sql = 'SELECT field, value FROM hashes WHERE key = ? AND ' \
+                    'field IN (%s)' % ','.join('?'*len(chunk))
+                rows = self.conn.execute(sql, [self._blob(key)] + 
+                                         map(buffer, chunk))
+                for field, value in rows:
+                    values[str(field)] = value
+        return [None if values.get(field) is None else _encode(values[field])
+                for field in fields]
+
+    def hgetall(self, key):
+        with self._lock:
+            rows = self.conn.execute('SELECT field, value FROM hashes '
+                                     'WHERE key = ?', (self._blob(key),))
+            return dict((str(field), _encode(value)) for field, value in rows)
+
+    def hlen(self, key):
+        with self._lock:
+            row = self.conn.execute('SELECT COUNT(*) FROM hashes '
+                                    'WHERE key = ?', 
+                                    (self._blob(key),)).fetchone()
+        return row[0]
+
+    def bitop(self, operation, dest, *keys):
+        with self._lock:
+            value = _bitop(operation, self.mget(keys))
+            self.set(dest, value)
+        return len(value)
+
+    def delete(self, *keys):
+        count = 0
+        with self._lock:
+            for key in keys:
+                key = self._blob(key)
+                count += self.conn.execute('DELETE FROM kv WHERE key = ?',
+                                           (key,)).rowcount
+                count += min(1, self.conn.execute(
+                    'DELETE FROM members WHERE key = ?', (key,)).rowcount)
+                count += min(1, self.conn.execute(
+                    'DELETE FROM hashes WHERE key = ?', (key,)).rowcount)
+        return count
+
+    def _execute(self, commands):
+        with self._lock:
+            self.conn.execute('BEGIN')
+            try:
+                results = [getattr(self, name)(*args, **kwargs)
+                           for name, args, kwargs in commands]
+            except:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.conn.execute('COMMIT')
+        return results
+
+def createBackend(config):
+    """Create backend from configuration, the backend type is selected by
+    "backend" in lexicon section, it can be redis, memory or sqlite. Return
+    None if the redis backend is selected without redis section
+
+    """
+    lexicon_cfg = config.get('lexicon') or {}
+    kind = lexicon_cfg.get('backend', 'redis')
+    if kind == 'redis':
+        if 'redis' not in config:
+            return None
+        import redis
+        return RedisBackend(redis.Redis(**(config.get('redis') or {})))
+    elif kind == 'memory':
+        return MemoryBackend()
+    elif kind == 'sqlite':
+        return SQLiteBackend(lexicon_cfg.get('sqlite_path', 'lexicon.db'))
+    raise ValueError('Unknown backend %r' % kind)
@@ -0,0 +1,6 @@
+# -*- coding: utf8 -*-
+"""Benchmarks of feeding, segmentation and dumping, they run offline against
+a memory or SQLite backend with a deterministic synthetic corpus, results are
+written as JSON so that runs can be compared
+
+"""
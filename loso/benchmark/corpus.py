@@ -0,0 +1,85 @@
+# -*- coding: utf8 -*-
+"""Deterministic synthetic Chinese/English mixed corpus
+
+"""
+import bisect
+import random
+
+# common CJK unified ideographs block
+_cjk_begin = 0x4e00
+_cjk_size = 3000
+
+# delimiters between sentences
+_delimiters = u'，。、；：！ \n'
+
+_english_words = [
+    u'iPhone', u'Google', u'Plurk', u'blog', u'ip', u'block', u'CPU', u'NBA',
+    u'Python', u'redis', u'3D', u'USB', u'OK', u'HTC', u'Wi-Fi', u"don't",
+]
+
+class CorpusGenerator(object):
+    """Generator of synthetic corpus. Chinese words are made of random
+    characters and picked with a Zipf-like distribution, so that frequent
+    words show up like they do in real text. The same seed always generates
+    the same corpus
+
+    """
+
+    def __init__(self, seed=0, vocabulary_size=5000, english_ratio=0.05):
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.english_ratio = english_ratio
+        self.vocabulary = []
+        for i in xrange(vocabulary_size):
+            length = self.random.choice((1, 1, 2, 2, 2, 2, 3, 3, 4))
+            word = u''.join(
+                unichr(_cjk_begin + self.random.randrange(_cjk_size))
+                for _ in xrange(length)
+            )
+            self.vocabulary.append(word)
+        # weight of i-th word is 1/(i+1)
+        self._cumulative = []
+        total = 0.0
+        for i in xrange(vocabulary_size):
+            total += 1.0/(i + 1)
+            self._cumulative.append(total)
+
+    def word(self):
+        """Get a random word
+
+        """
+        if self.random.random() < self.english_ratio:
+            return u' %s ' % self.random.choice(_english_words)
+        point = self.random.random()*self._cumulative[-1]
+        return self.vocabulary[bisect.bisect_left(self._cumulative, point)]
+
+    def sentence(self, length):
+        """Get a sentence of about length characters without delimiters
+
+        """
+        words = []
+        size = 0
+        while size < length:
+            word = self.word()
+            words.append(word)
+            size += len(word)
+        return u''.join(words)[:length].strip()
+
+    def text(self, size):
+        """Get a text of about size characters
+
+        """
+        parts = []
+        total = 0
+        while total < size:
+            sentence = self.sentence(self.random.randint(4, 30))
+            parts.append(sentence)
+            parts.append(self.random.choice(_delimiters))
+            total += len(sentence) + 1
+        return u''.join(parts)
+
+def generateCorpus(size, seed=0):
+    """Generate a text of about size characters
+
+    """
+    return CorpusGenerator(seed).text(size)
@@ -0,0 +1,273 @@
+# -*- coding: utf8 -*-
+"""Run benchmarks and write results as JSON, for example
+
+    python -m loso.benchmark.run -o result.json
+
+"""
+import os
+import sys
+import json
+import time
+import codecs
+import random
+import logging
+import optparse
+import platform
+import tempfile
+
+from loso import util
+from loso import lexicon
+from loso import service
+from loso import backends
+from loso.metrics import Metrics, InstrumentedBackend
+from loso.benchmark.corpus import CorpusGenerator
+
+def measureMemory(backend):
+    """Get bytes of memory or disk used by backend, for memory backend, it is
+    an estimation of the dict. Return None if it can't be measured
+
+    """
+    if isinstance(backend, backends.RedisBackend):
+        return backend.redis.info()['used_memory']
+    if isinstance(backend, backends.SQLiteBackend):
+        conn = backend.conn
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        pages = conn.execute('PRAGMA page_count').fetchone()[0]
+        free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        return (pages - free)*page_size
+    if isinstance(backend, backends.MemoryBackend):
+        size = sys.getsizeof(backend.data)
+        for key, value in backend.data.items():
+            size += sys.getsizeof(key) + sys.getsizeof(value)
+            if isinstance(value, set):
+                size += sum(sys.getsizeof(member) for member in value)
+            elif isinstance(value, dict):
+                size += sum(sys.getsizeof(field) + sys.getsizeof(count)
+                            for field, count in value.iteritems())
+        return size
+    return None
+
+def percentiles(values, points=(50, 90, 99)):
+    """Get percentiles of values
+
+    """
+    values = sorted(values)
+    result = {}
+    for point in points:
+        index = min(len(values) - 1, int(len(values)*point/100.0))
+        result['p%d' % point] = values[index]
+    return result
+
+class Benchmark(object):
+    """Benchmarks of lexicon database with a synthetic corpus
+
+    """
+
+    def __init__(self, backend, corpus_size=200000, seed=0, ngram=4,
+                 logger=None):
+        self.logger = logger
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+        # commands to backend are counted with metrics of their own
+        self.counter = Metrics(True)
+        self.backend = InstrumentedBackend(backend, self.counter)
+        self.corpus_size = corpus_size
+        self.seed = seed
+        self.ngram = ngram
+        self.generator = CorpusGenerator(seed)
+        config = dict(lexicon=dict(ngram=ngram))
+        self.service = service.SegumentService(config, backend=self.backend)
+        self.db = self.service.db
+
+    def benchFeed(self, category='bench'):
+        """Measure throughput of LexiconBuilder.feed
+
+        """
+        text = self.generator.text(self.corpus_size)
+        self.counter.reset()
+        begin = time.time()
+        total = self.service.builder.feed(category, text)
+        elapsed = time.time() - begin
+        round_trips, operations = self.counter.countCommands()
+        return dict(
+            chars=len(text),
+            terms=total,
+            seconds=elapsed,
+            chars_per_second=len(text)/elapsed,
+            round_trips=round_trips,
+            operations=operations
+        )
+
+    def benchSplitTerms(self, lengths=(5, 10, 20, 50, 100), count=200):
+        """Measure latency of SegumentService.splitTerms by sentence length
+
+        """
+        results = {}
+        for length in lengths:
+            sentences = [self.generator.sentence(length)
+                         for _ in xrange(count)]
+            latencies = []
+            self.counter.reset()
+            for sentence in sentences:
+                begin = time.time()
+                self.service.splitTerms(sentence)
+                latencies.append(time.time() - begin)
+            result = percentiles(latencies)
+            result['mean'] = sum(latencies)/len(latencies)
+            result['round_trips_per_call'] = \
+                self.counter.countCommands()[0]/float(count)
+            results[str(length)] = result
+        return results
+
+    def benchFindBestSegment(self, sizes=(10, 50, 100, 200, 1000),
+                             table_limit=200):
+        """Measure scaling of segmentation engines with random scores, the
+        table engine is only measured up to table_limit items because it
+        runs in cubic time
+
+        """
+        rand = random.Random(self.seed)
+        results = {}
+        for name, engine in sorted(lexicon.engines.iteritems()):
+            result = {}
+            for size in sizes:
+                if name == 'table' and size > table_limit:
+                    continue
+                text = self.generator.sentence(size)
+                grams = []
+                for n in xrange(1, self.ngram + 1):
+                    grams.append([(term, rand.random())
+                                  for term in util.ngram(n, text)])
+                begin = time.time()
+                engine(grams)
+                result[str(size)] = time.time() - begin
+            results[name] = result
+        return results
+
+    def benchDump(self, category='bench'):
+        """Measure speed of LexiconCategory.dump
+
+        """
+        c = self.db.getCategory(category)
+        fd, path = tempfile.mkstemp(suffix='.txt')
+        os.close(fd)
+        try:
+            file = codecs.open(path, 'wt', encoding='utf8')
+            self.counter.reset()
+            begin = time.time()
+            c.dump(file)
+            elapsed = time.time() - begin
+            file.close()
+            size = os.path.getsize(path)
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+        return dict(
+            seconds=elapsed,
+            terms=len(c.getTermList()),
+            bytes=size,
+            bytes_per_second=size/elapsed,
+            round_trips=self.counter.countCommands()[0]
+        )
+
+    def benchLayout(self, bucket_terms=64):
+        """Measure storage used by the key per term layout and the hash 
+        bucketed layout with the same corpus, the hash layout has about 
+        bucket_terms terms in every bucket
+
+        """
+        text = self.generator.text(self.corpus_size)
+        backend = self.backend.backend
+        results = {}
+        buckets = 0
+        for name in ('keys', 'hash'):
+            category = 'layout-' + name
+            before = measureMemory(backend)
+            c = self.db.addCategory(category, buckets)
+            self.service.builder.feed(category, text)
+            after = measureMemory(backend)
+            terms = c.getTermCount()
+            c.clean()
+            size = None
+            if before is not None and after is not None:
+                size = after - before
+            results[name] = dict(
+                buckets=buckets,
+                terms=terms,
+                bytes=size,
+                bytes_per_term=size/float(terms) if size and terms else None
+            )
+            buckets = max(1, terms // bucket_terms)
+        return results
+
+    def run(self):
+        """Run all benchmarks and return the results
+
+        """
+        results = dict(
+            meta=dict(
+                time=time.time(),
+                python=platform.python_version(),
+                platform=platform.platform(),
+                backend=self.backend.backend.__class__.__name__,
+                corpus_size=self.corpus_size,
+                seed=self.seed,
+                ngram=self.ngram
+            )
+        )
+        self.logger.info('Benchmark feed')
+        results['feed'] = self.benchFeed()
+        self.logger.info('Benchmark splitTerms')
+        results['split_terms'] = self.benchSplitTerms()
+        self.logger.info('Benchmark findBestSegment')
+        results['find_best_segment'] = self.benchFindBestSegment()
+        self.logger.info('Benchmark dump')
+        results['dump'] = self.benchDump()
+        self.logger.info('Benchmark storage layouts')
+        results['layout'] = self.benchLayout()
+        return results
+
+def createBackend(name, path=None):
+    """Create backend for benchmark by name, memory, sqlite or redis, path is
+    the SQLite file, or host:port of redis
+
+    """
+    if name == 'memory':
+        return backends.MemoryBackend()
+    elif name == 'redis':
+        import redis
+        host, _, port = (path or 'localhost').partition(':')
+        return backends.RedisBackend(redis.Redis(host, int(port or 6379)))
+    elif name == 'sqlite':
+        if path is None:
+            fd, path = tempfile.mkstemp(suffix='.db')
+            os.close(fd)
+        return backends.SQLiteBackend(path)
+    raise ValueError('Unknown backend %r' % name)
+
+def main(args=None):
+    parser = optparse.OptionParser()
+    parser.add_option('-o', '--output', help='path to JSON result file')
+    parser.add_option('-b', '--backend', default='memory',
+                      help='memory, sqlite or redis')
+    parser.add_option('-p', '--path', 
+                      help='path of SQLite database, or host:port of redis')
+    parser.add_option('-s', '--size', type='int', default=200000,
+                      help='characters of corpus to feed')
+    parser.add_option('--seed', type='int', default=0,
+                      help='seed of corpus generator')
+    options, _ = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger('lexicon').setLevel(logging.WARN)
+    backend = createBackend(options.backend, options.path)
+    results = Benchmark(backend, options.size, options.seed).run()
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'wt') as file:
+            file.write(output)
+    else:
+        print output
+
+if __name__ == '__main__':
+    main()
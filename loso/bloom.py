@@ -0,0 +1,122 @@
+# -*- coding: utf8 -*-
+"""Bloom filter of terms in a category. It tells that a term is surely not
+in the category, or that it may be in the category with a false positive
+rate, so that counts of most absent candidate terms need not be read.
+
+Bits are laid out like Redis bit strings, bit i is the (7 - i % 8)-th bit of
+byte i // 8, so that filters of the same size and hash count can be merged
+with BITOP OR.
+
+"""
+import math
+import struct
+import hashlib
+
+# two 32-bit hashes from MD5 of a term, small integers are much faster than
+# long integers in position arithmetic
+_positions = struct.Struct('<II')
+
+def _encode(term):
+    if isinstance(term, unicode):
+        return term.encode('utf8')
+    return term
+
+class BloomFilter(object):
+    """Bloom filter with size bits and hashes hash functions, positions of a
+    term are derived from MD5 of it with double hashing
+
+    """
+
+    def __init__(self, size, hashes, data=None):
+        self.size = size
+        self.hashes = hashes
+        if data is None:
+            self.bits = bytearray((size + 7) // 8)
+        else:
+            self.bits = bytearray(data)
+            # Redis strings are not longer than the highest bit set
+            if len(self.bits) < (size + 7) // 8:
+                self.bits.extend('\x00' * ((size + 7) // 8 - len(self.bits)))
+
+    @classmethod
+    def create(cls, capacity, error_rate):
+        """Create an empty filter for capacity terms with given false
+        positive rate
+
+        """
+        capacity = max(1, capacity)
+        size = int(math.ceil(-capacity * math.log(error_rate) /
+                             (math.log(2) ** 2)))
+        # round up to whole bytes
+        size = max(8, (size + 7) // 8 * 8)
+        hashes = max(1, int(round(size / float(capacity) * math.log(2))))
+        return cls(size, hashes)
+
+    def copy(self, empty=False):
+        """Get a filter of the same size and hash count, without terms if
+        empty is true
+
+        """
+        if empty:
+            return self.__class__(self.size, self.hashes)
+        return self.__class__(self.size, self.hashes, self.bits)
+
+    def _iterPositions(self, term):
+        h1, h2 = _positions.unpack_from(hashlib.md5(_encode(term)).digest())
+        size = self.size
+        for i in xrange(self.hashes):
+            yield (h1 + i * h2) % size
+
+    def add(self, term):
+        """Add a term
+
+        """
+        bits = self.bits
+        for position in self._iterPositions(term):
+            bits[position >> 3] |= 0x80 >> (position & 7)
+
+    def update(self, terms):
+        """Add terms
+
+        """
+        for term in terms:
+            self.add(term)
+
+    def __contains__(self, term):
+        # positions are computed inline, it is called for every candidate
+        h1, h2 = _positions.unpack_from(hashlib.md5(_encode(term)).digest())
+        size = self.size
+        bits = self.bits
+        for i in xrange(self.hashes):
+            position = (h1 + i * h2) % size
+            if not bits[position >> 3] & (0x80 >> (position & 7)):
+                return False
+        return True
+
+    def toString(self):
+        """Get bits as a byte string
+
+        """
+        return str(self.bits)
+
+    def countBits(self):
+        """Get count of set bits
+
+        """
+        return sum(bin(byte).count('1') for byte in self.bits)
+
+    def estimateCount(self):
+        """Estimate count of terms added from the set bits
+
+        """
+        ones = self.countBits()
+        if ones >= self.size:
+            return float('inf')
+        return -self.size / float(self.hashes) * \
+            math.log(1 - ones / float(self.size))
+
+    def estimateErrorRate(self):
+        """Estimate false positive rate from the set bits
+
+        """
+        return (self.countBits() / float(self.size)) ** self.hashes
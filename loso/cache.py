@@ -0,0 +1,122 @@
+# -*- coding: utf8 -*-
+import time
+import threading
+from collections import OrderedDict
+
+class LRUCache(object):
+    """A bounded cache with least recently used eviction, entries expire after
+    ttl seconds. If ttl is None, entries never expire. 
+    
+    The cache holds at most size entries, if max_weight is given, the total
+    weight of entries is also bounded, weight of an entry is given by 
+    weigher(key, value), for example, size of it in bytes
+
+    """
+
+    def __init__(self, size=10000, ttl=None, max_weight=None, weigher=None,
+                 timer=time.time):
+        self.size = size
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self.weigher = weigher
+        self.weight = 0
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (value, expire time, weight)
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        """Get value of a key, return default if it is not in cache or expired
+
+        """
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expire, weight = item
+            if expire is not None and expire <= self.timer():
+                self.weight -= weight
+                self.misses += 1
+                return default
+            # move to the most recently used end
+            self._items[key] = item
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Set value of a key
+
+        """
+        expire = None
+        if self.ttl is not None:
+            expire = self.timer() + self.ttl
+        weight = 0
+        if self.weigher is not None:
+            weight = self.weigher(key, value)
+        with self._lock:
+            self._pop(key)
+            self._items[key] = (value, expire, weight)
+            self.weight += weight
+            while self._items and (
+                len(self._items) > self.size or 
+                (self.max_weight is not None and 
+                 self.weight > self.max_weight)
+            ):
+                _, (_, _, evicted_weight) = self._items.popitem(last=False)
+                self.weight -= evicted_weight
+                self.evictions += 1
+                
+    def _pop(self, key):
+        """Remove a key without locking, return the removed item or None
+
+        """
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.weight -= item[2]
+        return item
+
+    def discard(self, *keys):
+        """Remove keys from cache
+
+        """
+        with self._lock:
+            for key in keys:
+                self._pop(key)
+
+    def discardIf(self, predicate):
+        """Remove all keys for which predicate(key) is true
+
+        """
+        with self._lock:
+            for key in [key for key in self._items if predicate(key)]:
+                self._pop(key)
+
+    def clear(self):
+        """Remove all keys from cache
+
+        """
+        with self._lock:
+            self._items.clear()
+            self.weight = 0
+
+    def getStats(self):
+        """Get statistics of this cache
+
+        """
+        total = self.hits + self.misses
+        return dict(
+            size=len(self._items),
+            capacity=self.size,
+            weight=self.weight,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            hit_rate=(self.hits/float(total)) if total else 0.0
+        )
@@ -0,0 +1,101 @@
+# -*- coding: utf8 -*-
+"""Client of the JSON-lines segmentation protocol, it calls methods of 
+SegumentService like xmlrpclib.ServerProxy does, for example
+
+    client = JSONLineClient('localhost', 5567)
+    terms = client.splitTerms(u'留下鉅細靡遺的太空梭發射影片')
+
+"""
+import json
+import socket
+import itertools
+import threading
+
+class RemoteError(Exception):
+    """Error raised by the server
+    
+    """
+    
+    def __init__(self, type, message):
+        Exception.__init__(self, '%s: %s' % (type, message))
+        self.type = type
+        self.message = message
+
+class JSONLineClient(object):
+    """Client keeps one connection alive to the server, it is thread-safe, but
+    calls from threads are sent one at a time
+    
+    """
+    
+    def __init__(self, host='localhost', port=5567, timeout=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._socket = None
+        self._file = None
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        
+    def _connect(self):
+        self._socket = socket.create_connection((self.host, self.port), 
+                                                self.timeout)
+        self._file = self._socket.makefile('rb')
+        
+    def close(self):
+        """Close the connection
+        
+        """
+        if self._socket is not None:
+            self._file.close()
+            self._socket.close()
+        self._socket = None
+        self._file = None
+        
+    def _request(self, data):
+        """Send a request line and return the response line, a kept alive 
+        connection closed by the server for being idle is connected again
+        once
+        
+        """
+        reused = self._socket is not None
+        if not reused:
+            self._connect()
+        try:
+            self._socket.sendall(data)
+            line = self._file.readline()
+        except socket.error:
+            self.close()
+            if reused:
+                return self._request(data)
+            raise
+        except:
+            self.close()
+            raise
+        if not line:
+            self.close()
+            if reused:
+                return self._request(data)
+            raise socket.error('Connection closed by server')
+        return line
+        
+    def call(self, method, *params):
+        """Call a method of service and return the result
+        
+        """
+        request_id = self._ids.next()
+        data = json.dumps(dict(id=request_id, method=method, params=params), 
+                          ensure_ascii=False)
+        if isinstance(data, unicode):
+            data = data.encode('utf8')
+        with self._lock:
+            line = self._request(data + '\n')
+        response = json.loads(line)
+        if response.get('error'):
+            error = response['error']
+            raise RemoteError(error.get('type'), error.get('message'))
+        return response.get('result')
+    
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return lambda *params: self.call(name, *params)
@@ -0,0 +1,219 @@
+# -*- coding: utf8 -*-
+"""Frozen lexicon is a read-only, memory-mapped file format of a category,
+it is for serving segmentation without Redis. The file is laid out as
+
+    header  -> magic "LOSOLEX1", gram (uint32), count of terms (uint32)
+    meta    -> (n-gram sum, n-gram variety) as two uint64 for n in 1..gram
+    counts  -> count of terms as uint64, ordered by term
+    offsets -> (count of terms + 1) uint64 offsets of terms in the blob
+    blob    -> UTF-8 encoded terms sorted in byte order
+
+All numbers are little-endian. Terms are looked up with binary search over
+the sorted offsets, so many processes can share one page-cached file.
+
+"""
+import mmap
+import struct
+import logging
+
+MAGIC = 'LOSOLEX1'
+
+_header = struct.Struct('<8sII')
+_meta = struct.Struct('<QQ')
+_number = struct.Struct('<Q')
+
+def iterDump(file):
+    """Read the text written by LexiconCategory.dump, return a tuple of
+    (meta dict, iterator of (term, count))
+
+    """
+    meta = {}
+    for line in file:
+        line = line.rstrip('\r\n')
+        # a blank line ends the meta data
+        if not line:
+            break
+        key, value = line.split(' ', 1)
+        meta[key] = int(value)
+
+    def iterTerms():
+        for line in file:
+            line = line.rstrip('\r\n')
+            if not line:
+                continue
+            count, term = line.split(' ', 1)
+            # term which has no count
+            if count == 'None':
+                continue
+            yield term, int(count)
+    return meta, iterTerms()
+
+def writeFrozen(file, gram, sums, varieties, terms):
+    """Write a frozen lexicon to file, sums and varieties are dicts map n to
+    n-gram sum and variety, terms is an iterable of (term, count), a term 
+    repeated by a scan is written once. Return count of terms written
+
+    """
+    items = {}
+    for term, count in terms:
+        if isinstance(term, unicode):
+            term = term.encode('utf8')
+        items[term] = count
+    items = sorted(items.iteritems())
+
+    file.write(_header.pack(MAGIC, gram, len(items)))
+    for n in xrange(1, gram + 1):
+        file.write(_meta.pack(sums.get(n, 0), varieties.get(n, 0)))
+    for _, count in items:
+        file.write(_number.pack(count))
+    offset = 0
+    for term, _ in items:
+        file.write(_number.pack(offset))
+        offset += len(term)
+    file.write(_number.pack(offset))
+    for term, _ in items:
+        file.write(term)
+    return len(items)
+
+def exportCategory(category, file):
+    """Export a live category in database to file as frozen lexicon
+
+    """
+    gram = category.gram
+    sums = {}
+    varieties = {}
+    for n in xrange(1, gram + 1):
+        sums[n] = category.getGramSum(n)
+        varieties[n] = category.getGramVariety(n)
+    items = ((term, int(count)) for term, count in category.iterTermCounts()
+             if count is not None)
+    return writeFrozen(file, gram, sums, varieties, items)
+
+def exportDump(dump_file, file):
+    """Export text written by LexiconCategory.dump to file as frozen lexicon
+
+    """
+    meta, terms = iterDump(dump_file)
+    gram = meta.get('gram', 0)
+    sums = {}
+    varieties = {}
+    for n in xrange(1, gram + 1):
+        sums[n] = meta.get('%d-gram-sum' % n, 0)
+        varieties[n] = meta.get('%d-gram-variety' % n, 0)
+    return writeFrozen(file, gram, sums, varieties, terms)
+
+class FrozenCategory(object):
+    """A read-only category backed by a memory-mapped frozen lexicon file,
+    it provides the reading methods of LexiconCategory
+
+    """
+
+    def __init__(self, name, path, logger=None):
+        self.logger = logger
+        if self.logger is None:
+            self.logger = logging.getLogger('lexicon.frozen')
+        self.name = name
+        self.path = path
+        with open(path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._gram, self._size = _header.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not a frozen lexicon file' % path)
+
+        self._metas = {}
+        position = _header.size
+        for n in xrange(1, self._gram + 1):
+            self._metas[n] = _meta.unpack_from(self._map, position)
+            position += _meta.size
+        self._counts_pos = position
+        self._offsets_pos = self._counts_pos + self._size*_number.size
+        self._blob_pos = self._offsets_pos + (self._size + 1)*_number.size
+        self.logger.info('Load frozen category %s from %s, %d terms',
+                         name, path, self._size)
+
+    def close(self):
+        self._map.close()
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def gram(self):
+        return self._gram
+
+    def _getTermBytes(self, i):
+        """Get UTF-8 bytes of i-th term
+
+        """
+        position = self._offsets_pos + i*_number.size
+        begin, = _number.unpack_from(self._map, position)
+        end, = _number.unpack_from(self._map, position + _number.size)
+        return self._map[self._blob_pos + begin:self._blob_pos + end]
+
+    def _find(self, term):
+        """Find index of term, return None if it doesn't exist
+
+        """
+        if isinstance(term, unicode):
+            term = term.encode('utf8')
+        low, high = 0, self._size
+        while low < high:
+            middle = (low + high) // 2
+            if self._getTermBytes(middle) < term:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._size and self._getTermBytes(low) == term:
+            return low
+
+    def getTerm(self, term):
+        """Get count of a term
+
+        """
+        i = self._find(term)
+        if i is None:
+            return None
+        position = self._counts_pos + i*_number.size
+        return _number.unpack_from(self._map, position)[0]
+
+    def getTerms(self, *terms):
+        """Get count of terms
+
+        """
+        return [self.getTerm(term) for term in terms]
+
+    def getTermList(self):
+        """Get all term name in this category
+
+        """
+        return [self._getTermBytes(i) for i in xrange(self._size)]
+
+    def getGramSum(self, n):
+        """Get sum of n-gram terms
+
+        """
+        return self._metas.get(n, (0, 0))[0]
+
+    def getGramVariety(self, n):
+        """Get variety of n-gram terms
+
+        """
+        return self._metas.get(n, (0, 0))[1]
+
+    def getStats(self):
+        """Get statistics of this category
+
+        """
+        stats = dict(
+            gram=self.gram,
+            total_sum=0,
+            total_variety=0
+        )
+        for n in xrange(1, self.gram + 1):
+            sum = self.getGramSum(n)
+            variety = self.getGramVariety(n)
+            stats['%sgram_sum' % n] = sum
+            stats['%sgram_variety' % n] = variety
+            stats['total_sum'] += sum
+            stats['total_variety'] += variety
+        return stats
@@ -1,25 +1,153 @@
 # -*- coding: utf8 -*-
 
 import re
+import math
+import time
+import zlib
+import uuid
 import logging
 
 from loso import util
+from loso import vectorized
+from loso.bloom import BloomFilter
+from loso.cache import LRUCache
+from loso.metrics import Metrics
+from loso.backends import Backend, RedisBackend
 
 # default delimiters for splitSentence
 default_delimiters = set(u"""\n\r\t ,.:"()[]{}。，、；：！「」『』─（）﹝﹞…﹏＿‧""")
 
 eng_term_pattern = """[a-zA-Z0-9\\-_']+"""
 
+# characters of English terms
+_eng_chars = frozenset(u'abcdefghijklmnopqrstuvwxyz'
+                       u'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+                       u"0123456789-_'")
+
+# kinds of tokens yielded by Tokenizer.iterTokens
+CHINESE = 'C'
+ENGLISH = 'E'
+DELIMITER = 'D'
+
+def _charClass(chars):
+    return ''.join(re.escape(c) for c in sorted(chars))
+
+class Tokenizer(object):
+    """Tokenizer splits text into sentences by delimiters, and sentences into
+    Chinese runs and English terms, in one pass of a regular expression 
+    compiled once. Whitespace which is not a delimiter separates terms like 
+    unicode.split does, it is not a token
+    
+    """
+    
+    def __init__(self, delimiters=None):
+        if delimiters is None:
+            delimiters = default_delimiters
+        self.delimiters = frozenset(delimiters)
+        # English characters which are delimiters end English terms
+        eng = _charClass(_eng_chars - self.delimiters)
+        other = _charClass(self.delimiters | _eng_chars)
+        if self.delimiters:
+            delimiter = _charClass(self.delimiters)
+            self._split_re = re.compile(u'[%s]' % delimiter)
+            # a delimiter, an English term, a Chinese run or a whitespace
+            token = u'([%s])|([%s]+)|([^%s\\s]+)|\\s' % (delimiter, eng, other)
+        else:
+            self._split_re = None
+            token = u'(?!)()|([%s]+)|([^%s\\s]+)|\\s' % (eng, other)
+        eng = _charClass(_eng_chars)
+        # an English term, a Chinese run or whitespaces, delimiters are not 
+        # treated specially
+        mix = u'([%s]+)|([^%s\\s]+)|\\s+' % (eng, eng)
+        # whitespace is matched like unicode.split for unicode, and like 
+        # str.split for str
+        # patterns by whether text is unicode
+        self._token_res = {
+            True: re.compile(token, re.UNICODE),
+            False: re.compile(token),
+        }
+        self._mix_res = {
+            True: re.compile(mix, re.UNICODE),
+            False: re.compile(mix),
+        }
+    
+    def iterTokens(self, text):
+        """Iterate (kind, token) of text, kind is CHINESE for a run of 
+        Chinese (and other) characters, ENGLISH for an English term, or 
+        DELIMITER for a delimiter between sentences
+        
+        """
+        pattern = self._token_res[isinstance(text, unicode)]
+        kinds = (None, DELIMITER, ENGLISH, CHINESE)
+        for match in pattern.finditer(text):
+            index = match.lastindex
+            if index is not None:
+                yield kinds[index], match.group(index)
+    
+    def splitSentence(self, text):
+        """Split text into list of sentences by delimiters
+        
+        """
+        if self._split_re is None:
+            return [text]
+        return self._split_re.split(text)
+    
+    def iterSentenceTerms(self, text, eng_prefix='E'):
+        """Iterate (sentence, mixed terms) of all sentences in text, which 
+        are the same as splitSentence and iterMixTerms of every sentence
+        
+        """
+        pattern = self._token_res[isinstance(text, unicode)]
+        begin = 0
+        terms = []
+        for match in pattern.finditer(text):
+            index = match.lastindex
+            if index is None:
+                continue
+            if index == 1:
+                yield text[begin:match.start()], terms
+                begin = match.end()
+                terms = []
+            elif index == 2:
+                terms.append(eng_prefix + match.group(2).lower())
+            else:
+                terms.append(match.group(3))
+        yield text[begin:], terms
+        
+    def mixTerms(self, text, eng_prefix='E'):
+        """Split text into list of Chinese runs and English terms with 
+        eng_prefix, delimiters are not treated specially
+        
+        """
+        pattern = self._mix_res[isinstance(text, unicode)]
+        terms = []
+        for eng, chinese in pattern.findall(text):
+            if eng:
+                terms.append(eng_prefix + eng.lower())
+            elif chinese:
+                terms.append(chinese)
+        return terms
+        
+    def englishTerms(self, text):
+        """Get list of English terms in text
+        
+        """
+        pattern = self._mix_res[isinstance(text, unicode)]
+        return [eng for eng, _ in pattern.findall(text) if eng]
+
+# tokenizer with default delimiters
+default_tokenizer = Tokenizer()
+
+def _getTokenizer(delimiters):
+    if delimiters is None:
+        return default_tokenizer
+    return Tokenizer(delimiters)
+
 def iterEnglishTerms(text):
     """Iterate English terms from Chinese text
     
     """
-    terms = []
-    parts = text.split()
-    for part in parts:
-        for term in re.finditer(eng_term_pattern, part):
-            terms.append(term.group(0))
-    return terms
+    return default_tokenizer.englishTerms(text)
 
 def iterMixTerms(text, eng_prefix='E'):
     """Iterate sentence which contains English and Chinese terms, for example
@@ -41,40 +169,20 @@ def iterMixTerms(text, eng_prefix='E'):
     The eng_prefix is the prefix which will be add to front of English terms
     
     """
-    # last position term
-    terms = []
-    parts = text.split()
-    for part in parts:
-        last = 0
-        for match in re.finditer(eng_term_pattern, part):
-            previous_term = part[last:match.start()]
-            if previous_term:
-                terms.append(previous_term)
-            if eng_prefix:
-                terms.append(eng_prefix + match.group(0).lower())
-            else:
-                terms.append(match.group(0).lower())
-            last = match.end()
-        final_term = part[last:]
-        if final_term:
-            terms.append(final_term)
-    return terms
+    return default_tokenizer.mixTerms(text, eng_prefix or '')
 
 def splitSentence(text, delimiters=None):
     """Split article into sentences by delimiters
     
     """
-    if delimiters is None:
-        delimiters = default_delimiters
+    return _getTokenizer(delimiters).splitSentence(text)
+
+def iterSentenceTerms(text, delimiters=None, eng_prefix='E'):
+    """Split article into sentences by delimiters and sentences into mixed
+    terms like iterMixTerms in one pass, iterate (sentence, mixed terms)
     
-    sentence = []
-    for c in text:
-        if c in delimiters:
-            yield ''.join(sentence)
-            sentence = []
-        else:
-            sentence.append(c)
-    yield ''.join(sentence)
+    """
+    return _getTokenizer(delimiters).iterSentenceTerms(text, eng_prefix or '')
     
 def iterTerms(n, text, emmit_head_tail=False):
     """Iterate n-gram terms in given text and return a generator. 
@@ -108,6 +216,34 @@ def iterTerms(n, text, emmit_head_tail=False):
             if emmit_head_tail:
                 yield 'E' + term
                 
+def countTerms(text, ngram, counts=None):
+    """Count 1 to n-gram terms in text, return a list of dicts, the i-th
+    dict maps (i+1)-gram terms to their count. If counts is given, terms are
+    counted into it
+    
+    """
+    if counts is None:
+        counts = [{} for n in xrange(ngram)]
+    # every sentence is split and lower cased only once, then all 1 to n-gram
+    # terms are sliced from it, this is the same as counting iterTerms(n, text)
+    # for every n
+    for sentence in splitSentence(text):
+        sentence = sentence.lower()
+        length = len(sentence)
+        for n in xrange(1, min(ngram, length)+1):
+            terms_count = counts[n-1]
+            get = terms_count.get
+            for i in xrange(length - n + 1):
+                term = sentence[i:i+n]
+                terms_count[term] = get(term, 0) + 1
+    return counts
+
+def _countTermsWorker(args):
+    """Count terms in a worker process of LexiconBuilder
+    
+    """
+    return countTerms(*args)
+
 def findBestSegment(grams, op=lambda a, b: a*b):
     """Find the best segmentation
     
@@ -160,10 +296,89 @@ def findBestSegment(grams, op=lambda a, b: a*b):
             table[current_range] = winner
     return table[(0, size-1)]
 
+def findBestPath(grams):
+    """Find the best segmentation with best-path dynamic programming, it 
+    finds a segmentation of the same score as findBestSegment, but it only 
+    looks back n items at every position, so it runs in linear time. Scores 
+    are added in log space, therefore it won't underflow on long sentences. 
+    When several segmentations score the same, it may pick another one than
+    findBestSegment. Return (terms, log score)
+    
+    """
+    # n-gram
+    n = len(grams)
+    # size of terms in unigram
+    size = len(grams[0])
+    
+    # best[i] is the log score of best solution for first i items, and 
+    # lengths[i] is the length of last term in that solution
+    best = [0.0] * (size + 1)
+    lengths = [0] * (size + 1)
+    log = math.log
+    for end in xrange(1, size + 1):
+        best_score = None
+        best_length = 0
+        for length in xrange(1, min(n, end) + 1):
+            score = best[end-length] + log(grams[length-1][end-length][1])
+            # on ties, prefer the longer last term
+            if best_score is None or score >= best_score:
+                best_score = score
+                best_length = length
+        best[end] = best_score
+        lengths[end] = best_length
+        
+    # trace back the terms from the end
+    terms = []
+    end = size
+    while end > 0:
+        length = lengths[end]
+        terms.append(grams[length-1][end-length][0])
+        end -= length
+    terms.reverse()
+    return terms, best[size]
+
+# segmentation engines can be selected by LexiconDatabase
+engines = dict(
+    viterbi=findBestPath,
+    table=findBestSegment,
+)
+# scores and best paths of all texts are computed on arrays together
+if vectorized.available:
+    engines['numpy'] = vectorized.findBestPathArray
+
+# marker of a key which is not in cache
+_missing = object()
+
+# score of a term which is not in lexicon
+_smoothing = 0.00000001
+
+def _normalizeFactor(sum, variety):
+    """Get normalize factor of n-gram terms with n-gram sum and variety, 
+    score of a term is its count divided by the factor
+    
+    """
+    sum = int(sum or 0)
+    variety = int(variety or 0)
+    if not variety:
+        return 1
+    v = sum/float(variety)
+    return v*v
+
 class LexiconCategory(object):
     
     progress_interval = 10000
     
+    # how many terms to scan and read in one round trip when iterating all 
+    # terms
+    scan_size = 1000
+    
+    # how many terms to write in one pipelined batch when loading a dump
+    load_batch_size = 10000
+    
+    # approximate count of terms in a hash bucket, for reading about 
+    # scan_size terms of buckets in one round trip
+    bucket_terms = 100
+    
     def __init__(self, db, name, logger=None):
         self.logger = logger
         if self.logger is None:
@@ -174,58 +389,433 @@ class LexiconCategory(object):
         assert ':' not in self.name, """ ":" can't be part of category name"""
         
         # prefix of this category
-        self.prefix = db.prefix + self.name + ':'
+        self._setPrefix(db.prefix + self.name + ':')
+        # count of hash buckets, 0 for the key per term layout
+        self._buckets = None
+        # bloom filter of terms, None for no filter, _missing for not loaded
+        self._bloom = _missing
+        # (generation, buckets) of score table, None for not loaded
+        self._score_table = None
+    
+    def _setPrefix(self, prefix):
+        self.prefix = prefix
         self._meta_prefix = self.prefix + 'meta:'
         self._lexicon_prefix = self.prefix + 'lex:'
         self._terms_key = self.prefix + 'terms'
+        self._hash_prefix = self.prefix + 'hlex:'
+        self._bloom_key = self.prefix + 'bloom'
+        self._score_prefix = self.prefix + 'score:'
+        self._version_key = self._meta_prefix + 'version'
+        self._layout_version_key = self._meta_prefix + 'layout-version'
        
-    def init(self, ngram=4):
-        """Initialize category in database
+    def init(self, ngram=4, buckets=0, bloom_error_rate=None):
+        """Initialize category in database, if buckets is not 0, counts of 
+        terms are stored in that many hash buckets. If bloom_error_rate is not
+        0, a bloom filter of terms with that false positive rate is created, 
+        default to the one of database
         
         """
         # add to category set
-        if not self.db.redis.sadd(self.db._category_set_key, self.name):
+        if not self.db.backend.sadd(self.db._category_set_key, self.name):
             # already exists
             self.logger.info('Category %s already exists', self.name)
             return
         self.setMeta('gram', ngram)
+        if buckets:
+            self.setMeta('buckets', buckets)
+        self._buckets = buckets
+        if bloom_error_rate is None:
+            bloom_error_rate = self.db.bloom_error_rate
+        if bloom_error_rate:
+            self._writeBloom(BloomFilter.create(self.db.bloom_capacity, 
+                                                bloom_error_rate))
         for n in xrange(ngram):
             self.increaseGramSum(n, 0)
             self.increaseGramVariety(n, 0)
-        self.logger.info('Add category %s (gram=%s)', self.name, ngram)
+        self.db._bumpVersion(self.name)
+        self.logger.info('Add category %s (gram=%s, buckets=%s)', self.name, 
+                         ngram, buckets)
+    
+    @property
+    def buckets(self):
+        """Count of hash buckets terms are stored in, 0 for the key per term
+        layout
+        
+        """
+        if self._buckets is None:
+            # read directly, a cached value may be older than the registry
+            self._buckets = int(self.db.backend.get(self._meta_prefix + 
+                                                    'buckets') or 0)
+        return self._buckets
+    
+    def _bucketKey(self, buckets, index):
+        """Get key of a hash bucket in the layout of given count of buckets,
+        layouts of different counts don't share keys, so that migrating 
+        between them won't delete the new buckets
+        
+        """
+        return '%s%d:%d' % (self._hash_prefix, buckets, index)
+    
+    @property
+    def bloom(self):
+        """Bloom filter of terms in this category, None if there is no filter
+        
+        """
+        if self._bloom is _missing:
+            self._bloom = self._readBloom()
+        return self._bloom
+    
+    def _readBloom(self):
+        """Read bloom filter from backend, values are read directly, so that 
+        the filter won't flood the cache
+        
+        """
+        size, hashes, data = self.db.backend.mget([
+            self._meta_prefix + 'bloom-size', 
+            self._meta_prefix + 'bloom-hashes', 
+            self._bloom_key
+        ])
+        if not size:
+            return None
+        return BloomFilter(int(size), int(hashes), data)
+    
+    def _writeBloom(self, bloom):
+        """Replace bloom filter in backend with bloom
         
-    def clean(self):
-        """Clean all value of this category
+        """
+        pipe = self.db.backend.pipeline(transaction=False)
+        pipe.set(self._meta_prefix + 'bloom-size', bloom.size)
+        pipe.set(self._meta_prefix + 'bloom-hashes', bloom.hashes)
+        pipe.set(self._bloom_key, bloom.toString())
+        pipe.execute()
+        self._bloom = _missing
+    
+    def _mergeBloom(self, part):
+        """Add terms in bloom filter part, which is a copy of the filter of
+        this category, to the filter in backend with BITOP OR, so that
+        concurrent writers don't overwrite terms of each other
         
         """
-        # remove terms
-        terms = self.getTermList()
-        keys = [self._lexicon_prefix + term for term in terms]
-        self.db.redis.delete(*keys)
+        temp_key = '%s:%s' % (self._bloom_key, uuid.uuid4().hex)
+        pipe = self.db.backend.pipeline(transaction=False)
+        pipe.set(temp_key, part.toString())
+        pipe.bitop('OR', self._bloom_key, self._bloom_key, temp_key)
+        pipe.delete(temp_key)
+        pipe.execute()
+        self._bloom = _missing
+        self.db._bumpVersion(self.name)
+    
+    def addBloomTerms(self, terms):
+        """Add terms to bloom filter of this category if there is one. Terms 
+        increased by increaseTerms must be added, otherwise they are taken as
+        absent when splitting terms
         
-        # remove meta keys
-        for n in self.gram:
-            self.db.redis.delete(self._meta_prefix + ('%s-gram-sum' % n))
-            self.db.redis.delete(self._meta_prefix + ('%s-gram-variety' % n))
-        self.db.redis.delete(self._meta_prefix + 'gram')
+        """
+        bloom = self.bloom
+        if bloom is None:
+            return
+        # only terms not in the filter yet are uploaded, feeding known terms
+        # changes nothing and doesn't bump version
+        new_terms = [term for term in terms if term not in bloom]
+        if not new_terms:
+            return
+        part = bloom.copy(empty=True)
+        part.update(new_terms)
+        self._mergeBloom(part)
+    
+    def rebuildBloom(self, error_rate, capacity=None, scan_size=None):
+        """Build bloom filter from all terms in this category with given false
+        positive rate and capacity of terms, default to twice of current 
+        terms. If error_rate is 0, the filter is removed. The category should
+        not be fed during rebuilding. Return count of terms
+        
+        """
+        if not error_rate:
+            self.db.backend.unlink(self._meta_prefix + 'bloom-size', 
+                                   self._meta_prefix + 'bloom-hashes', 
+                                   self._bloom_key)
+            self._bloom = _missing
+            self.db._bumpVersion(self.name)
+            self.logger.info('Removed bloom filter of category %r', self.name)
+            return 0
+        whole = self.getTermCount()
+        if capacity is None:
+            capacity = whole * 2
+        bloom = BloomFilter.create(capacity, error_rate)
+        self.logger.info('Building bloom filter of category %r, %d terms, '
+                         '%d bits, %d hashes', self.name, whole, bloom.size, 
+                         bloom.hashes)
+        i = 0
+        for i, (term, _) in enumerate(self.iterTermCounts(scan_size), 1):
+            bloom.add(term)
+            if i % self.progress_interval == 0:
+                per = (i/float(whole))*100.0 if whole else 100.0
+                self.logger.info('Progress %d/%d (%02d%%)', i, whole, per)
+        self._writeBloom(bloom)
+        self.db._bumpVersion(self.name)
+        self.logger.info('Built bloom filter of category %r, %d terms, '
+                         'estimated false positive rate %.4f', self.name, i, 
+                         bloom.estimateErrorRate())
+        return i
+    
+    @property
+    def scoreTable(self):
+        """Tuple of (generation, buckets) of score table written by finalize,
+        generation is 0 if the category is not finalized. The table is in the
+        layout of counts when it was written
+        
+        """
+        if self._score_table is None:
+            generation, buckets = self.db.backend.mget([
+                self._meta_prefix + 'score-generation', 
+                self._meta_prefix + 'score-buckets'
+            ])
+            self._score_table = (int(generation or 0), int(buckets or 0))
+        return self._score_table
+    
+    def _scoreItem(self, term, generation, buckets):
+        """Get where score of a term is stored in score table of a 
+        generation, like _termItem
+        
+        """
+        prefix = '%s%d:' % (self._score_prefix, generation)
+        if not buckets:
+            return prefix + term
+        data = term.encode('utf8') if isinstance(term, unicode) else term
+        index = (zlib.crc32(data) & 0xffffffff) % buckets
+        return (prefix + str(index), term)
+    
+    def _deleteScores(self, generation, buckets, scan_size=None, throttle=0):
+        """Delete score table of a generation part by part, sleep throttle 
+        seconds between parts. Terms are never removed from the category 
+        before clean, so the terms set has all terms of the table
+        
+        """
+        if scan_size is None:
+            scan_size = self.scan_size
+        prefix = '%s%d:' % (self._score_prefix, generation)
+        if buckets:
+            step = max(1, scan_size // self.bucket_terms)
+            parts = ([prefix + str(index) for index 
+                      in xrange(begin, min(begin + step, buckets))]
+                     for begin in xrange(0, buckets, step))
+        else:
+            parts = self._iterScoreKeyParts(prefix, scan_size)
+        for keys in parts:
+            self.db.backend.unlink(*keys)
+            if throttle:
+                time.sleep(throttle)
+    
+    def _iterScoreKeyParts(self, prefix, scan_size):
+        """Iterate lists of scan_size keys of score table in the key per term
+        layout, terms are read in the current layout of counts
+        
+        """
+        keys = []
+        for term, _ in self.iterTermCounts(scan_size):
+            keys.append(prefix + term)
+            if len(keys) >= scan_size:
+                yield keys
+                keys = []
+        if keys:
+            yield keys
+    
+    def finalize(self, scan_size=None, throttle=0):
+        """Write normalized score of every term to a new generation of score
+        table and delete the previous one, return count of terms. Scores 
+        don't change with feeding until the category is finalized again
+        
+        """
+        if scan_size is None:
+            scan_size = self.scan_size
+        backend = self.db.backend
+        old_generation, old_buckets = backend.mget([
+            self._meta_prefix + 'score-generation', 
+            self._meta_prefix + 'score-buckets'
+        ])
+        generation = backend.incr(self._meta_prefix + 'score-generations')
+        whole = self.getTermCount()
+        buckets = self.buckets
+        self.logger.info('Finalizing category %r, generation %d, %d terms', 
+                         self.name, generation, whole)
+        
+        factors = dict(
+            (n, _normalizeFactor(self.getGramSum(n), self.getGramVariety(n)))
+            for n in xrange(1, self.gram + 1)
+        )
+        i = 0
+        pipe = backend.pipeline(transaction=False)
+        for i, (term, count) in enumerate(self.iterTermCounts(scan_size), 1):
+            if count is not None:
+                item = self._scoreItem(term, generation, buckets)
+                score = int(count)/factors.get(len(term.decode('utf8')), 1)
+                if buckets:
+                    pipe.hset(item[0], item[1], repr(score))
+                else:
+                    pipe.set(item, repr(score))
+            if i % scan_size:
+                continue
+            pipe.execute()
+            if i % self.progress_interval < scan_size:
+                per = (i/float(whole))*100.0 if whole else 100.0
+                self.logger.info('Progress %d/%d (%02d%%)', i, whole, per)
+            if throttle:
+                time.sleep(throttle)
+        pipe.set(self._meta_prefix + 'score-generation', generation)
+        pipe.set(self._meta_prefix + 'score-buckets', buckets)
+        pipe.execute()
+        self._score_table = None
+        self.db._bumpVersion(self.name)
+        
+        if old_generation:
+            self._deleteScores(int(old_generation), int(old_buckets or 0), 
+                               scan_size, throttle)
+        self.logger.info('Finalized %d terms of category %r, generation %d', 
+                         i, self.name, generation)
+        return i
+    
+    def _termItem(self, term, buckets=None):
+        """Get where count of a term is stored, a key in the key per term 
+        layout, or a (hash key, field) in the hash bucketed layout
+        
+        """
+        if buckets is None:
+            buckets = self.buckets
+        if not buckets:
+            return self._lexicon_prefix + term
+        data = term.encode('utf8') if isinstance(term, unicode) else term
+        index = (zlib.crc32(data) & 0xffffffff) % buckets
+        return (self._bucketKey(buckets, index), term)
+    
+    def _queueIncrease(self, pipe, term, delta, buckets):
+        """Queue increasing count of a term to pipeline, return item of term
+        
+        """
+        item = self._termItem(term, buckets)
+        if buckets:
+            pipe.hincrby(item[0], item[1], delta)
+        else:
+            pipe.incr(item, delta)
+            pipe.sadd(self._terms_key, term)
+        return item
+    
+    def _queueSet(self, pipe, term, value, buckets):
+        """Queue setting value of a term in given layout to pipeline, return 
+        where it is stored
+        
+        """
+        item = self._termItem(term, buckets)
+        if buckets:
+            pipe.hset(item[0], item[1], value)
+        else:
+            pipe.set(item, value)
+            pipe.sadd(self._terms_key, term)
+        return item
+        
+    def clean(self, scan_size=None, throttle=0):
+        """Clean all value of this category. Terms are scanned part by part, 
+        and keys of every scan_size terms are deleted with one UNLINK (or DEL
+        if the backend doesn't support it), sleep throttle seconds between 
+        parts to give way to other clients. Return count of deleted terms
+        
+        """
+        self.logger.info('Cleaning category %r', self.name)
+        # scores are deleted before terms they are found with
+        generation, buckets = self.scoreTable
+        if generation:
+            self._deleteScores(generation, buckets, scan_size, throttle)
+        i = self._deleteTerms(self.buckets, scan_size, throttle)
+        
+        # remove meta keys, init creates them from 0-gram
+        backend = self.db.backend
+        keys = [self._meta_prefix + 'gram', self._meta_prefix + 'buckets',
+                self._meta_prefix + 'bloom-size', 
+                self._meta_prefix + 'bloom-hashes', self._bloom_key,
+                self._meta_prefix + 'score-generation',
+                self._meta_prefix + 'score-buckets',
+                self._meta_prefix + 'score-generations', self._version_key,
+                self._layout_version_key]
+        for n in xrange(self.gram + 1):
+            keys.append(self._meta_prefix + ('%s-gram-sum' % n))
+            keys.append(self._meta_prefix + ('%s-gram-variety' % n))
+        backend.unlink(*keys)
         
         # remove this category from category set
-        self.db.redis.srem(self.db._category_set_key, self.name)
+        backend.srem(self.db._category_set_key, self.name)
+        self.db._discardPrefix(self.prefix)
         
+        self._buckets = None
+        self._bloom = _missing
+        self._score_table = None
+        self.db._invalidateMerged(self.name)
+        # the deleted version differs from any version read before
+        self.db._bumpVersion()
         self.logger.info('Clean category %r, %d terms are deleted', 
-                         self.name, len(terms))
+                         self.name, i)
+        return i
+    
+    def _deleteTerms(self, buckets, scan_size=None, throttle=0):
+        """Delete counts of all terms stored in given layout part by part, 
+        sleep throttle seconds between parts. Return count of deleted terms
+        
+        """
+        if scan_size is None:
+            scan_size = self.scan_size
+        backend = self.db.backend
+        terms = self._countTerms(buckets)
+        
+        if buckets:
+            whole = buckets
+            step = max(1, scan_size // self.bucket_terms)
+            parts = ([self._bucketKey(buckets, index) for index 
+                      in xrange(begin, min(begin + step, buckets))]
+                     for begin in xrange(0, buckets, step))
+        else:
+            whole = terms + 1
+            parts = self._iterTermKeyParts(scan_size)
+        
+        deleted = 0
+        for keys in parts:
+            backend.unlink(*keys)
+            if (deleted + len(keys)) // self.progress_interval != \
+                    deleted // self.progress_interval:
+                per = ((deleted + len(keys))/float(whole))*100.0
+                self.logger.info('Progress %d/%d keys (%02d%%)', 
+                                 deleted + len(keys), whole, per)
+            deleted += len(keys)
+            if throttle:
+                time.sleep(throttle)
+        return terms
+    
+    def _iterTermKeyParts(self, scan_size):
+        """Iterate lists of scan_size keys of the key per term layout, the 
+        terms set is in the last list. The terms set must not be modified 
+        during the iteration, so that every term is returned
+        
+        """
+        keys = []
+        for term in self.db.backend.sscan_iter(self._terms_key, 
+                                               count=scan_size):
+            keys.append(self._lexicon_prefix + term)
+            if len(keys) >= scan_size:
+                yield keys
+                keys = []
+        keys.append(self._terms_key)
+        yield keys
         
     def getMeta(self, key):
         """Get value of a meta data
         
         """
-        return self.db.redis.get(self._meta_prefix + key)
+        return self.db._get(self._meta_prefix + key)
     
     def setMeta(self, key, value):
         """Set value of a meta data
         
         """
-        return self.db.redis.set(self._meta_prefix + key, value)
+        result = self.db.backend.set(self._meta_prefix + key, value)
+        self.db._discard(self._meta_prefix + key)
+        return result
     
     @property
     def gram(self):
@@ -235,45 +825,154 @@ class LexiconCategory(object):
         """Increase value of a term
         
         """
-        # increase number
-        key = self._lexicon_prefix + term
-        self.db.redis.incr(key, delta)
-        # add to terms set
-        self.db.redis.sadd(self._terms_key, term)
+        item = self._termItem(term)
+        if self.buckets:
+            self.db.backend.hincrby(item[0], item[1], delta)
+        else:
+            # increase number
+            self.db.backend.incr(item, delta)
+            # add to terms set
+            self.db.backend.sadd(self._terms_key, term)
+        self.db._discard(item)
+        self.addBloomTerms([term])
+        
+    def increaseTerms(self, terms, gram_sums=None, gram_varieties=None):
+        """Increase values of many terms in one pipelined round trip, terms 
+        is a list of (term, delta) pairs. The gram_sums and gram_varieties are
+        dicts map n to delta of n-gram sum and variety, they are sent in the
+        same batch. Return the result of pipeline execution. New terms should
+        be added to the bloom filter with addBloomTerms after
+        
+        """
+        return self._writeTerms(terms, gram_sums, gram_varieties)
+    
+    def _writeTerms(self, terms, gram_sums=None, gram_varieties=None, 
+                    queue=None):
+        """Write (term, value) pairs with queue, _queueIncrease by default, 
+        and increase meta data like increaseTerms does
+        
+        """
+        if queue is None:
+            queue = self._queueIncrease
+        keys = []
+        buckets = self.buckets
+        pipe = self.db.backend.pipeline(transaction=False)
+        for term, value in terms:
+            keys.append(queue(pipe, term, value, buckets))
+        for n, value in (gram_sums or {}).iteritems():
+            key = self._meta_prefix + ('%s-gram-sum' % n)
+            keys.append(key)
+            pipe.incr(key, value)
+        for n, value in (gram_varieties or {}).iteritems():
+            key = self._meta_prefix + ('%s-gram-variety' % n)
+            keys.append(key)
+            pipe.incr(key, value)
+        result = pipe.execute()
+        # discarded after writing, a value read by other thread before that
+        # would be cached again until it expires
+        self.db._discard(*keys)
+        return result
         
     def getTerm(self, term):
         """Get count of a term
         
         """
-        key = self._lexicon_prefix + term
-        return self.db.redis.get(key)
+        return self.db._get(self._termItem(term))
     
     def getTerms(self, *terms):
         """Get count of terms
         
         """
-        keys = [self._lexicon_prefix + term for term in terms]
-        return self.db.redis.mget(keys)
+        buckets = self.buckets
+        return self.db._mget([self._termItem(term, buckets) 
+                              for term in terms])
     
     def getTermList(self):
         """Get all term name in this category
         
         """
-        return self.db.redis.smembers(self._terms_key)
+        if self.buckets:
+            return set(term for term, _ in self.iterTermCounts())
+        return self.db.backend.smembers(self._terms_key)
+    
+    def getTermCount(self):
+        """Get count of distinct terms in this category
+        
+        """
+        return self._countTerms(self.buckets)
+    
+    def _countTerms(self, buckets):
+        """Get count of terms stored in given layout
+        
+        """
+        backend = self.db.backend
+        if not buckets:
+            return backend.scard(self._terms_key)
+        count = 0
+        for begin in xrange(0, buckets, self.scan_size):
+            pipe = backend.pipeline(transaction=False)
+            for index in xrange(begin, min(begin + self.scan_size, buckets)):
+                pipe.hlen(self._bucketKey(buckets, index))
+            count += sum(pipe.execute())
+        return count
+    
+    def iterTermCounts(self, scan_size=None):
+        """Iterate (term, count) of all terms in this category. Terms are 
+        scanned part by part, and counts of every scan_size terms are read in
+        one round trip. A term may be returned more than once if the 
+        category is fed during the scan
+        
+        """
+        return self._iterTermCounts(self.buckets, scan_size)
+    
+    def _iterTermCounts(self, buckets, scan_size=None):
+        """Iterate (term, count) of all terms stored in given layout
+        
+        """
+        if scan_size is None:
+            scan_size = self.scan_size
+        backend = self.db.backend
+        if buckets:
+            step = max(1, scan_size // self.bucket_terms)
+            for begin in xrange(0, buckets, step):
+                pipe = backend.pipeline(transaction=False)
+                for index in xrange(begin, min(begin + step, buckets)):
+                    pipe.hgetall(self._bucketKey(buckets, index))
+                for fields in pipe.execute():
+                    for item in fields.iteritems():
+                        yield item
+            return
+        terms = []
+        for term in backend.sscan_iter(self._terms_key, count=scan_size):
+            terms.append(term)
+            if len(terms) < scan_size:
+                continue
+            keys = [self._lexicon_prefix + term for term in terms]
+            for item in zip(terms, backend.mget(keys)):
+                yield item
+            terms = []
+        if terms:
+            keys = [self._lexicon_prefix + term for term in terms]
+            for item in zip(terms, backend.mget(keys)):
+                yield item
     
     def increaseGramSum(self, n, value):
         """Increase sum of n-gram terms
         
         """
         key = self._meta_prefix + ('%s-gram-sum' % n)
-        return self.db.redis.incr(key, value)
+        result = self.db.backend.incr(key, value)
+        self.db._discard(key)
+        return result
     
     def increaseGramVariety(self, n, value):
         """Increase variety of n-gram terms
         
         """
         key = self._meta_prefix + ('%s-gram-variety' % n)
-        return self.db.redis.incr(key, value)
+        result = self.db.backend.incr(key, value)
+        self.db._discard(key)
+        return result
     
     def getGramSum(self, n):
         """Get sum of n-gram terms
@@ -310,6 +1009,11 @@ class LexiconCategory(object):
         return stats
      
     def dump(self, file):
+        """Write meta data and counts of terms to file, return count of 
+        written terms. The category should not be fed while dumping, 
+        otherwise a term may be written more than once
+        
+        """
         self.logger.info('Dumping meta-data ...')
         print >>file, 'gram', self.gram
         for n in xrange(1, self.gram + 1):
@@ -325,26 +1029,264 @@ class LexiconCategory(object):
         # a blank line
         print >>file
         
-        self.logger.info('Dumping lexicons terms ...')
-        terms = self.getTermList()
-        self.logger.info('Get %d terms', len(terms))
-        self.logger.info('Dumping lexicons values ...')
-        values = self.getTerms(*terms)
-        self.logger.info('Get %d values', len(terms))
-        for i, (term, count) in enumerate(zip(terms, values)):
-            term = term.decode('utf8')
-            print >>file, count, term
+        whole = self.getTermCount()
+        self.logger.info('Dumping %d lexicons terms ...', whole)
+        i = 0
+        for i, (term, count) in enumerate(self.iterTermCounts(), 1):
+            file.write(u'%s %s\n' % (count, term.decode('utf8')))
             if i % self.progress_interval == 0:
-                if i % self.progress_interval == 0:
-                    whole = len(terms)
-                    per = (i/float(whole))*100.0
-                    self.logger.info('Progress %d/%d (%02d%%)', i, whole, per)
+                per = (i/float(whole))*100.0 if whole else 100.0
+                self.logger.info('Progress %d/%d (%02d%%)', i, whole, per)
+        self.logger.info('Dumped %d terms', i)
+        return i
+    
+    def load(self, file, mode='merge', batch_size=None):
+        """Load text written by dump into this category and return count of
+        terms loaded. In merge mode, counts and meta data are added to the
+        existing ones, in replace mode, the category is cleaned first and 
+        counts are set, so that a term written twice by dump is loaded once.
+        Terms are written in pipelined batches of batch_size terms. Scores of
+        a finalized category don't change until it is finalized again
+        
+        """
+        from loso.frozen import iterDump
+        if mode not in ('merge', 'replace'):
+            raise ValueError('Unknown load mode %r' % mode)
+        if batch_size is None:
+            batch_size = self.load_batch_size
+        meta, terms = iterDump(file)
+        gram = meta.get('gram', self.db.ngram)
+        # keep layout of existing category, new one takes that of database
+        buckets = self.db.buckets
+        if self.name in self.db._checkCategories([self.name]):
+            buckets = self.buckets
+        queue = self._queueIncrease
+        if mode == 'replace':
+            self.clean()
+            queue = self._queueSet
+        self.init(gram, buckets)
+        if self.gram < gram:
+            self.setMeta('gram', gram)
+        
+        self.logger.info('Loading lexicons terms in %s mode ...', mode)
+        # terms to add to bloom filter
+        bloom = self.bloom
+        part = None
+        if bloom is not None:
+            part = bloom.copy(empty=True)
+        i = 0
+        new_terms = 0
+        batch = []
+        for i, item in enumerate(terms, 1):
+            batch.append(item)
+            if part is not None and item[0] not in bloom:
+                part.add(item[0])
+                new_terms += 1
+            if len(batch) < batch_size:
+                continue
+            self._writeTerms(batch, queue=queue)
+            batch = []
+            if i % self.progress_interval < batch_size:
+                self.logger.info('Progress %d terms', i)
+        # meta data goes with the last batch
+        sums = {}
+        varieties = {}
+        for n in xrange(1, gram + 1):
+            sums[n] = meta.get('%d-gram-sum' % n, 0)
+            varieties[n] = meta.get('%d-gram-variety' % n, 0)
+        self._writeTerms(batch, sums, varieties, queue)
+        if new_terms:
+            self._mergeBloom(part)
+        self.db._invalidateMerged(self.name)
+        self.db._bumpCountsVersion(self.name)
+        self.logger.info('Loaded %d terms', i)
+        return i
+    
+    def migrate(self, buckets, scan_size=None, throttle=0):
+        """Move counts of terms to the layout with given count of hash 
+        buckets, 0 for the key per term layout, and return count of moved 
+        terms. The category should not be fed during migration
+        
+        """
+        if scan_size is None:
+            scan_size = self.scan_size
+        old_buckets = self.buckets
+        if buckets == old_buckets:
+            self.logger.info('Category %r is already in %d buckets', 
+                             self.name, buckets)
+            return 0
+        self.logger.info('Migrating category %r from %d to %d buckets', 
+                         self.name, old_buckets, buckets)
+        whole = self._countTerms(old_buckets)
+        i = 0
+        pipe = self.db.backend.pipeline(transaction=False)
+        terms = self._iterTermCounts(old_buckets, scan_size)
+        for i, (term, count) in enumerate(terms, 1):
+            # counts are set rather than increased, so that migrating again
+            # after a failure, or a term scanned twice, won't add them twice
+            if count is not None:
+                self._queueSet(pipe, term, int(count), buckets)
+            if i % scan_size:
+                continue
+            pipe.execute()
+            if i % self.progress_interval < scan_size:
+                per = (i/float(whole))*100.0 if whole else 100.0
+                self.logger.info('Progress %d/%d (%02d%%)', i, whole, per)
+            if throttle:
+                time.sleep(throttle)
+        pipe.execute()
+        
+        if buckets:
+            self.setMeta('buckets', buckets)
+        else:
+            self.db.backend.unlink(self._meta_prefix + 'buckets')
+        self._buckets = buckets
+        self.db._bumpVersion(self.name)
+        self._deleteTerms(old_buckets, scan_size, throttle)
+        self.db._discardPrefix(self.prefix)
+        self.logger.info('Migrated %d terms of category %r', i, self.name)
+        return i
+        
+class MergedCategory(LexiconCategory):
+    """A materialized view over several categories, it stores the score of 
+    every term, which is sum of normalized counts in the categories, so that
+    splitting terms with all of them reads one value per term like with one
+    category. It is built on demand by LexiconDatabase.mergeCategories, and 
+    it is not used after any of the categories is fed or cleaned until it is
+    built again
+    
+    """
+    
+    def __init__(self, db, names, logger=None):
+        self.names = tuple(sorted(names))
+        for name in self.names:
+            assert ',' not in name, """ "," can't be part of merged name"""
+        LexiconCategory.__init__(self, db, ','.join(self.names), logger)
+        self._setPrefix(db.prefix + 'merged:' + self.name + ':')
+        # the view is only used when this key exists
+        self._ready_key = self._meta_prefix + 'ready'
+        
+    def _queueScore(self, pipe, term, score, buckets):
+        """Queue setting score of a term to pipeline
+        
+        """
+        self._queueSet(pipe, term, repr(score), buckets)
+        
+    def build(self, scan_size=None):
+        """Build the view from its categories, return count of terms. Terms
+        are read and written part by part, a term is written with the first
+        category it is in
+        
+        """
+        if scan_size is None:
+            scan_size = self.scan_size
+        db = self.db
+        backend = db.backend
+        categories = []
+        for name in self.names:
+            c = db.getCategory(name)
+            if type(c) is not LexiconCategory:
+                raise ValueError('Category %s is not in database' % name)
+            categories.append(c)
+        self.logger.info('Building merged category %r', self.name)
+        
+        # drop the old view
+        self.invalidate()
+        self._deleteTerms(self.buckets, scan_size)
+        buckets = self._buckets = db.buckets
+        if buckets:
+            self.setMeta('buckets', buckets)
+        else:
+            backend.unlink(self._meta_prefix + 'buckets')
+        
+        factors = []
+        for c in categories:
+            factors.append(dict(
+                (n, _normalizeFactor(c.getGramSum(n), c.getGramVariety(n)))
+                for n in xrange(1, db.ngram + 1)
+            ))
+        
+        def write(index, terms):
+            # counts of the terms in all categories
+            items = [[c._termItem(term, c.buckets) for term in terms] 
+                     for c in categories]
+            fetched = db._fetch(set(sum(items, [])))
+            counts = [[int(fetched[item] or 0) for item in c_items]
+                      for c_items in items]
+            written = 0
+            pipe = backend.pipeline(transaction=False)
+            for i, term in enumerate(terms):
+                # written with a previous category
+                if any(counts[j][i] for j in xrange(index)):
+                    continue
+                score = _smoothing
+                for c_counts, c_factors in zip(counts, factors):
+                    score += c_counts[i]/c_factors.get(len(term), 1)
+                self._queueScore(pipe, term, score, buckets)
+                written += 1
+            pipe.execute()
+            return written
+        
+        total = 0
+        for index, c in enumerate(categories):
+            terms = []
+            for term, _ in c.iterTermCounts(scan_size):
+                terms.append(term.decode('utf8'))
+                if len(terms) >= scan_size:
+                    total += write(index, terms)
+                    terms = []
+            total += write(index, terms)
+            self.logger.info('Merged category %r, %d terms', c.name, total)
+        
+        backend.set(self._ready_key, 1)
+        backend.sadd(db._merged_set_key, self.name)
+        db._bumpVersion()
+        self.logger.info('Built merged category %r, %d terms', self.name, 
+                         total)
+        return total
+    
+    def invalidate(self):
+        """Stop using this view until it is built again
+        
+        """
+        self.db.backend.unlink(self._ready_key)
+        self.db._discard(self._ready_key)
+    
+    def clean(self, scan_size=None, throttle=0):
+        """Delete this view
+        
+        """
+        self.invalidate()
+        i = self._deleteTerms(self.buckets, scan_size, throttle)
+        self.db.backend.unlink(self._meta_prefix + 'buckets')
+        self.db.backend.srem(self.db._merged_set_key, self.name)
+        self.db._discardPrefix(self.prefix)
+        self.db._bumpVersion()
+        self._buckets = None
+        self.logger.info('Clean merged category %r, %d terms are deleted', 
+                         self.name, i)
+        return i
+    
+    def getScores(self, terms):
+        """Get scores of terms as a dict, return None if the view is not 
+        ready
+        
+        """
+        buckets = self.buckets
+        keys = [self._ready_key]
+        keys.extend(self._termItem(term, buckets) for term in terms)
+        values = self.db._mget(keys)
+        if values[0] is None:
+            return None
+        return dict((term, _smoothing if value is None else float(value))
+                    for term, value in zip(terms, values[1:]))
         
 class LexiconDatabase(object):
     """Lexicon database is for storing lexicon counting information
     
     The scheme of database is simple, following are the key value pairs
     we will use in the Redis database. We assume the prefix of is "loso:" here.
+    Other backends in loso.backends store the same keys.
     
     First of all, we need to distinguish lexicon into different categories.
     Therefore we need a category attached with lexicons. Thus, we use following
@@ -365,33 +1307,373 @@ class LexiconDatabase(object):
     
         loso:cat:<category name>:lex:<term> -> Count of term in this category
     
+    A key and a set member for every term cost much memory in Redis, so a 
+    category can store counts in hash buckets instead, then there is no 
+    terms set, and a term is a field of the bucket of its CRC32
+    
+        loso:cat:<category name>:hlex:<buckets>:<crc32 % buckets> -> Hash 
+        maps term to count
+        
+    Count of buckets is in meta data "buckets", it should be chosen so that
+    every bucket holds less than hash-max-listpack-entries (128 by default)
+    terms, then Redis stores them compactly.
+    
+    The set of categories and merged categories is cached in process, it is
+    reloaded when the version of the registry changes
+    
+        loso:version -> Increased when categories are added, fed, cleaned, 
+        merged, migrated or finalized
+        loso:cat:<category name>:meta:version -> Version of registry when 
+        counts, scores, layout or bloom filter of the category were changed
+        loso:cat:<category name>:meta:layout-version -> Version of registry 
+        when buckets, bloom filter or score table of the category were 
+        changed
+        
+    The version is read in the same round trip as term counts, so processes
+    see changes made by others without polling. Category objects read their
+    buckets, bloom filter and score table only once, they are dropped when 
+    the registry is reloaded with another layout version of their category,
+    then read again. Feeding without new terms in the bloom filter keeps 
+    them.
+    
+    A category may have a bloom filter of its terms, which is loaded in 
+    process, then counts of candidate terms surely not in the category are 
+    not read
+    
+        loso:cat:<category name>:bloom -> Bits of the filter
+        loso:cat:<category name>:meta:bloom-size -> Count of bits
+        loso:cat:<category name>:meta:bloom-hashes -> Count of hash functions
+    
+    A finalized category has a score table, which holds the normalized score
+    of every term, so that splitting terms reads one value per term and no
+    meta data. Every finalization writes a new generation of the table
+    
+        loso:cat:<category name>:score:<generation>:<term> -> Score of term
+        loso:cat:<category name>:score:<generation>:<crc32 % buckets> -> 
+        Hash maps term to score, when counts are in hash buckets
+        loso:cat:<category name>:meta:score-generation -> Generation in use
+        loso:cat:<category name>:meta:score-buckets -> Buckets of the table
+    
     """
     
     progress_interval = 10000
     
+    # how many times to read counts again when categories are changed by 
+    # other process during the read
+    read_retries = 3
+    
     def __init__(
         self, 
-        redis,
+        backend,
         ngram=4,
         prefix='loso:', 
+        cache_size=0,
+        cache_ttl=60,
+        engine='table',
+        metrics=None,
+        buckets=0,
+        bloom_error_rate=0,
+        bloom_capacity=1000000,
         logger=None
     ):
         self.logger = logger
         if self.logger is None:
             self.logger = logging.getLogger('lexicon.database')
-        self.redis = redis
+        # a Redis client is wrapped as backend
+        if backend is not None and not isinstance(backend, Backend):
+            backend = RedisBackend(backend)
+        self.backend = backend
+        # runtime metrics, disabled by default
+        self.metrics = metrics
+        if self.metrics is None:
+            self.metrics = Metrics()
         self.ngram = ngram
         self.prefix = prefix
+        # count of hash buckets of new categories, 0 for key per term layout
+        self.buckets = buckets
+        # false positive rate and capacity of bloom filters of new categories,
+        # 0 for no filter
+        self.bloom_error_rate = bloom_error_rate
+        self.bloom_capacity = bloom_capacity
+        # read-through cache for term counts and meta data
+        self.cache = None
+        if cache_size:
+            self.cache = LRUCache(cache_size, cache_ttl)
+        
+        # function for finding best segmentation
+        if engine == 'numpy' and not vectorized.available:
+            self.logger.warn('NumPy is not installed, use viterbi engine')
+            engine = 'viterbi'
+        self.engine = engine
+        self.findBestSegment = engines[engine]
         
         self._categories_cache = {}
+        # frozen categories, name -> FrozenCategory
+        self._frozen = {}
         # key for category
         self._category_set_key = self.prefix + 'category'
+        # merged categories, names -> MergedCategory, None for not loaded
+        self._merged = None
+        self._merged_set_key = self.prefix + 'merged'
+        # cached (version, category names, merged names), None for not loaded
+        self._registry = None
+        # versions of categories when the registry was loaded
+        self._category_versions = {}
+        # (version of registry, names of categories known to be missing)
+        self._missing_categories = (None, set())
+        self._version_key = self.prefix + 'version'
+        # clock for ages of versions read
+        self.timer = time.time
+        # the last version read from backend and when it was read
+        self._seen_version = None
+        self._seen_time = None
+    
+    def _get(self, key):
+        """Get value of a key, read through the cache if it is enabled
+        
+        """
+        if self.cache is None and not isinstance(key, tuple):
+            return self.backend.get(key)
+        return self._mget([key])[0]
+    
+    def _fetch(self, keys):
+        """Fetch values of keys from backend in one round trip, return a dict
+        maps key to value. A key is a string key, or a tuple of (hash key, 
+        field) for a field in hash
+        
+        """
+        strings = []
+        fields = {}
+        for key in keys:
+            if isinstance(key, tuple):
+                fields.setdefault(key[0], []).append(key[1])
+            else:
+                strings.append(key)
+        # check version of registry in the same round trip, it is read last,
+        # so that if it is not changed, nothing read before is deleted by 
+        # migrate or finalize, which bump the version before deleting
+        if not fields:
+            strings.append(self._version_key)
+            values = dict(zip(strings, self.backend.mget(strings)))
+            self._checkVersion(values.pop(self._version_key))
+            return values
+        hash_keys = list(fields)
+        pipe = self.backend.pipeline(transaction=False)
+        if strings:
+            pipe.mget(strings)
+        for hash_key in hash_keys:
+            pipe.hmget(hash_key, fields[hash_key])
+        pipe.get(self._version_key)
+        results = iter(pipe.execute())
+        values = {}
+        if strings:
+            values.update(zip(strings, results.next()))
+        for hash_key in hash_keys:
+            hash_fields = fields[hash_key]
+            values.update(zip([(hash_key, field) for field in hash_fields], 
+                              results.next()))
+        self._checkVersion(results.next())
+        return values
+    
+    def _mget(self, keys):
+        """Get values of keys, read through the cache if it is enabled, see
+        _fetch for the keys
+        
+        """
+        if not keys:
+            return []
+        if self.cache is None:
+            if not any(isinstance(key, tuple) for key in keys):
+                values = self.backend.mget(list(keys) + [self._version_key])
+                self._checkVersion(values.pop())
+                return values
+            fetched = self._fetch(set(keys))
+            return [fetched[key] for key in keys]
+        values = []
+        missing = []
+        for key in keys:
+            value = self.cache.get(key, _missing)
+            if value is _missing:
+                missing.append(key)
+            values.append(value)
+        if missing:
+            fetched = self._fetch(set(missing))
+            for key, value in fetched.iteritems():
+                self.cache.set(key, value)
+            values = [fetched[key] if value is _missing else value 
+                      for key, value in zip(keys, values)]
+        return values
+    
+    def _discard(self, *keys):
+        """Remove keys from the cache
+        
+        """
+        if self.cache is not None:
+            self.cache.discard(*keys)
+            
+    def _discardPrefix(self, prefix):
+        """Remove keys start with prefix from the cache
+        
+        """
+        def match(key):
+            if isinstance(key, tuple):
+                key = key[0]
+            return key.startswith(prefix)
+        if self.cache is not None:
+            self.cache.discardIf(match)
+        
+    def getStats(self):
+        """Get statistics of this lexicon database
+        
+        """
+        categories = {}
+        for c in self._getCategories():
+            categories[c.name] = c.getStats()
+        cache = None
+        if self.cache is not None:
+            cache = self.cache.getStats()
+        return dict(categories=categories, cache=cache)
+    
+    def loadBloomFilters(self):
+        """Load bloom filters of all categories, return count of categories
+        which have a filter
+        
+        """
+        count = 0
+        for c in self._getCategories():
+            if isinstance(c, LexiconCategory) and c.bloom is not None:
+                count += 1
+        return count
+    
+    def attachFrozen(self, name, path):
+        """Attach a frozen lexicon file as a read-only category, it overrides
+        category in database with the same name
+        
+        """
+        from loso.frozen import FrozenCategory
+        category = FrozenCategory(name, path)
+        self._frozen[name] = category
+        return category
+    
+    def _loadRegistry(self):
+        """Get cached registry, a tuple of (version, category names, merged
+        category names), load it from backend in one round trip if it is not
+        loaded
+        
+        """
+        registry = self._registry
+        if registry is None:
+            registry = (None, set(), set())
+            if self.backend is not None:
+                pipe = self.backend.pipeline(transaction=False)
+                pipe.get(self._version_key)
+                pipe.smembers(self._category_set_key)
+                pipe.smembers(self._merged_set_key)
+                registry = tuple(pipe.execute())
+            versions = self._getLayoutVersions(registry[1])
+            # objects of categories removed or changed are out of date
+            old_versions = self._category_versions
+            self._categories_cache = dict(
+                (name, c) for name, c in self._categories_cache.iteritems()
+                if name in versions and 
+                versions[name] == old_versions.get(name)
+            )
+            self._category_versions = versions
+            self._merged = None
+            self._registry = registry
+        return registry
+    
+    def _checkVersion(self, version):
+        """Drop cached registry if version read from backend is not the 
+        version of it
+        
+        """
+        self._seen_version = version
+        self._seen_time = self.timer()
+        registry = self._registry
+        if registry is not None and registry[0] != version:
+            self.logger.info('Registry version changed from %s to %s', 
+                             registry[0], version)
+            self._registry = None
+    
+    def _bumpVersion(self, *names):
+        """Increase version of registry, so that all processes reload it. 
+        Versions and layout versions of categories names are changed too, 
+        their buckets, bloom filters or score tables have been changed, so 
+        that other processes drop their objects
+        
+        """
+        self._writeVersion(names, names)
+    
+    def _bumpCountsVersion(self, *names):
+        """Increase version of registry like _bumpVersion, but only counts of
+        categories names have been changed, other processes keep their 
+        objects
+        
+        """
+        self._writeVersion(names, ())
+    
+    def _writeVersion(self, names, layout_names):
+        version = self.backend.incr(self._version_key)
+        # set to the new version of registry rather than increased, so that 
+        # a category cleaned and added again won't get a version it had
+        pipe = self.backend.pipeline(transaction=False)
+        for name in names:
+            pipe.set(LexiconCategory(self, name)._version_key, version)
+        for name in layout_names:
+            pipe.set(LexiconCategory(self, name)._layout_version_key, version)
+        pipe.execute()
+        self._registry = None
+        self._seen_version = str(version)
+        self._seen_time = self.timer()
+    
+    def getVersion(self, max_age=0):
+        """Get version of registry, it is increased whenever categories or 
+        their counts are changed. The version read with term counts is 
+        returned if it was read less than max_age seconds ago, otherwise it
+        is read from backend, and cached registry is dropped if it changed. 
+        Return None without backend
+        
+        """
+        if self.backend is None:
+            return None
+        if (max_age and self._seen_time is not None and 
+            self.timer() - self._seen_time < max_age):
+            return self._seen_version
+        version = self.backend.get(self._version_key)
+        self._checkVersion(version)
+        return version
+    
+    def getCategoryVersions(self, names):
+        """Get versions of categories as a dict maps name to version, it is 
+        changed when counts or scores of the category are changed
+        
+        """
+        if self.backend is None or not names:
+            return dict.fromkeys(names)
+        names = list(names)
+        keys = [LexiconCategory(self, name)._version_key for name in names]
+        return dict(zip(names, self.backend.mget(keys)))
+    
+    def _getLayoutVersions(self, names):
+        """Get layout versions of categories like getCategoryVersions, they 
+        are changed when objects of the categories are out of date
+        
+        """
+        if self.backend is None or not names:
+            return dict.fromkeys(names)
+        names = list(names)
+        keys = [LexiconCategory(self, name)._layout_version_key 
+                for name in names]
+        return dict(zip(names, self.backend.mget(keys)))
     
     def getCategory(self, name):
         """Get category and return 
         
         """
-        if name not in self.getCategoryList():
+        if name in self._frozen:
+            return self._frozen[name]
+        if name not in self._checkCategories([name]):
             return 
         category = self._categories_cache.get(name)
         if category:
@@ -400,53 +1682,298 @@ class LexiconDatabase(object):
         self._categories_cache[name] = category
         return category
     
-    def addCategory(self, name):
-        """Add a category and return
+    def addCategory(self, name, buckets=None):
+        """Add a category and return, counts of terms in the new category are
+        stored in buckets hash buckets, default to buckets of database
         
         """
-        category = self._categories_cache.get(name)
-        if category:
-            return category
+        if name in self._loadRegistry()[1]:
+            return self.getCategory(name)
+        if buckets is None:
+            buckets = self.buckets
         category = LexiconCategory(self, name)
-        category.init(self.ngram)
+        category.init(self.ngram, buckets)
         self._categories_cache[name] = category
         return category
     
+    def _checkCategories(self, names):
+        """Get list of all categories, if some of names are not in the cached
+        registry, they may be added by other process, reload it. Names still 
+        missing after that only cost reading the version, until it changes
+        
+        """
+        categories = self.getCategoryList()
+        missing = set(names) - categories
+        if missing:
+            version, known = self._missing_categories
+            if version == self._registry[0] and missing.issubset(known):
+                # the registry is dropped if the version changed
+                self.getVersion()
+            else:
+                self._registry = None
+            categories = self.getCategoryList()
+            missing = set(names) - categories
+            if version == self._registry[0]:
+                missing.update(known)
+            self._missing_categories = (self._registry[0], missing)
+        return categories
+    
     def getCategoryList(self):
         """Get list of all categories
         
         """
-        return self.redis.smembers(self._category_set_key)
+        categories = set(self._frozen)
+        categories.update(self._loadRegistry()[1])
+        return categories
        
-    def clean(self):
-        """Clean lexicon up
+    def clean(self, scan_size=None, throttle=0):
+        """Clean lexicon up, frozen categories are not touched
         
         """
-        categories = self.getCategoryList()
+        # categories may be changed by other processes
+        self._registry = None
+        categories = self.getCategoryList() - set(self._frozen)
         if categories:
             for name in categories:
                 c = self.getCategory(name)
-                c.clean()
+                if c is not None:
+                    c.clean(scan_size, throttle)
+        for merged in self._loadMerged().values():
+            merged.clean(scan_size, throttle)
         self.logger.info('Clean lexicon database, %s categories', 
                          len(categories))
         
+    def _getCategories(self, names=None):
+        """Get list of category objects by names, if names is empty, all 
+        categories will be returned
+        
+        """
+        if not names:
+            names = self.getCategoryList()
+        all_category = self._checkCategories(names)
+        c_list = []
+        for name in names:
+            if name not in all_category:
+                self.logger.error('Category %s not exist', name)
+                continue
+            if name in self._frozen:
+                c_list.append(self._frozen[name])
+                continue
+            c = self._categories_cache.get(name)
+            if c is None:
+                c = LexiconCategory(self, name)
+                self._categories_cache[name] = c
+            c_list.append(c)
+        return c_list
+        
+    def _loadMerged(self):
+        """Get merged categories as a dict maps sorted names to 
+        MergedCategory, they are cached with the registry
+        
+        """
+        names = self._loadRegistry()[2]
+        if self._merged is None:
+            merged = {}
+            for name in names:
+                category = MergedCategory(self, name.split(','))
+                merged[category.names] = category
+            self._merged = merged
+        return self._merged
+    
+    def mergeCategories(self, names):
+        """Build a merged category of categories, then splitting terms with
+        the same categories reads scores from it. Return count of terms
+        
+        """
+        category = MergedCategory(self, names)
+        if len(category.names) < 2:
+            raise ValueError('At least two categories are needed')
+        return category.build()
+    
+    def dropMerged(self, names):
+        """Delete merged category of categories
+        
+        """
+        return MergedCategory(self, names).clean()
+    
+    def _invalidateMerged(self, name):
+        """Stop using merged categories of category name, because its counts
+        have been changed
+        
+        """
+        if self.backend is None:
+            return
+        for merged_name in self.backend.smembers(self._merged_set_key):
+            names = merged_name.split(',')
+            if name in names:
+                MergedCategory(self, names).invalidate()
+    
+    def _getTermCounts(self, terms, categories):
+        """Get counts of distinct terms in categories like _readTermCounts. If
+        version of the registry changed during the read, categories may have
+        been migrated or finalized, and keys read may have been deleted, then 
+        they are read again with reloaded categories
+        
+        """
+        for i in xrange(self.read_retries + 1):
+            registry = self._loadRegistry()
+            result = self._readTermCounts(terms, categories)
+            if self._registry is registry:
+                break
+            self.metrics.increase('registry', 'reread')
+            categories = self._getCategories([c.name for c in categories])
+        return result
+    
+    def _readTermCounts(self, terms, categories):
+        """Get counts of distinct terms in categories in one round trip, 
+        return (counts, scores). The counts is a list of (terms, counts, 
+        factors) of every category, factors is None for finalized ones. If a
+        merged category is ready, counts is None and scores maps term to score
+        
+        """
+        # terms may be in categories, None for terms of categories without
+        # bloom filter
+        c_terms = []
+        for c in categories:
+            bloom = None
+            if isinstance(c, LexiconCategory):
+                bloom = c.bloom
+            if bloom is None:
+                c_terms.append(None)
+            else:
+                c_terms.append([term for term in terms if term in bloom])
+        
+        if len(categories) > 1:
+            names = tuple(sorted(c.name for c in categories))
+            merged = self._loadMerged().get(names)
+            if merged is not None:
+                known = terms
+                if None not in c_terms:
+                    known = list(set().union(*c_terms))
+                    self.metrics.increase('bloom', 'skipped', 
+                                          len(terms) - len(known))
+                merged_scores = merged.getScores(known)
+                if merged_scores is not None:
+                    scores = dict.fromkeys(terms, _smoothing)
+                    scores.update(merged_scores)
+                    return None, scores
+        
+        grams = sorted(set(len(term) for term in terms))
+        keys = []
+        for i, c in enumerate(categories):
+            if not isinstance(c, LexiconCategory):
+                continue
+            if c_terms[i] is None:
+                c_terms[i] = terms
+            else:
+                self.metrics.increase('bloom', 'skipped', 
+                                      len(terms) - len(c_terms[i]))
+            generation, buckets = c.scoreTable
+            if generation:
+                keys.extend(c._scoreItem(term, generation, buckets) 
+                            for term in c_terms[i])
+                continue
+            for n in grams:
+                keys.append(c._meta_prefix + ('%s-gram-sum' % n))
+                keys.append(c._meta_prefix + ('%s-gram-variety' % n))
+            buckets = c.buckets
+            keys.extend(c._termItem(term, buckets) for term in c_terms[i])
+        values = iter(self._mget(keys))
+        
+        counts = []
+        for i, c in enumerate(categories):
+            if isinstance(c, LexiconCategory):
+                if c.scoreTable[0]:
+                    c_scores = [values.next() for term in c_terms[i]]
+                    counts.append((c_terms[i], c_scores, None))
+                    continue
+                metas = [(values.next(), values.next()) for n in grams]
+                c_counts = [values.next() for term in c_terms[i]]
+            else:
+                metas = [(c.getGramSum(n), c.getGramVariety(n)) 
+                         for n in grams]
+                c_counts = c.getTerms(*terms)
+                c_terms[i] = terms
+            # normalize factor of n-gram
+            factors = {}
+            for n, (sum, variety) in zip(grams, metas):
+                factors[n] = _normalizeFactor(sum, variety)
+            counts.append((c_terms[i], c_counts, factors))
+        return counts, None
+    
+    def _getTermScores(self, terms, categories):
+        """Get scores of terms, return a dict maps term to score
+        
+        """
+        terms = list(set(terms))
+        counts, scores = self._getTermCounts(terms, categories)
+        if counts is None:
+            return scores
+        scores = dict.fromkeys(terms, _smoothing)
+        for c_terms, c_counts, factors in counts:
+            if factors is None:
+                for term, score in zip(c_terms, c_counts):
+                    scores[term] += float(score or 0)
+                continue
+            for term, count in zip(c_terms, c_counts):
+                scores[term] += int(count or 0)/factors[len(term)]
+        return scores
+
     def _getTermScore(self, term, ngram, categories):
         """Get score of a term
         
         """
-        score = 0.00000001
-        for c in categories:
-            count = int(c.getTerm(term) or 0)
-            n = len(term)
-            sum = int(c.getGramSum(n) or 0)
-            variety = int(c.getGramVariety(n) or 0)
-            if not variety:
-                v = 1
+        return self._getTermScores([term], categories)[term]
+    
+    def splitTermsList(self, texts, categories=None):
+        """Split a list of texts into terms, return a list of term lists. 
+        Scores of candidate terms of all texts are fetched in one round trip
+        
+        """
+        if not texts:
+            return []
+        metrics = self.metrics
+        with metrics.timer('stage', 'lookup'):
+            c_list = self._getCategories(categories)
+            candidates = []
+            for text in texts:
+                for n in xrange(1, self.ngram+1):
+                    candidates.extend(util.ngram(n, text))
+            if self.engine == 'numpy':
+                candidates = list(set(candidates))
+                counts, scores = self._getTermCounts(candidates, c_list)
             else:
-                v = sum/float(variety)
-                v *= v
-            score += count/v
-        return score
+                scores = self._getTermScores(candidates, c_list)
+        
+        if self.engine == 'numpy':
+            with metrics.timer('stage', 'segment'):
+                if counts is None:
+                    scores = vectorized.numpy.array([scores[term] for term 
+                                                     in candidates])
+                else:
+                    scores = vectorized.scoreTerms(candidates, counts, 
+                                                   _smoothing, self.ngram)
+                results = [terms for terms, _ in vectorized.splitTexts(
+                    texts, self.ngram, candidates, scores)]
+            metrics.increase('segmented', 'texts', len(texts))
+            return results
+        
+        results = []
+        with metrics.timer('stage', 'segment'):
+            for text in texts:
+                grams = []
+                for n in xrange(1, self.ngram+1):
+                    terms = []
+                    for term in util.ngram(n, text):
+                        score = scores[term]
+                        self.logger.debug('Term=%s, Score=%s', term, score)
+                        terms.append((term, score))
+                    grams.append(terms)
+                terms, best_score = self.findBestSegment(grams)
+                self.logger.debug('Best score: %s', best_score)
+                results.append(terms)
+        metrics.increase('segmented', 'texts', len(texts))
+        return results
 
     def splitTerms(self, text, categories=None):
         """Split text into terms, categories is a list of category to read
@@ -454,70 +1981,252 @@ class LexiconDatabase(object):
         categories
         
         """
-        all_category = self.getCategoryList()
-        if not categories:
-            categories = all_category
-        c_list = []
-        for name in categories:
-            c = self.getCategory(name)
-            if not c:
-                self.logger.error('Category %s not exist', name)
-                continue
-            c_list.append(c)
-        grams = []
-        for n in xrange(1, self.ngram+1):
-            terms = []
-            for term in util.ngram(n, text):
-                score = self._getTermScore(term, n, c_list)
-                self.logger.debug('Term=%s, Score=%s', term, score)
-                terms.append((term, score))
-            grams.append(terms)
-        terms, best_score = findBestSegment(grams)
-        self.logger.debug('Best score: %s', best_score)
-        return terms
+        return self.splitTermsList([text], categories)[0]
        
 class LexiconBuilder(object):
     
     progress_interval = 10000
     
-    def __init__(self, db, ngram=4, logger=None):
+    # how many chars of stream to count in one block
+    block_size = 1024*1024
+    
+    def __init__(
+        self, 
+        db, 
+        ngram=4, 
+        batch_size=1000, 
+        workers=1, 
+        flush_terms=1000000,
+        exact_variety=True,
+        refinalize=False,
+        logger=None
+    ):
         self.logger = logger
         if self.logger is None:
             self.logger = logging.getLogger('lexicon.builder')
         self.db = db
         self.ngram = ngram
+        # how many terms to send to database in one pipelined batch
+        self.batch_size = batch_size
+        # how many processes to count terms with
+        self.workers = workers
+        # how many distinct terms to hold before flushing to database when 
+        # feeding a stream
+        self.flush_terms = flush_terms
+        # whether to keep flushed terms of a stream in a temporary set, so 
+        # that n-gram variety counts a term once rather than once per flush
+        self.exact_variety = exact_variety
+        # whether to finalize a finalized category again after feeding it, 
+        # which rewrites its whole score table
+        self.refinalize = refinalize
+        
+    def _countParallel(self, text, workers, counts=None, pool=None):
+        """Split text at sentence boundaries into chunks, count terms of the 
+        chunks in a process pool and merge the results into counts. A pool of
+        workers is created for this call if pool is None
+        
+        """
+        from multiprocessing import Pool
+        
+        sentences = [sentence for sentence in splitSentence(text) if sentence]
+        # a few chunks per worker for balancing the load
+        chunk_size = max(1, len(text) // (workers * 4))
+        chunks = []
+        chunk = []
+        size = 0
+        for sentence in sentences:
+            chunk.append(sentence)
+            size += len(sentence)
+            if size >= chunk_size:
+                chunks.append(u'\n'.join(chunk))
+                chunk = []
+                size = 0
+        if chunk:
+            chunks.append(u'\n'.join(chunk))
+        self.logger.debug('Count terms of %d chunks with %d workers', 
+                          len(chunks), workers)
+        
+        tasks = [(part, self.ngram) for part in chunks]
+        if pool is not None:
+            results = pool.map(_countTermsWorker, tasks)
+        else:
+            pool = Pool(workers)
+            try:
+                results = pool.map(_countTermsWorker, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        
+        if counts is None:
+            counts = [{} for n in xrange(self.ngram)]
+        for result in results:
+            for terms_count, chunk_count in zip(counts, result):
+                for term, count in chunk_count.iteritems():
+                    terms_count[term] = terms_count.get(term, 0) + count
+        return counts
+    
+    def _count(self, text, workers, counts=None, pool=None):
+        """Count terms in text into counts, in a process pool if workers is 
+        more than 1
+        
+        """
+        with self.db.metrics.timer('stage', 'count'):
+            if workers > 1:
+                return self._countParallel(text, workers, counts, pool)
+            return countTerms(text, self.ngram, counts)
+    
+    def _addSeenTerms(self, seen_key, terms):
+        """Add terms to the set at seen_key in batches, return count of terms
+        which were not in it
+        
+        """
+        backend = self.db.backend
+        new = 0
+        for i in xrange(0, len(terms), self.batch_size):
+            new += backend.sadd(seen_key, *terms[i:i+self.batch_size])
+        return new
+    
+    def _writeCounts(self, cat, counts, seen_key=None):
+        """Write counts of terms returned by countTerms to category, return 
+        total terms have been written. If seen_key is given, n-gram variety
+        only counts terms which are not in the set at it, and they are added
+        to the set, so that several writes of a feed count a term once
+        
+        """
+        with self.db.metrics.timer('stage', 'write'):
+            total = 0
+            for n, terms_count in enumerate(counts, 1):
+                sum = 0
+                for count in terms_count.itervalues():
+                    sum += count
+                if seen_key is None:
+                    variety = len(terms_count)
+                else:
+                    variety = self._addSeenTerms(seen_key, terms_count.keys())
+                total += sum
+                # add terms to database in batches, the n-gram sum and 
+                # variety go with the last batch
+                items = terms_count.items()
+                whole = len(items)
+                begins = range(0, whole, self.batch_size) or [0]
+                for i in begins:
+                    batch = items[i:i+self.batch_size]
+                    if i == begins[-1]:
+                        result = cat.increaseTerms(batch, {n: sum}, 
+                                                   {n: variety})
+                        self.logger.debug('Increase %d-gram sum to %d', n, 
+                                          result[-2])
+                        self.logger.debug('Increase %d-gram variety to %d', n, 
+                                          result[-1])
+                    else:
+                        cat.increaseTerms(batch)
+                    if i % self.progress_interval < self.batch_size:
+                        per = (i/float(whole))*100.0 if whole else 100.0
+                        self.logger.info('Progress %d/%d (%02d%%)', i, whole, 
+                                         per)
+            cat.addBloomTerms(term for terms_count in counts 
+                              for term in terms_count)
+            self.db._invalidateMerged(cat.name)
+            # results split by other processes are out of date
+            self.db._bumpCountsVersion(cat.name)
+            return total
+    
+    def _refinalize(self, cat):
+        """Finalize category again after feeding if refinalize is set and it 
+        is finalized, so that its scores include the fed terms
+        
+        """
+        if not self.refinalize:
+            return
+        cat._score_table = None
+        if cat.scoreTable[0]:
+            cat.finalize()
     
-    def feed(self, category, text):
-        """Feed text into lexicon database and return total terms has been fed
+    def feed(self, category, text, workers=None):
+        """Feed text into lexicon database and return total terms has been fed,
+        if workers is more than 1, terms are counted in a process pool
         
         """
+        if workers is None:
+            workers = self.workers
         cat = self.db.addCategory(category)
+        begin = time.time()
+        counts = self._count(text, workers)
+        total = self._writeCounts(cat, counts)
+        self._refinalize(cat)
+        elapsed = max(time.time() - begin, 0.000001)
+        self.logger.info('Fed %d terms, %d chars in %.2f seconds (%d chars/s)', 
+                         total, len(text), elapsed, len(text)/elapsed)
+        return total
+    
+    def feedStream(self, category, chunks, workers=None, flush_terms=None):
+        """Feed an iterable of text chunks, such as lines of a file, into 
+        lexicon database and return total terms has been fed. 
+        
+        Terms are counted block by block, and the counts are flushed to 
+        database whenever there are more than flush_terms distinct terms, so
+        the memory usage doesn't grow with size of input. If exact_variety 
+        is set, terms of flushes are kept in a temporary set in database, so 
+        that n-gram variety is the same as feeding the whole stream at once,
+        otherwise every flush counts as a separate feed in n-gram variety
+        
+        """
+        from multiprocessing import Pool
+        
+        if workers is None:
+            workers = self.workers
+        if flush_terms is None:
+            flush_terms = self.flush_terms
+        cat = self.db.addCategory(category)
+        begin = time.time()
         total = 0
-        for n in xrange(1, self.ngram+1):
-            self.logger.debug('Processing %d-gram', n)
-            terms_count = {}
-            sum = 0
-            variety = 0
-            # count number of terms
-            for term in iterTerms(n, text):
-                terms_count.setdefault(term, 0)
-                if terms_count[term] == 0:
-                    variety += 1
-                terms_count[term] += 1
-                total += 1
-            # add terms to database
-            for i, (term, delta) in enumerate(terms_count.iteritems()):
-                result = cat.increaseTerm(term, delta)
-                sum += delta
-                if i % self.progress_interval == 0:
-                    whole = len(terms_count)
-                    per = (i/float(whole))*100.0
-                    self.logger.info('Progress %d/%d (%02d%%)', i, whole, per)
-                                      
-            # add n-gram count
-            result = cat.increaseGramSum(n, sum)
-            self.logger.debug('Increase %d-gram sum to %d', n, result)
-            result = cat.increaseGramVariety(n, variety)
-            self.logger.debug('Increase %d-gram variety to %d', n, result)
-        self.logger.info('Fed %d terms', total)
+        chars = 0
+        counts = [{} for n in xrange(self.ngram)]
+        # set of terms have been flushed, created on the first flush
+        seen_key = None
+        # one pool counts all blocks
+        pool = None
+        if workers > 1:
+            pool = Pool(workers)
+        try:
+            # complete sentences to be counted
+            block = []
+            block_chars = 0
+            # the last sentence of a chunk may continue in next chunk
+            pending = u''
+            for chunk in chunks:
+                chars += len(chunk)
+                sentences = list(splitSentence(pending + chunk))
+                pending = sentences.pop()
+                for sentence in sentences:
+                    if sentence:
+                        block.append(sentence)
+                        block_chars += len(sentence)
+                if block_chars < self.block_size:
+                    continue
+                self._count(u'\n'.join(block), workers, counts, pool)
+                block = []
+                block_chars = 0
+                if sum(len(terms_count) 
+                       for terms_count in counts) >= flush_terms:
+                    self.logger.info('Flush %d chars', chars)
+                    if seen_key is None and self.exact_variety:
+                        seen_key = '%sfeed:%s' % (cat.prefix, 
+                                                  uuid.uuid4().hex)
+                    total += self._writeCounts(cat, counts, seen_key)
+                    counts = [{} for n in xrange(self.ngram)]
+            block.append(pending)
+            self._count(u'\n'.join(block), workers, counts, pool)
+            total += self._writeCounts(cat, counts, seen_key)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            if seen_key is not None:
+                self.db.backend.unlink(seen_key)
+        self._refinalize(cat)
+        
+        elapsed = max(time.time() - begin, 0.000001)
+        self.logger.info('Fed %d terms, %d chars in %.2f seconds (%d chars/s)', 
+                         total, chars, elapsed, chars/elapsed)
         return total
@@ -0,0 +1,245 @@
+# -*- coding: utf8 -*-
+"""Runtime metrics of segmentation. Metrics are grouped in families, every
+metric in a family is distinguished by a label, for example, timer of
+stage "lookup" is in family "stage". When metrics are disabled, timers and
+counters do nothing, so instrumented code costs almost nothing
+
+"""
+import time
+import threading
+
+from loso import backends
+
+class _NullTimer(object):
+    """Timer does nothing, it is shared when metrics are disabled
+
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_null_timer = _NullTimer()
+
+class _Timer(object):
+
+    def __init__(self, metrics, family, label):
+        self.metrics = metrics
+        self.family = family
+        self.label = label
+
+    def __enter__(self):
+        self.begin = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.observe(self.family, self.label,
+                             time.time() - self.begin)
+        return False
+
+class Metrics(object):
+    """Collects timers, counters and gauges
+
+    """
+
+    # name of label of families in Prometheus format, default to "name"
+    label_names = dict(
+        stage='stage',
+        command='command',
+        cache_hit_rate='cache',
+        cache_size='cache',
+    )
+
+    def __init__(self, enabled=False, prefix='loso_'):
+        self.enabled = enabled
+        self.prefix = prefix
+        # (family, label) -> [count, sum, max]
+        self.timers = {}
+        # (family, label) -> value
+        self.counters = {}
+        # functions return list of (family, label, value) gauges
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def timer(self, family, label):
+        """Get a context manager measures time of its block
+
+        """
+        if not self.enabled:
+            return _null_timer
+        return _Timer(self, family, label)
+
+    def observe(self, family, label, seconds):
+        """Record an observed duration
+
+        """
+        if not self.enabled:
+            return
+        key = (family, label)
+        with self._lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                timer = self.timers[key] = [0, 0.0, 0.0]
+            timer[0] += 1
+            timer[1] += seconds
+            if seconds > timer[2]:
+                timer[2] = seconds
+
+    def increase(self, family, label, value=1):
+        """Increase a counter
+
+        """
+        if not self.enabled:
+            return
+        key = (family, label)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def reset(self):
+        """Reset all timers and counters
+
+        """
+        with self._lock:
+            self.timers = {}
+            self.counters = {}
+
+    def countCommands(self):
+        """Get (round trips, operations) of commands recorded by 
+        InstrumentedBackend, a pipeline is one round trip of all its commands
+
+        """
+        with self._lock:
+            calls = dict((label, timer[0]) for (family, label), timer
+                         in self.timers.iteritems() if family == 'command')
+            pipelined = self.counters.get(('pipelined', 'commands'), 0)
+        round_trips = sum(calls.itervalues())
+        return round_trips, round_trips - calls.get('pipeline', 0) + pipelined
+
+    def addCollector(self, collector):
+        """Add a function returns list of (family, label, value) gauges, it
+        is called when metrics are read
+
+        """
+        self.collectors.append(collector)
+
+    def _collectGauges(self):
+        gauges = []
+        for collector in self.collectors:
+            gauges.extend(collector())
+        return gauges
+
+    def getMetrics(self):
+        """Get all metrics as a dict, metric names are "family:label"
+
+        """
+        with self._lock:
+            timers = dict(
+                ('%s:%s' % key, dict(count=count, sum=total, max=maximum))
+                for key, (count, total, maximum) in self.timers.iteritems()
+            )
+            counters = dict(('%s:%s' % key, value)
+                            for key, value in self.counters.iteritems())
+        gauges = dict(('%s:%s' % (family, label), value)
+                      for family, label, value in self._collectGauges())
+        return dict(
+            enabled=self.enabled,
+            timers=timers,
+            counters=counters,
+            gauges=gauges
+        )
+
+    def formatPrometheus(self, labels=None):
+        """Format metrics as Prometheus text exposition format, labels is a
+        dict of labels added to every sample, such as pid of the worker
+
+        """
+        common = ''.join('%s="%s",' % item
+                         for item in sorted((labels or {}).iteritems()))
+        lines = []
+        def add(name, kind, samples):
+            lines.append('# TYPE %s %s' % (name, kind))
+            for suffix, family, label, value in samples:
+                label_name = self.label_names.get(family, 'name')
+                lines.append('%s%s{%s%s="%s"} %r' % (name, suffix, common,
+                                                     label_name, label, value))
+
+        with self._lock:
+            timers = sorted(self.timers.iteritems())
+            counters = sorted(self.counters.iteritems())
+        families = sorted(set(family for (family, _), _ in timers))
+        for family in families:
+            samples = []
+            for (timer_family, label), (count, total, _) in timers:
+                if timer_family == family:
+                    samples.append(('_count', family, label, count))
+                    samples.append(('_sum', family, label, total))
+            add('%s%s_seconds' % (self.prefix, family), 'summary', samples)
+        families = sorted(set(family for (family, _), _ in counters))
+        for family in families:
+            samples = [('', family, label, value)
+                       for (counter_family, label), value in counters
+                       if counter_family == family]
+            add('%s%s_total' % (self.prefix, family), 'counter', samples)
+        gauges = sorted(self._collectGauges())
+        families = sorted(set(family for family, _, _ in gauges))
+        for family in families:
+            samples = [('', family, label, value)
+                       for gauge_family, label, value in gauges
+                       if gauge_family == family]
+            add('%s%s' % (self.prefix, family), 'gauge', samples)
+        return '\n'.join(lines) + '\n'
+
+class InstrumentedBackend(backends.Backend):
+    """Backend wrapper records count and latency of every command to the
+    wrapped backend in family "command", a pipeline is recorded as one
+    "pipeline" command
+
+    """
+
+    def __init__(self, backend, metrics):
+        self.backend = backend
+        self.metrics = metrics
+        self.commands = backend.commands
+
+    def __getattr__(self, name):
+        return _instrumented(name).__get__(self)
+
+    def pipeline(self, transaction=False):
+        return _InstrumentedPipeline(self.backend.pipeline(transaction),
+                                     self.metrics)
+
+class _InstrumentedPipeline(object):
+
+    def __init__(self, pipeline, metrics):
+        self.pipeline = pipeline
+        self.metrics = metrics
+        self.size = 0
+
+    def __getattr__(self, name):
+        func = getattr(self.pipeline, name)
+        def queue(*args, **kwargs):
+            self.size += 1
+            func(*args, **kwargs)
+            return self
+        return queue
+
+    def execute(self):
+        self.metrics.increase('pipelined', 'commands', self.size)
+        self.size = 0
+        with self.metrics.timer('command', 'pipeline'):
+            return self.pipeline.execute()
+
+def _instrumented(name):
+    """Make a method records calls of command to the wrapped backend
+
+    """
+    def call(self, *args, **kwargs):
+        with self.metrics.timer('command', name):
+            return getattr(self.backend, name)(*args, **kwargs)
+    call.__name__ = name
+    return call
+
+for _name in backends.Backend.commands:
+    setattr(InstrumentedBackend, _name, _instrumented(_name))
@@ -46,43 +46,55 @@ class FeedCommand(Command):
         ('file=', 'f', 'text file to feed'),
         ('encoding=', 'e', 'encoding of text file'),
         ('category=', 'c', 'category name'),
+        ('workers=', 'w', 'number of processes to count terms with'),
     ]
 
     def initialize_options(self):
         self.encoding = 'utf8'
         self.file = None
         self.category = None
+        self.workers = None
     
     def finalize_options(self):
         import codecs
+        if self.workers is not None:
+            self.workers = int(self.workers)
         if not self.file:
             raise DistutilsOptionError('Must set text file path to feed')
         if not self.category:
             raise DistutilsOptionError('Must set category to feed')
         self.text_file = codecs.open(self.file, 'rt', encoding=self.encoding)
-        self.text = self.text_file.read()
 
     def run(self):
         logging.basicConfig(level=logging.DEBUG)
         cfg = _loadConfig()
         seg_service = service.SegumentService(cfg)
-        seg_service.feed(self.category, self.text)
+        # feed file line by line, so that memory usage stays flat
+        seg_service.builder.feedStream(self.category, self.text_file, 
+                                       self.workers)
+        self.text_file.close()
         
 class ResetCommand(Command):
     description = 'reset lexicon database'
-    user_options = []
+    user_options = [
+        ('scan-size=', 's', 'number of terms to delete in one command'),
+        ('throttle=', 't', 'seconds to sleep between deletions'),
+    ]
 
     def initialize_options(self):
-        pass
+        self.scan_size = None
+        self.throttle = 0
     
     def finalize_options(self):
-        pass
+        if self.scan_size is not None:
+            self.scan_size = int(self.scan_size)
+        self.throttle = float(self.throttle)
 
     def run(self):
         logging.basicConfig(level=logging.DEBUG)
         cfg = _loadConfig()
         seg_service = service.SegumentService(cfg)
-        seg_service.db.clean()
+        seg_service.db.clean(self.scan_size, self.throttle)
         print 'Done.'
         
 class ServeCommand(Command):
@@ -96,24 +108,13 @@ class ServeCommand(Command):
         pass
 
     def run(self):
-        from SimpleXMLRPCServer import SimpleXMLRPCServer
+        from loso import server
 
         logging.basicConfig(level=logging.INFO)
         logger = logging.getLogger('segment.main')
         
         cfg = _loadConfig()
-
-        seg_service = service.SegumentService(cfg)
-        
-        xcfg= cfg['xmlrpc']
-        interface = xcfg.get('interface', '0.0.0.0')
-        port = xcfg.get('port', 5566)
-        logger.info('Start segmentation service at %s:%d', interface, port)
-        
-        server = SimpleXMLRPCServer((interface, port), allow_none=True)
-        server.register_introspection_functions()
-        server.register_instance(seg_service)
-        server.serve_forever()
+        server.serve(cfg, logger)
         
 class DumpCommand(Command):
     description = 'dump lexicon database as a text file'
@@ -148,6 +149,200 @@ class DumpCommand(Command):
         self.text_file.close()
         print 'Done.'
         
+class LoadCommand(Command):
+    description = 'load a text file written by dump into lexicon database'
+    user_options = [
+        ('file=', 'f', '/path/to/text'),
+        ('encoding=', 'e', 'encoding of text file'),
+        ('category=', 'c', 'category name'),
+        ('mode=', 'm', 'merge (add to existing counts) or replace'),
+    ]
+
+    def initialize_options(self):
+        self.encoding = 'utf8'
+        self.file = None
+        self.category = None
+        self.mode = 'merge'
+    
+    def finalize_options(self):
+        import codecs
+        if not self.file:
+            raise DistutilsOptionError('Must set text file path to load')
+        if not self.category:
+            raise DistutilsOptionError('Must set category to load')
+        if self.mode not in ('merge', 'replace'):
+            raise DistutilsOptionError('Mode must be merge or replace')
+        self.text_file = codecs.open(self.file, 'rt', encoding=self.encoding)
+
+    def run(self):
+        logging.basicConfig(level=logging.DEBUG)
+        cfg = _loadConfig()
+        seg_service = service.SegumentService(cfg)
+        c = seg_service.db.addCategory(self.category)
+        count = c.load(self.text_file, self.mode)
+        self.text_file.close()
+        print 'Done, %d terms.' % count
+        
+class MergeCommand(Command):
+    description = 'build merged category for splitting with many categories'
+    user_options = [
+        ('category=', 'c', 'category names, split by comma'),
+        ('drop', 'd', 'delete the merged category instead'),
+    ]
+    boolean_options = ['drop']
+
+    def initialize_options(self):
+        self.category = None
+        self.drop = False
+    
+    def finalize_options(self):
+        if not self.category:
+            raise DistutilsOptionError('Must set categories to merge')
+        self.category = self.category.split(',')
+
+    def run(self):
+        logging.basicConfig(level=logging.DEBUG)
+        cfg = _loadConfig()
+        seg_service = service.SegumentService(cfg)
+        if self.drop:
+            count = seg_service.db.dropMerged(self.category)
+        else:
+            count = seg_service.mergeCategories(self.category)
+        print 'Done, %d terms.' % count
+        
+class MigrateCommand(Command):
+    description = 'move a category to hash bucketed or key per term layout'
+    user_options = [
+        ('category=', 'c', 'category name'),
+        ('buckets=', 'b', 'number of hash buckets, 0 for a key per term'),
+        ('throttle=', 't', 'seconds to sleep between batches'),
+    ]
+
+    def initialize_options(self):
+        self.category = None
+        self.buckets = None
+        self.throttle = 0
+    
+    def finalize_options(self):
+        if not self.category:
+            raise DistutilsOptionError('Must set category to migrate')
+        if self.buckets is None:
+            raise DistutilsOptionError('Must set number of buckets')
+        self.buckets = int(self.buckets)
+        self.throttle = float(self.throttle)
+
+    def run(self):
+        logging.basicConfig(level=logging.DEBUG)
+        cfg = _loadConfig()
+        seg_service = service.SegumentService(cfg)
+        c = seg_service.db.getCategory(self.category)
+        if not c:
+            print 'Category %s not exist' % self.category
+            return
+        count = c.migrate(self.buckets, throttle=self.throttle)
+        print 'Done, %d terms.' % count
+        
+class BloomCommand(Command):
+    description = 'rebuild bloom filters of terms in categories'
+    user_options = [
+        ('category=', 'c', 'category name, split by comma, default to all'),
+        ('error-rate=', 'r', 
+         'false positive rate, 0 to remove filters, default to configuration'),
+        ('capacity=', 'n', 'number of terms, default to twice of terms'),
+    ]
+
+    def initialize_options(self):
+        self.category = None
+        self.error_rate = None
+        self.capacity = None
+    
+    def finalize_options(self):
+        if self.category:
+            self.category = self.category.split(',')
+        if self.error_rate is not None:
+            self.error_rate = float(self.error_rate)
+        if self.capacity is not None:
+            self.capacity = int(self.capacity)
+
+    def run(self):
+        from loso import lexicon
+        logging.basicConfig(level=logging.DEBUG)
+        cfg = _loadConfig()
+        seg_service = service.SegumentService(cfg)
+        error_rate = self.error_rate
+        if error_rate is None:
+            error_rate = seg_service.bloom_error_rate
+        for c in seg_service.db._getCategories(self.category):
+            if not isinstance(c, lexicon.LexiconCategory):
+                continue
+            count = c.rebuildBloom(error_rate, self.capacity)
+            print 'Done %s, %d terms.' % (c.name, count)
+        
+class FinalizeCommand(Command):
+    description = 'write precomputed term scores of categories'
+    user_options = [
+        ('category=', 'c', 'category name, split by comma, default to all'),
+    ]
+
+    def initialize_options(self):
+        self.category = None
+    
+    def finalize_options(self):
+        if self.category:
+            self.category = self.category.split(',')
+
+    def run(self):
+        from loso import lexicon
+        logging.basicConfig(level=logging.DEBUG)
+        cfg = _loadConfig()
+        seg_service = service.SegumentService(cfg)
+        for c in seg_service.db._getCategories(self.category):
+            if not isinstance(c, lexicon.LexiconCategory):
+                continue
+            count = c.finalize()
+            print 'Done %s, %d terms.' % (c.name, count)
+        
+class FreezeCommand(Command):
+    description = 'export a category as a memory-mapped frozen lexicon file'
+    user_options = [
+        ('file=', 'f', '/path/to/frozen/lexicon'),
+        ('category=', 'c', 'category name to read from database'),
+        ('input=', 'i', 'dump text file to read instead of database'),
+        ('encoding=', 'e', 'encoding of dump text file'),
+    ]
+
+    def initialize_options(self):
+        self.encoding = 'utf8'
+        self.file = None
+        self.category = None
+        self.input = None
+    
+    def finalize_options(self):
+        if not self.file:
+            raise DistutilsOptionError('Must set frozen lexicon path to write')
+        if not self.category and not self.input:
+            raise DistutilsOptionError('Must set category or dump file')
+
+    def run(self):
+        import codecs
+        from loso import frozen
+        logging.basicConfig(level=logging.DEBUG)
+        if self.input:
+            dump_file = codecs.open(self.input, 'rt', encoding=self.encoding)
+            with open(self.file, 'wb') as file:
+                count = frozen.exportDump(dump_file, file)
+            dump_file.close()
+        else:
+            cfg = _loadConfig()
+            seg_service = service.SegumentService(cfg)
+            c = seg_service.db.getCategory(self.category)
+            if not c:
+                print 'Category %s not exist' % self.category
+                return
+            with open(self.file, 'wb') as file:
+                count = frozen.exportCategory(c, file)
+        print 'Done, %d terms.' % count
+        
 class InfoCommand(Command):
     description = 'Display info of lexicon database'
     user_options = [
@@ -181,4 +376,31 @@ class InfoCommand(Command):
             for n in xrange(1, stats['gram']+1):
                 print '%d-gram sum:' % n, stats['%sgram_sum' % n]
                 print '%d-gram variety:' % n, stats['%sgram_variety' % n]
-            print 
+            print
+            
+class BenchmarkCommand(Command):
+    description = 'run benchmarks offline and write results as JSON'
+    user_options = [
+        ('output=', 'o', 'path to JSON result file'),
+        ('backend=', 'b', 'backend to run against, memory, sqlite or redis'),
+        ('path=', 'p', 'path of SQLite database, or host:port of redis'),
+        ('size=', 's', 'characters of synthetic corpus to feed'),
+    ]
+
+    def initialize_options(self):
+        self.output = None
+        self.backend = 'memory'
+        self.path = None
+        self.size = '200000'
+    
+    def finalize_options(self):
+        if not self.output:
+            raise DistutilsOptionError('Must set path of result file')
+
+    def run(self):
+        from loso.benchmark import run
+        args = ['-o', self.output, '-b', self.backend, '-s', self.size]
+        if self.path:
+            args += ['-p', self.path]
+        run.main(args)
+        print 'Done.'
@@ -0,0 +1,494 @@
+# -*- coding: utf8 -*-
+"""Concurrent segmentation server. Listening sockets are bound in the parent
+process, then a number of worker processes are pre-forked, every worker has
+its own SegumentService (and its own connection pool to the backend) and
+handles requests with a pool of threads.
+
+Besides XML-RPC, the service can be served with a lean JSON-lines protocol 
+over TCP, a connection is kept alive for many calls until it is idle for 
+idle_timeout seconds. Every request is a line of UTF-8 encoded JSON object
+
+    {"id": 1, "method": "splitTerms", "params": ["text", null]}
+    
+and every response is a line of JSON object in the same order
+
+    {"id": 1, "result": ["term", ...]}
+    {"id": 1, "error": {"type": "ValueError", "message": "..."}}
+
+Runtime metrics are served in Prometheus text format by HTTP GET /metrics.
+On the XML-RPC port, they are metrics of the worker which accepts the 
+connection. With port in the metrics section of configuration, every worker
+also serves its own metrics on port plus index of the worker, so that all
+workers can be scraped.
+
+"""
+import os
+import sys
+import time
+import json
+import errno
+import Queue
+import socket
+import signal
+import logging
+import threading
+import SocketServer
+import BaseHTTPServer
+from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+
+from loso import service
+
+class ThreadPoolMixIn(object):
+    """Mix-in class handles requests with a fixed pool of threads. A request
+    is only accepted when a thread is free to handle it, so that requests 
+    are not queued behind busy threads, other workers listening on the same
+    socket accept them instead
+
+    """
+
+    # number of threads in the pool
+    threads = 4
+    
+    # seconds to wait before checking again when all threads are busy
+    busy_interval = 0.05
+
+    def startThreads(self):
+        """Start threads of the pool
+
+        """
+        self._requests = Queue.Queue()
+        # count of threads free to handle a request
+        self._idle = threading.Semaphore(self.threads)
+        self._accepted = False
+        self._threads = []
+        for i in xrange(self.threads):
+            thread = threading.Thread(target=self._processRequests)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stopThreads(self):
+        """Stop threads of the pool after queued requests are handled
+
+        """
+        for thread in self._threads:
+            self._requests.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _processRequests(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+                self.shutdown_request(request)
+            except:
+                self.handle_error(request, client_address)
+                self.shutdown_request(request)
+            finally:
+                self._idle.release()
+
+    def _handle_request_noblock(self):
+        if not self._idle.acquire(False):
+            # leave the connection in backlog of the listening socket
+            time.sleep(self.busy_interval)
+            return
+        self._accepted = False
+        try:
+            SocketServer.BaseServer._handle_request_noblock(self)
+        finally:
+            # other worker took the connection, or it is rejected
+            if not self._accepted:
+                self._idle.release()
+
+    def process_request(self, request, client_address):
+        self._accepted = True
+        self._requests.put((request, client_address))
+
+    def get_request(self):
+        request, client_address = self.socket.accept()
+        # the listening socket is shared by workers and is non-blocking,
+        # handle the accepted socket in blocking mode
+        request.setblocking(1)
+        return request, client_address
+
+def _sendMetrics(handler, seg_service, worker):
+    """Send metrics of service in Prometheus text format as response of HTTP
+    request handler, return False if the path is not the metrics path
+    
+    """
+    if handler.path.split('?', 1)[0] != '/metrics' or seg_service is None:
+        return False
+    body = seg_service.metrics.formatPrometheus(dict(pid=os.getpid(), 
+                                                     worker=worker))
+    handler.send_response(200)
+    handler.send_header('Content-type', 'text/plain; version=0.0.4')
+    handler.send_header('Content-length', str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+    return True
+
+class XMLRPCRequestHandler(SimpleXMLRPCRequestHandler):
+    """XML-RPC request handler also serves metrics of the service in 
+    Prometheus text format at GET /metrics
+    
+    """
+    
+    def do_GET(self):
+        seg_service = getattr(self.server, 'instance', None)
+        if not _sendMetrics(self, seg_service, self.server.worker):
+            self.report_404()
+
+class MetricsRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves metrics of the service at GET /metrics
+    
+    """
+    
+    def do_GET(self):
+        if not _sendMetrics(self, self.server.service, self.server.worker):
+            self.send_error(404)
+    
+    def log_message(self, format, *args):
+        pass
+
+class MetricsServer(BaseHTTPServer.HTTPServer):
+    """HTTP server of metrics of a worker, it is bound by the worker itself,
+    so that every worker has its own port
+    
+    """
+    
+    allow_reuse_address = True
+    
+    def __init__(self, address, seg_service, worker=0):
+        self.service = seg_service
+        self.worker = worker
+        BaseHTTPServer.HTTPServer.__init__(self, address, 
+                                           MetricsRequestHandler)
+
+class XMLRPCServer(ThreadPoolMixIn, SimpleXMLRPCServer):
+    """XML-RPC server handles requests with a pool of threads
+
+    """
+
+    def __init__(self, address, threads=4, logger=None):
+        self.logger = logger
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+        self.threads = threads
+        # index of the worker serves it
+        self.worker = 0
+        SimpleXMLRPCServer.__init__(self, address, XMLRPCRequestHandler,
+                                    allow_none=True, logRequests=False)
+        # workers wait for the same socket, only one of them gets the
+        # connection, others should not block in accept
+        self.socket.setblocking(0)
+
+    def setService(self, seg_service):
+        """Set the service to serve
+
+        """
+        self.register_introspection_functions()
+        self.register_instance(seg_service)
+
+class JSONLineHandler(SocketServer.StreamRequestHandler):
+    """Handler of JSON-lines connection, it handles requests until the client
+    closes the connection, or the connection is idle for idle_timeout 
+    seconds of the server, so that idle clients don't hold threads forever
+    
+    """
+
+    def setup(self):
+        self.timeout = self.server.idle_timeout
+        SocketServer.StreamRequestHandler.setup(self)
+        self.server.addConnection(self.connection)
+
+    def finish(self):
+        self.server.removeConnection(self.connection)
+        SocketServer.StreamRequestHandler.finish(self)
+
+    def handle(self):
+        while True:
+            try:
+                line = self.rfile.readline()
+            except socket.timeout:
+                self.server.logger.debug('Close idle connection from %s:%d',
+                                         *self.client_address[:2])
+                return
+            if not line:
+                return
+            if not line.strip():
+                continue
+            response = self.server.dispatch(line)
+            self.wfile.write(response)
+            self.wfile.flush()
+
+class JSONLineServer(ThreadPoolMixIn, SocketServer.TCPServer):
+    """JSON-lines server handles connections with a pool of threads, every 
+    thread serves one connection at a time. A connection idle for 
+    idle_timeout seconds is closed, None for never
+    
+    """
+    
+    allow_reuse_address = True
+
+    def __init__(self, address, threads=16, logger=None, idle_timeout=30):
+        self.logger = logger
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+        self.threads = threads
+        self.idle_timeout = idle_timeout
+        self.service = None
+        self._connections = set()
+        self._connections_lock = threading.Lock()
+        SocketServer.TCPServer.__init__(self, address, JSONLineHandler)
+        self.socket.setblocking(0)
+
+    def setService(self, seg_service):
+        """Set the service to serve
+
+        """
+        self.service = seg_service
+
+    def addConnection(self, connection):
+        with self._connections_lock:
+            self._connections.add(connection)
+
+    def removeConnection(self, connection):
+        with self._connections_lock:
+            self._connections.discard(connection)
+
+    def stopThreads(self):
+        # stop reading from kept alive connections, so that their handlers 
+        # return after current request
+        with self._connections_lock:
+            for connection in self._connections:
+                try:
+                    connection.shutdown(socket.SHUT_RD)
+                except socket.error:
+                    pass
+        ThreadPoolMixIn.stopThreads(self)
+
+    def dispatch(self, line):
+        """Call service method requested in line and return response line
+        
+        """
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get('id')
+            method = request['method']
+            func = None
+            if not method.startswith('_'):
+                func = getattr(self.service, method, None)
+            if not callable(func):
+                raise AttributeError('Method %s is not supported' % method)
+            result = func(*request.get('params', []))
+            response = dict(id=request_id, result=result)
+        except Exception, e:
+            self.logger.exception('Failed to handle request')
+            response = dict(id=request_id, error=dict(
+                type=e.__class__.__name__, 
+                message=unicode(e)
+            ))
+        data = json.dumps(response, ensure_ascii=False)
+        if isinstance(data, unicode):
+            data = data.encode('utf8')
+        return data + '\n'
+
+class Worker(object):
+    """A worker serves requests on servers with its own service, index is 
+    the index of the worker, a respawned worker takes index of the exited 
+    one
+
+    """
+
+    def __init__(self, config, servers, logger=None, index=0):
+        self.logger = logger
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+        self.config = config
+        self.servers = servers
+        self.index = index
+        self._stopped = threading.Event()
+
+    def stop(self):
+        """Stop serving, it can be called from signal handlers
+
+        """
+        self._stopped.set()
+
+    def run(self):
+        """Serve requests until stop is called
+
+        """
+        seg_service = service.SegumentService(self.config)
+        threads = []
+        for server in self.servers:
+            server.worker = self.index
+            server.setService(seg_service)
+            server.startThreads()
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        metrics_server = None
+        mcfg = self.config.get('metrics') or {}
+        if mcfg.get('port'):
+            address = (mcfg.get('interface', '0.0.0.0'), 
+                       mcfg['port'] + self.index)
+            metrics_server = MetricsServer(address, seg_service, self.index)
+            thread = threading.Thread(target=metrics_server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+            self.logger.info('Worker %d serves metrics at %s:%d', 
+                             os.getpid(), address[0], address[1])
+        self.logger.info('Worker %d is serving', os.getpid())
+
+        # signals are only delivered when main thread is not blocked
+        while not self._stopped.is_set():
+            self._stopped.wait(1)
+
+        self.logger.info('Worker %d is shutting down', os.getpid())
+        for server in self.servers:
+            server.shutdown()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+            metrics_server.server_close()
+        for server in self.servers:
+            server.stopThreads()
+        for thread in threads:
+            thread.join()
+        self.logger.info('Worker %d stopped', os.getpid())
+
+class PreforkServer(object):
+    """Pre-forks worker processes and keeps them running until it receives
+    SIGTERM or SIGINT, then stops all workers gracefully
+
+    """
+
+    def __init__(self, config, servers, workers=1, logger=None):
+        self.logger = logger
+        if self.logger is None:
+            self.logger = logging.getLogger(__name__)
+        self.config = config
+        self.servers = servers
+        self.workers = workers
+        # pid -> index of worker
+        self._children = {}
+        self._stopping = False
+
+    def _spawn(self, index):
+        pid = os.fork()
+        if pid:
+            self._children[pid] = index
+            return
+        # child process
+        code = 0
+        try:
+            worker = Worker(self.config, self.servers, self.logger, index)
+            handler = lambda signum, frame: worker.stop()
+            signal.signal(signal.SIGTERM, handler)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            worker.run()
+        except:
+            self.logger.exception('Worker %d failed', os.getpid())
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+
+    def serve_forever(self):
+        """Run workers until stopped
+
+        """
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for i in xrange(self.workers):
+            self._spawn(i)
+
+        while not self._stopping:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError, e:
+                if e.errno != errno.EINTR:
+                    raise
+                continue
+            if not pid:
+                time.sleep(0.5)
+                continue
+            index = self._children.pop(pid, None)
+            if index is None:
+                continue
+            self.logger.warn('Worker %d exited with status %d, respawn',
+                             pid, status)
+            # don't respawn too fast when workers keep failing
+            time.sleep(1)
+            self._spawn(index)
+
+        self.logger.info('Shutting down %d workers', len(self._children))
+        for pid in self._children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, 0)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.ECHILD:
+                    break
+                raise
+            self._children.pop(pid, None)
+        for server in self.servers:
+            server.server_close()
+        self.logger.info('Server stopped')
+
+def serve(config, logger=None):
+    """Run segmentation servers configured in config
+
+    """
+    if logger is None:
+        logger = logging.getLogger(__name__)
+    xcfg = config.get('xmlrpc') or {}
+    interface = xcfg.get('interface', '0.0.0.0')
+    port = xcfg.get('port', 5566)
+    workers = xcfg.get('workers', 1)
+    threads = xcfg.get('threads', 4)
+    logger.info('Start segmentation service at %s:%d, %d workers with '
+                '%d threads', interface, port, workers, threads)
+    servers = [XMLRPCServer((interface, port), threads, logger)]
+    
+    jcfg = config.get('jsonline')
+    if jcfg:
+        interface = jcfg.get('interface', '0.0.0.0')
+        port = jcfg.get('port', 5567)
+        threads = jcfg.get('threads', 16)
+        idle_timeout = jcfg.get('idle_timeout', 30)
+        logger.info('Start JSON-lines service at %s:%d with %d threads', 
+                    interface, port, threads)
+        servers.append(JSONLineServer((interface, port), threads, logger,
+                                      idle_timeout))
+
+    if workers > 1:
+        PreforkServer(config, servers, workers, logger).serve_forever()
+        return
+
+    # single worker runs in this process
+    worker = Worker(config, servers, logger)
+    handler = lambda signum, frame: worker.stop()
+    signal.signal(signal.SIGTERM, handler)
+    signal.signal(signal.SIGINT, handler)
+    worker.run()
+    for server in servers:
+        server.server_close()
@@ -1,76 +1,330 @@
 # -*- coding: utf8 -*-
 import logging
 
-import redis
-
 from loso import lexicon
+from loso import backends
+from loso.cache import LRUCache
+from loso.metrics import Metrics, InstrumentedBackend
+
+def _weighSegment(key, terms):
+    """Get approximate size in bytes of a segmentation cache entry
+    
+    """
+    sentence, _ = key
+    return len(sentence.encode('utf8')) + sum(len(term.encode('utf8')) 
+                                              for term in terms)
 
 class SegumentService(object):
     
-    def __init__(self, config, logger=None):
+    def __init__(self, config, logger=None, backend=None):
         self.logger = logger
         if self.logger is None:
             self.logger = logging.getLogger(__name__)
         self.ngram = 4
+        self.batch_size = 1000
+        self.feed_workers = 1
+        self.feed_flush_terms = 1000000
+        self.feed_exact_variety = True
+        self.feed_refinalize = False
+        self.cache_size = 0
+        self.cache_ttl = 60
+        self.engine = 'table'
+        self.frozen = {}
+        self.segment_cache_size = 0
+        self.segment_cache_bytes = None
+        self.segment_cache_ttl = None
+        self.segment_cache_check = 1
+        self.hash_buckets = 0
+        self.bloom_error_rate = 0
+        self.bloom_capacity = 1000000
+        self.metrics_enabled = False
         self.config = config
 
         # get ngram configuration
         c = config.get('lexicon')
         if c:
             self.ngram = c.get('ngram', self.ngram)
+            self.batch_size = c.get('batch_size', self.batch_size)
+            self.feed_workers = c.get('feed_workers', self.feed_workers)
+            self.feed_flush_terms = c.get('feed_flush_terms', 
+                                          self.feed_flush_terms)
+            self.feed_exact_variety = c.get('feed_exact_variety', 
+                                            self.feed_exact_variety)
+            self.feed_refinalize = c.get('feed_refinalize', 
+                                         self.feed_refinalize)
+            self.cache_size = c.get('cache_size', self.cache_size)
+            self.cache_ttl = c.get('cache_ttl', self.cache_ttl)
+            self.engine = c.get('engine', self.engine)
+            self.frozen = c.get('frozen') or self.frozen
+            self.segment_cache_size = c.get('segment_cache_size', 
+                                            self.segment_cache_size)
+            self.segment_cache_bytes = c.get('segment_cache_bytes', 
+                                             self.segment_cache_bytes)
+            self.segment_cache_ttl = c.get('segment_cache_ttl', 
+                                           self.segment_cache_ttl)
+            self.segment_cache_check = c.get('segment_cache_check', 
+                                             self.segment_cache_check)
+            self.hash_buckets = c.get('hash_buckets', self.hash_buckets)
+            self.bloom_error_rate = c.get('bloom_error_rate', 
+                                          self.bloom_error_rate)
+            self.bloom_capacity = c.get('bloom_capacity', self.bloom_capacity)
+        c = config.get('metrics')
+        if c:
+            self.metrics_enabled = c.get('enabled', self.metrics_enabled)
+        self.metrics = Metrics(self.metrics_enabled)
 
-        # get redis config
-        c = config.get('redis', {})
-        redis_db = redis.Redis(**c)
+        # get storage backend, with redis backend but without redis section, 
+        # only frozen categories are served. A given backend is used instead
+        # of the configured one
+        if backend is None:
+            backend = backends.createBackend(config)
+        # only pay for timing backend calls when metrics are enabled
+        if backend is not None and self.metrics.enabled:
+            backend = InstrumentedBackend(backend, self.metrics)
 
-        self.db = lexicon.LexiconDatabase(redis_db)
-        self.builder = lexicon.LexiconBuilder(self.db, self.ngram)
+        self.db = lexicon.LexiconDatabase(
+            backend, 
+            ngram=self.ngram,
+            cache_size=self.cache_size, 
+            cache_ttl=self.cache_ttl,
+            engine=self.engine,
+            metrics=self.metrics,
+            buckets=self.hash_buckets,
+            bloom_error_rate=self.bloom_error_rate,
+            bloom_capacity=self.bloom_capacity
+        )
+        for name, path in self.frozen.iteritems():
+            self.db.attachFrozen(name, path)
+        # load bloom filters before serving, rather than in the first request
+        if backend is not None:
+            self.db.loadBloomFilters()
+        self.builder = lexicon.LexiconBuilder(self.db, self.ngram, 
+                                              self.batch_size, 
+                                              self.feed_workers,
+                                              self.feed_flush_terms,
+                                              self.feed_exact_variety,
+                                              self.feed_refinalize)
+        
+        # cache of segmentation results, (sentence, categories) -> terms, 
+        # results of changed categories are discarded when version of the 
+        # registry changes
+        self.segment_cache = None
+        # version of registry and categories the cached results are split 
+        # with, and when the version was checked
+        self._segment_version = None
+        self._segment_versions = {}
+        self._segment_checked = None
+        if self.segment_cache_size:
+            self.segment_cache = LRUCache(
+                self.segment_cache_size, 
+                ttl=self.segment_cache_ttl,
+                max_weight=self.segment_cache_bytes,
+                weigher=_weighSegment
+            )
+        self.metrics.addCollector(self._collectCacheMetrics)
+    
+    def _collectCacheMetrics(self):
+        """Get hit rates and sizes of caches as metric gauges
+        
+        """
+        gauges = []
+        caches = [('term', self.db.cache), ('segment', self.segment_cache)]
+        for name, cache in caches:
+            if cache is None:
+                continue
+            stats = cache.getStats()
+            gauges.append(('cache_hit_rate', name, stats['hit_rate']))
+            gauges.append(('cache_size', name, stats['size']))
+        return gauges
+    
+    def getMetrics(self):
+        """Get runtime metrics, timers are count, sum and max of seconds 
+        spent in every stage and backend command
+        
+        """
+        return self.metrics.getMetrics()
     
     def getStats(self):
         """Get statistics information
         
         """
-        return self.db.getStats()
+        stats = self.db.getStats()
+        stats['segment_cache'] = None
+        if self.segment_cache is not None:
+            stats['segment_cache'] = self.segment_cache.getStats()
+        return stats
     
     def feed(self, category, text):
         """Feed text data to lexicon database
         
         """
         self.logger.info('Feed %d bytes data', len(text))
-        return self.builder.feed(category, text)
+        result = self.builder.feed(category, text)
+        # check the version on next request, rather than serving results of 
+        # this process for a while
+        self._segment_checked = None
+        return result
+    
+    def mergeCategories(self, categories):
+        """Build merged category of categories, so that splitting terms with
+        them costs the same as with one category
+        
+        """
+        self.logger.info('Merge categories %s', ', '.join(categories))
+        return self.db.mergeCategories(categories)
+    
+    def _checkSegmentCache(self):
+        """Discard cached segmentation results of categories which changed, 
+        categories may be fed, loaded, finalized or cleaned by any process. 
+        The version of registry is checked at most once in every 
+        segment_cache_check seconds, a version read by the last lookup is 
+        used if it is new enough, versions of categories are only read when
+        the version of registry changed
+        
+        """
+        now = self.db.timer()
+        if (self._segment_checked is not None and 
+            now - self._segment_checked < self.segment_cache_check):
+            return
+        self._segment_checked = now
+        version = self.db.getVersion(self.segment_cache_check)
+        if version == self._segment_version:
+            return
+        names = self.db.getCategoryList().union(self._segment_versions)
+        versions = self.db.getCategoryVersions(names)
+        changed = set(name for name in names 
+                      if versions[name] != self._segment_versions.get(name))
+        if changed:
+            self.logger.info('Discard split sentences of %s', 
+                             ', '.join(sorted(changed)))
+            # results split with all categories change with any of them
+            self.segment_cache.discardIf(
+                lambda key: key[1] is None or changed.intersection(key[1]))
+        self._segment_version = version
+        self._segment_versions = versions
+    
+    def _splitSentences(self, mixed_terms, categories):
+        """Split sentences into terms, mixed_terms is a dict maps sentence to
+        its Chinese parts and English terms, return a dict maps sentence to a
+        tuple of terms. Chinese parts of all sentences are split together, so
+        that scores of their candidate terms are fetched in one round trip
+        
+        """
+        results = {}
+        missing = []
+        if self.segment_cache is not None:
+            self._checkSegmentCache()
+        for sentence in mixed_terms:
+            terms = None
+            if self.segment_cache is not None:
+                terms = self.segment_cache.get((sentence, categories))
+            if terms is None:
+                missing.append(sentence)
+            else:
+                results[sentence] = terms
+        if not missing:
+            return results
+        
+        chinese = set()
+        for sentence in missing:
+            chinese.update(mixed for mixed in mixed_terms[sentence] 
+                           if not mixed.startswith('E'))
+        chinese = list(chinese)
+        chinese_terms = dict(zip(chinese, 
+                                 self.db.splitTermsList(chinese, categories)))
+        
+        for sentence in missing:
+            terms = []
+            for mixed in mixed_terms[sentence]:
+                # English term
+                if mixed.startswith('E'):
+                    terms.append(mixed)
+                # Chinese sentence
+                else:
+                    terms.extend(chinese_terms[mixed])
+            terms = tuple(terms)
+            if self.segment_cache is not None:
+                self.segment_cache.set((sentence, categories), terms)
+            results[sentence] = terms
+        return results
+    
+    def splitTermsBatch(self, texts, categories=None):
+        """Split many texts into terms, return a list of term lists. Same
+        sentences and candidate terms in all texts are looked up only once
+        
+        """
+        if categories:
+            categories = tuple(sorted(set(categories)))
+        else:
+            categories = None
+        text_sentences = []
+        mixed_terms = {}
+        # sentences and their Chinese parts and English terms in one pass
+        with self.metrics.timer('stage', 'tokenize'):
+            for text in texts:
+                sentences = []
+                for sentence, mixed in lexicon.iterSentenceTerms(text):
+                    if sentence:
+                        sentences.append(sentence)
+                        mixed_terms[sentence] = mixed
+                text_sentences.append(sentences)
+        results = self._splitSentences(mixed_terms, categories)
+        
+        terms_list = []
+        for sentences in text_sentences:
+            terms = []
+            for sentence in sentences:
+                terms.extend(results[sentence])
+            terms_list.append(terms)
+        return terms_list
         
     def splitTerms(self, text, categories=None):
         """Split text into terms
         
+        """
+        return self.splitTermsBatch([text], categories)[0]
+    
+    def _splitNgramSentence(self, mixed_terms):
+        """Split Chinese parts and English terms of a sentence into 1 to n 
+        gram terms
+        
         """
         terms = []
-        for sentence in lexicon.splitSentence(text):
-            if sentence:
-                for mixed in lexicon.iterMixTerms(sentence):
-                    # English term
-                    if mixed.startswith('E'):
-                        terms.append(mixed)
-                    # Chinese sentence
-                    else:
-                        terms.extend(self.db.splitTerms(mixed, categories))
+        for mixed in mixed_terms:
+            # English term
+            if mixed.startswith('E'):
+                terms.append(mixed)
+            # Chinese sentence
+            else:
+                for n in xrange(1, self.ngram+1):
+                    terms.extend(lexicon.iterTerms(n, mixed, False))
         return terms
     
+    def splitNgramTermsBatch(self, texts):
+        """Split many texts into 1 to n gram terms, return a list of term 
+        lists. Same sentences in all texts are split only once
+        
+        """
+        results = {}
+        terms_list = []
+        for text in texts:
+            terms = []
+            for sentence, mixed in lexicon.iterSentenceTerms(text):
+                if not sentence:
+                    continue
+                sentence_terms = results.get(sentence)
+                if sentence_terms is None:
+                    sentence_terms = self._splitNgramSentence(mixed)
+                    results[sentence] = sentence_terms
+                terms.extend(sentence_terms)
+            terms_list.append(terms)
+        return terms_list
+    
     def splitNgramTerms(self, text):
         """Split text into 1 to n gram terms
         
         """
-        terms = []
-        for sentence in lexicon.splitSentence(text):
-            if sentence:
-                for mixed in lexicon.iterMixTerms(sentence):
-                    # English term
-                    if mixed.startswith('E'):
-                        terms.append(mixed)
-                    # Chinese sentence
-                    else:
-                        for n in xrange(1, self.ngram+1):
-                            terms.extend(lexicon.iterTerms(n, mixed, False))
-        return terms
+        return self.splitNgramTermsBatch([text])[0]
     
     def splitSentence(self, text):
         """Split text into sentence
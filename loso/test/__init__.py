@@ -0,0 +1,46 @@
+# -*- coding: utf8 -*-
+import random
+
+from loso import lexicon
+
+_english_words = [u'iPhone', u'blog', u'ip', u'block', u'NBA', u"don't"]
+
+_delimiters = u'，。、；：！ \n'
+
+def makeText(size, seed=0, vocabulary_size=300):
+    """Make a text of about size characters with the same words every time
+    for the same seed, common words show up more often like in real text
+
+    """
+    rand = random.Random(seed)
+    vocabulary = []
+    for i in xrange(vocabulary_size):
+        length = rand.choice((1, 1, 2, 2, 2, 3, 4))
+        vocabulary.append(u''.join(unichr(0x4e00 + rand.randrange(500))
+                                   for _ in xrange(length)))
+    parts = []
+    total = 0
+    while total < size:
+        sentence = []
+        for _ in xrange(rand.randint(2, 8)):
+            if rand.random() < 0.05:
+                sentence.append(u' %s ' % rand.choice(_english_words))
+            else:
+                # words in front of the vocabulary are more common
+                index = int(rand.expovariate(1.0/40))
+                sentence.append(vocabulary[index % vocabulary_size])
+        sentence = u''.join(sentence).strip()
+        parts.append(sentence)
+        parts.append(rand.choice(_delimiters))
+        total += len(sentence) + 1
+    return u''.join(parts)
+
+def iterChinese(text):
+    """Iterate runs of Chinese characters in text, which are what the service
+    splits into terms
+
+    """
+    for sentence in lexicon.splitSentence(text):
+        for term in lexicon.iterMixTerms(sentence):
+            if not term.startswith('E'):
+                yield term
@@ -0,0 +1,110 @@
+# -*- coding: utf8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from loso import lexicon
+from loso.backends import MemoryBackend, SQLiteBackend, createBackend
+from loso.test import makeText, iterChinese
+
+corpus = makeText(5000, seed=0)
+sample = makeText(1000, seed=1)
+
+class TestBackends(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def createBackends(self, name='lexicon.db'):
+        return [
+            MemoryBackend(),
+            SQLiteBackend(os.path.join(self.dir, name)),
+        ]
+
+    def testCommands(self):
+        for backend in self.createBackends():
+            self.assertEqual(backend.get('a'), None)
+            backend.set('a', u'中文')
+            self.assertEqual(backend.get('a'), u'中文'.encode('utf8'))
+            self.assertEqual(backend.incr('n'), 1)
+            self.assertEqual(backend.incr('n', 5), 6)
+            self.assertEqual(backend.mget(['a', 'missing', 'n']),
+                             [u'中文'.encode('utf8'), None, '6'])
+            backend.sadd('s', 'x', 'y')
+            backend.sadd('s', 'y', 'z')
+            backend.srem('s', 'x')
+            self.assertEqual(backend.smembers('s'), set(['y', 'z']))
+            backend.delete('a', 's')
+            self.assertEqual(backend.get('a'), None)
+            self.assertEqual(backend.smembers('s'), set())
+
+    def testPipeline(self):
+        for backend in self.createBackends():
+            pipe = backend.pipeline(transaction=False)
+            pipe.set('a', 1)
+            pipe.incr('a', 2)
+            pipe.get('a')
+            self.assertEqual(len(pipe), 3)
+            self.assertEqual(pipe.execute()[1:], [3, '3'])
+            # nothing is sent before execute
+            pipe = backend.pipeline()
+            pipe.set('b', 1)
+            self.assertEqual(backend.get('b'), None)
+
+    def testCreateBackend(self):
+        config = dict(lexicon=dict(backend='memory'))
+        self.assertTrue(isinstance(createBackend(config), MemoryBackend))
+        path = os.path.join(self.dir, 'config.db')
+        config = dict(lexicon=dict(backend='sqlite', sqlite_path=path))
+        self.assertTrue(isinstance(createBackend(config), SQLiteBackend))
+        self.assertEqual(createBackend(dict(lexicon={})), None)
+        config = dict(lexicon=dict(backend='unknown'))
+        self.assertRaises(ValueError, createBackend, config)
+
+    def testFeed(self):
+        # counts stored in backends are the same as counting in process
+        texts = list(iterChinese(sample))
+        results = []
+        for backend in self.createBackends():
+            db = lexicon.LexiconDatabase(backend)
+            lexicon.LexiconBuilder(db, 4).feed('news', corpus)
+            cat = db.getCategory('news')
+            for n in xrange(1, 5):
+                expected = {}
+                for term in lexicon.iterTerms(n, corpus):
+                    expected[term] = expected.get(term, 0) + 1
+                self.assertEqual(cat.getGramSum(n), sum(expected.values()))
+                self.assertEqual(cat.getGramVariety(n), len(expected))
+                terms = expected.keys()
+                self.assertEqual(map(int, cat.getTerms(*terms)),
+                                 [expected[term] for term in terms])
+            results.append(db.splitTermsList(texts))
+        self.assertEqual(results[0], results[1])
+
+    def testBuckets(self):
+        # counts in hash buckets are the same as counts in keys
+        texts = list(iterChinese(sample))
+        db = lexicon.LexiconDatabase(MemoryBackend())
+        lexicon.LexiconBuilder(db, 4).feed('news', corpus)
+        cat = db.getCategory('news')
+        expected = sorted(cat.iterTermCounts())
+        split = db.splitTermsList(texts)
+        for backend in self.createBackends('buckets.db'):
+            db = lexicon.LexiconDatabase(backend, buckets=64)
+            lexicon.LexiconBuilder(db, 4).feed('news', corpus)
+            cat = db.getCategory('news')
+            self.assertEqual(cat.buckets, 64)
+            self.assertEqual(cat.getTermCount(), len(expected))
+            self.assertEqual(sorted(cat.iterTermCounts()), expected)
+            self.assertEqual(db.splitTermsList(texts), split)
+            # no key per term
+            self.assertEqual(cat.getTerm(expected[0][0]), expected[0][1])
+            self.assertEqual(backend.get(cat._lexicon_prefix + 
+                                         expected[0][0]), None)
+
+if __name__ == '__main__':
+    unittest.main()
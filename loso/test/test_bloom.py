@@ -0,0 +1,119 @@
+# -*- coding: utf8 -*-
+import random
+import unittest
+
+from loso import lexicon
+from loso.bloom import BloomFilter
+from loso.backends import MemoryBackend
+from loso.test import makeText, iterChinese
+
+corpus = makeText(5000, seed=0)
+texts = list(iterChinese(makeText(1000, seed=1)))
+
+class CountingBackend(MemoryBackend):
+    """Memory backend counts keys read by mget and bitop commands
+
+    """
+
+    def __init__(self):
+        MemoryBackend.__init__(self)
+        self.reads = 0
+        self.bitops = 0
+
+    def mget(self, keys):
+        self.reads += len(keys)
+        return MemoryBackend.mget(self, keys)
+
+    def bitop(self, operation, dest, *keys):
+        self.bitops += 1
+        return MemoryBackend.bitop(self, operation, dest, *keys)
+
+class TestBloomFilter(unittest.TestCase):
+
+    def testTerms(self):
+        rand = random.Random(0)
+        terms = set(u''.join(unichr(0x4e00 + rand.randrange(500))
+                             for _ in xrange(rand.randint(1, 4)))
+                    for _ in xrange(2000))
+        bloom = BloomFilter.create(len(terms), 0.01)
+        bloom.update(terms)
+        # no false negatives
+        for term in terms:
+            self.assertTrue(term in bloom)
+            self.assertTrue(term.encode('utf8') in bloom)
+        others = [u'x%d' % i for i in xrange(10000)]
+        errors = sum(1 for term in others if term in bloom)
+        self.assertTrue(errors < 300, errors)
+        self.assertAlmostEqual(bloom.estimateCount(), len(terms),
+                               delta=len(terms)*0.1)
+        copy = BloomFilter(bloom.size, bloom.hashes, bloom.toString())
+        self.assertTrue(all(term in copy for term in terms))
+        self.assertEqual(bloom.copy(empty=True).countBits(), 0)
+
+class TestBloomGating(unittest.TestCase):
+
+    def createDatabase(self, **kwargs):
+        db = lexicon.LexiconDatabase(CountingBackend(), **kwargs)
+        builder = lexicon.LexiconBuilder(db, 4)
+        builder.feed('news', corpus)
+        builder.feed('blog', makeText(3000, seed=3))
+        db.backend.reads = 0
+        return db
+
+    def testSplitTerms(self):
+        # the same segmentation with and without filters
+        db = self.createDatabase()
+        bloom = self.createDatabase(bloom_error_rate=0.01,
+                                    bloom_capacity=50000)
+        for names in (None, ['news'], ['news', 'blog']):
+            bloom.getCategory('news').bloom
+            bloom.getCategory('blog').bloom
+            bloom.backend.reads = db.backend.reads = 0
+            self.assertEqual(bloom.splitTermsList(texts, names),
+                             db.splitTermsList(texts, names))
+            # counts of terms not in filters are not read
+            self.assertTrue(bloom.backend.reads < db.backend.reads)
+
+    def testKnownTerms(self):
+        # feeding terms which are in the filter uploads nothing
+        db = self.createDatabase(bloom_error_rate=0.01, bloom_capacity=50000)
+        bitops = db.backend.bitops
+        lexicon.LexiconBuilder(db, 4).feed('news', corpus[:200])
+        self.assertEqual(db.backend.bitops, bitops)
+        lexicon.LexiconBuilder(db, 4).feed('news', u'魑魅魍魉')
+        self.assertEqual(db.backend.bitops, bitops + 1)
+
+    def testOtherProcess(self):
+        # other processes download a filter again only when it has new terms
+        db = self.createDatabase(bloom_error_rate=0.01, bloom_capacity=50000)
+        other = lexicon.LexiconDatabase(db.backend)
+        news = other.getCategory('news').bloom
+        blog = other.getCategory('blog').bloom
+        lexicon.LexiconBuilder(db, 4).feed('news', corpus[:200])
+        other.getVersion()
+        self.assertTrue(other.getCategory('news').bloom is news)
+        lexicon.LexiconBuilder(db, 4).feed('news', u'魑魅魍魉')
+        other.getVersion()
+        self.assertTrue(u'魑魅魍魉' in other.getCategory('news').bloom)
+        self.assertTrue(other.getCategory('blog').bloom is blog)
+
+    def testRebuild(self):
+        db = self.createDatabase()
+        split = db.splitTermsList(texts)
+        category = db.getCategory('news')
+        self.assertEqual(category.bloom, None)
+        whole = category.getTermCount()
+        self.assertEqual(category.rebuildBloom(0.01), whole)
+        bloom = category.bloom
+        self.assertEqual(bloom.hashes, 7)
+        self.assertTrue(all(term in bloom for term, _
+                            in category.iterTermCounts()))
+        self.assertEqual(db.splitTermsList(texts), split)
+        # terms fed later are added to the filter
+        lexicon.LexiconBuilder(db, 4).feed('news', u'魑魅魍魉')
+        self.assertTrue(u'魑魅魍魉' in db.getCategory('news').bloom)
+        self.assertEqual(category.rebuildBloom(0), 0)
+        self.assertEqual(db.getCategory('news').bloom, None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# -*- coding: utf8 -*-
+import unittest
+
+from loso import lexicon
+from loso.backends import MemoryBackend
+from loso.test import makeText
+
+corpus = makeText(20000, seed=0)
+
+def dumpCategory(db, name):
+    """Get (meta, sorted term counts) of a category
+
+    """
+    cat = db.getCategory(name)
+    meta = [(cat.getGramSum(n), cat.getGramVariety(n))
+            for n in xrange(1, cat.gram + 1)]
+    terms = sorted(cat.getTermList())
+    return meta, zip(terms, cat.getTerms(*terms))
+
+def feed(text, **kwargs):
+    db = lexicon.LexiconDatabase(MemoryBackend())
+    lexicon.LexiconBuilder(db, 4, **kwargs).feed('news', text)
+    return dumpCategory(db, 'news')
+
+def feedStream(chunks, flush_terms, workers=1):
+    db = lexicon.LexiconDatabase(MemoryBackend())
+    builder = lexicon.LexiconBuilder(db, 4, flush_terms=flush_terms)
+    builder.block_size = 2000
+    builder.feedStream('news', chunks, workers=workers)
+    return dumpCategory(db, 'news')
+
+class TestBuilder(unittest.TestCase):
+
+    def testCountTerms(self):
+        counts = lexicon.countTerms(corpus, 4)
+        for n in xrange(1, 5):
+            expected = {}
+            for term in lexicon.iterTerms(n, corpus):
+                expected[term] = expected.get(term, 0) + 1
+            self.assertEqual(counts[n-1], expected)
+        # counted into given counts
+        expected = dict((term, count*2) for term, count 
+                        in counts[0].iteritems())
+        self.assertEqual(lexicon.countTerms(corpus, 4, counts)[0], expected)
+
+    def testFeedWorkers(self):
+        expected = feed(corpus)
+        self.assertEqual(feed(corpus, workers=3), expected)
+        # text which is shorter than chunks of workers
+        self.assertEqual(feed(corpus[:10], workers=4), feed(corpus[:10]))
+
+    def testFeedStream(self):
+        # sentences are split across chunks
+        chunks = [corpus[i:i+500] for i in xrange(0, len(corpus), 500)]
+        self.assertEqual(feedStream(chunks, 1000000), feed(corpus))
+
+    def testFlush(self):
+        # n-gram variety counts a term once across flushes
+        chunks = [corpus[i:i+500] for i in xrange(0, len(corpus), 500)]
+        expected = feed(corpus)
+        for workers in (1, 2):
+            db = lexicon.LexiconDatabase(MemoryBackend())
+            builder = lexicon.LexiconBuilder(db, 4, flush_terms=3000)
+            builder.block_size = 2000
+            builder.feedStream('news', chunks, workers=workers)
+            self.assertEqual(dumpCategory(db, 'news'), expected)
+            # temporary set of flushed terms is deleted
+            self.assertEqual([key for key in db.backend.data 
+                              if ':feed:' in key], [])
+
+    def testInexactVariety(self):
+        # every flush counts its terms in variety without the set
+        chunks = [corpus[i:i+500] for i in xrange(0, len(corpus), 500)]
+        meta, counts = feed(corpus)
+        db = lexicon.LexiconDatabase(MemoryBackend())
+        builder = lexicon.LexiconBuilder(db, 4, flush_terms=3000, 
+                                         exact_variety=False)
+        builder.block_size = 2000
+        builder.feedStream('news', chunks)
+        stream_meta, stream_counts = dumpCategory(db, 'news')
+        self.assertEqual(stream_counts, counts)
+        for (gram_sum, variety), (stream_sum, stream_variety) in zip(
+                meta, stream_meta):
+            self.assertEqual(stream_sum, gram_sum)
+            self.assertTrue(stream_variety > variety)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+# -*- coding: utf8 -*-
+import unittest
+
+from loso import lexicon
+from loso.cache import LRUCache
+from loso.backends import MemoryBackend
+from loso.test import makeText, iterChinese
+
+corpus = makeText(3000, seed=0)
+more = makeText(3000, seed=2)
+
+class Clock(object):
+    """Timer of which time is set by tests
+
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestLRUCache(unittest.TestCase):
+
+    def testGetSet(self):
+        cache = LRUCache(10)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('a', 0), 0)
+        cache.set('a', 1)
+        cache.set('b', None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b', 0), None)
+        stats = cache.getStats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 2))
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def testEviction(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        # a is used recently, so b is evicted
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.getStats()['evictions'], 1)
+
+    def testTTL(self):
+        clock = Clock()
+        cache = LRUCache(10, ttl=5, timer=clock)
+        cache.set('a', 1)
+        clock.now = 4.9
+        self.assertEqual(cache.get('a'), 1)
+        clock.now = 5
+        self.assertEqual(cache.get('a'), None)
+        # entries never expire without ttl
+        cache = LRUCache(10, timer=clock)
+        cache.set('a', 1)
+        clock.now = 1000000
+        self.assertEqual(cache.get('a'), 1)
+
+    def testDiscard(self):
+        cache = LRUCache(10)
+        for key in ('cat:a', 'cat:b', 'other'):
+            cache.set(key, 1)
+        cache.discard('cat:a', 'missing')
+        self.assertEqual(cache.get('cat:a'), None)
+        cache.discardIf(lambda key: key.startswith('cat:'))
+        self.assertEqual(cache.get('cat:b'), None)
+        self.assertEqual(cache.get('other'), 1)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def testWeight(self):
+        cache = LRUCache(10, max_weight=10, 
+                         weigher=lambda key, value: len(value))
+        cache.set('a', 'x'*4)
+        cache.set('b', 'x'*4)
+        self.assertEqual(cache.weight, 8)
+        # a is evicted to make room for c
+        cache.set('c', 'x'*4)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.weight, 8)
+        # replacing a value takes its old weight back
+        cache.set('b', 'x')
+        self.assertEqual(cache.weight, 5)
+        cache.discard('c')
+        self.assertEqual(cache.weight, 1)
+
+class RacingBackend(MemoryBackend):
+    """Memory backend runs a function right before executing a pipeline, like
+    another thread reading in between
+
+    """
+
+    before_execute = None
+
+    def _execute(self, commands):
+        if self.before_execute is not None:
+            self.before_execute()
+        return MemoryBackend._execute(self, commands)
+
+class TestDatabaseCache(unittest.TestCase):
+
+    def testFeed(self):
+        texts = list(iterChinese(makeText(1000, seed=1)))
+        db = lexicon.LexiconDatabase(MemoryBackend())
+        cached = lexicon.LexiconDatabase(MemoryBackend(), cache_size=100000)
+        for d in (db, cached):
+            lexicon.LexiconBuilder(d, 4).feed('news', corpus)
+        self.assertEqual(cached.splitTermsList(texts), db.splitTermsList(texts))
+        self.assertTrue(cached.cache.getStats()['misses'] > 0)
+        # cached counts and meta data are discarded after feeding
+        for d in (db, cached):
+            lexicon.LexiconBuilder(d, 4).feed('news', more)
+        self.assertEqual(cached.splitTermsList(texts), db.splitTermsList(texts))
+        self.assertEqual(cached.getCategory('news').getGramSum(1), 
+                         db.getCategory('news').getGramSum(1))
+
+    def testRead(self):
+        # a value read before the write completes is not left in cache
+        db = lexicon.LexiconDatabase(RacingBackend(), cache_size=100)
+        category = db.addCategory('news')
+        category.increaseTerms([(u'中文', 1)], {2: 1})
+        self.assertEqual(category.getTerm(u'中文'), '1')
+        def read():
+            category.getTerm(u'中文')
+            category.getGramSum(2)
+        db.backend.before_execute = read
+        category.increaseTerms([(u'中文', 1)], {2: 1})
+        db.backend.before_execute = None
+        self.assertEqual(category.getTerm(u'中文'), '2')
+        self.assertEqual(category.getGramSum(2), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,375 @@
+# -*- coding: utf8 -*-
+import os
+import codecs
+import shutil
+import tempfile
+import unittest
+
+from loso import lexicon
+from loso.frozen import iterDump
+from loso.backends import MemoryBackend
+from loso.test import makeText, iterChinese
+
+corpus = makeText(5000, seed=0)
+# Chinese runs of a sample to split
+texts = list(iterChinese(makeText(1000, seed=1)))
+
+class RepeatingBackend(MemoryBackend):
+    """Memory backend of which SSCAN returns every other member twice, like
+    Redis does when a set is rehashed during the scan
+
+    """
+
+    def sscan_iter(self, key, count=None):
+        for i, member in enumerate(MemoryBackend.sscan_iter(self, key, count)):
+            yield member
+            if i % 2:
+                yield member
+
+def createDatabase(text=corpus, backend=None):
+    if backend is None:
+        backend = MemoryBackend()
+    db = lexicon.LexiconDatabase(backend)
+    lexicon.LexiconBuilder(db, 4).feed('news', text)
+    return db
+
+def getCounts(category):
+    """Get a dict maps terms of category to their counts, terms without 
+    count are skipped like dump does
+
+    """
+    terms = category.getTermList()
+    return dict((term, int(count)) for term, count 
+                in zip(terms, category.getTerms(*terms)) if count is not None)
+
+def getMeta(category):
+    meta = dict(gram=category.gram)
+    for n in xrange(1, category.gram + 1):
+        meta['%d-gram-sum' % n] = category.getGramSum(n)
+        meta['%d-gram-variety' % n] = category.getGramVariety(n)
+    return meta
+
+class TestDump(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = createDatabase()
+        self.category = self.db.getCategory('news')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def dump(self, category):
+        path = os.path.join(self.dir, '%s.txt' % category.name)
+        with codecs.open(path, 'wt', encoding='utf8') as file:
+            category.dump(file)
+        return path
+
+    def testIterTermCounts(self):
+        expected = getCounts(self.category)
+        self.assertEqual(self.category.getTermCount(), len(expected))
+        for scan_size in (1, 7, 1000000):
+            items = list(self.category.iterTermCounts(scan_size))
+            self.assertEqual(len(items), len(expected))
+            self.assertEqual(dict((term, int(count)) for term, count
+                                  in items), expected)
+
+    def testRepeatedTerms(self):
+        # terms dumped twice are loaded once in replace mode
+        db = createDatabase(backend=RepeatingBackend())
+        category = db.getCategory('news')
+        items = list(category.iterTermCounts(7))
+        self.assertTrue(len(items) > category.getTermCount())
+        self.assertEqual(dict(items), dict(self.category.iterTermCounts()))
+        path = self.dump(category)
+        db = lexicon.LexiconDatabase(MemoryBackend())
+        self.load(db, path, 'replace')
+        self.assertEqual(getCounts(db.getCategory('news')),
+                         getCounts(self.category))
+
+    def testDump(self):
+        path = self.dump(self.category)
+        with codecs.open(path, 'rt', encoding='utf8') as file:
+            meta, terms = iterDump(file)
+            terms = list(terms)
+        self.assertEqual(meta, getMeta(self.category))
+        self.assertEqual(len(terms), self.category.getTermCount())
+        self.assertEqual(dict((term.encode('utf8'), count)
+                              for term, count in terms),
+                         getCounts(self.category))
+
+    def load(self, db, path, mode):
+        category = db.addCategory('news')
+        with codecs.open(path, 'rt', encoding='utf8') as file:
+            return category.load(file, mode, batch_size=100)
+
+    def testLoad(self):
+        path = self.dump(self.category)
+        expected = getCounts(self.category)
+        for mode in ('merge', 'replace'):
+            db = lexicon.LexiconDatabase(MemoryBackend())
+            self.assertEqual(self.load(db, path, mode), len(expected))
+            category = db.getCategory('news')
+            self.assertEqual(getCounts(category), expected)
+            self.assertEqual(getMeta(category), getMeta(self.category))
+            self.assertEqual(db.splitTermsList(texts), 
+                             self.db.splitTermsList(texts))
+
+    def testMerge(self):
+        path = self.dump(self.category)
+        expected = getCounts(self.category)
+        meta = getMeta(self.category)
+        self.load(self.db, path, 'merge')
+        self.assertEqual(getCounts(self.category), 
+                         dict((term, count*2) for term, count 
+                              in expected.iteritems()))
+        for key, value in getMeta(self.category).iteritems():
+            if key != 'gram':
+                self.assertEqual(value, meta[key]*2)
+
+    def testReplace(self):
+        path = self.dump(self.category)
+        expected = getCounts(self.category)
+        db = createDatabase(makeText(3000, seed=3))
+        self.load(db, path, 'replace')
+        category = db.getCategory('news')
+        self.assertEqual(getCounts(category), expected)
+        # no term of the replaced category is left
+        self.assertEqual(category.getTermCount(), len(expected))
+        self.assertEqual(getMeta(category), getMeta(self.category))
+        self.assertRaises(ValueError, self.load, db, path, 'append')
+
+class TestClean(unittest.TestCase):
+
+    def setUp(self):
+        self.db = createDatabase()
+        lexicon.LexiconBuilder(self.db, 4).feed('blog', makeText(3000, 
+                                                                 seed=3))
+        self.backend = self.db.backend
+
+    def getKeys(self, name):
+        prefix = '%s%s:' % (self.db.prefix, name)
+        return [key for key in self.backend.data if key.startswith(prefix)]
+
+    def testClean(self):
+        blog = getCounts(self.db.getCategory('blog'))
+        category = self.db.getCategory('news')
+        whole = category.getTermCount()
+        self.assertNotEqual(self.getKeys('news'), [])
+        self.assertEqual(category.clean(scan_size=7), whole)
+        self.assertEqual(self.getKeys('news'), [])
+        self.assertEqual(self.db.getCategoryList(), set(['blog']))
+        self.assertEqual(getCounts(self.db.getCategory('blog')), blog)
+
+    def testCleanBuckets(self):
+        db = lexicon.LexiconDatabase(self.backend, buckets=16)
+        lexicon.LexiconBuilder(db, 4).feed('forum', corpus)
+        self.assertEqual(db.getCategory('forum').buckets, 16)
+        self.assertNotEqual(self.getKeys('forum'), [])
+        db.getCategory('forum').clean(scan_size=5)
+        self.assertEqual(self.getKeys('forum'), [])
+
+    def testCleanDatabase(self):
+        self.db.clean(scan_size=100)
+        self.assertEqual(self.getKeys('news'), [])
+        self.assertEqual(self.getKeys('blog'), [])
+        self.assertEqual(self.db.getCategoryList(), set())
+
+class TestMigrate(unittest.TestCase):
+
+    def testMigrate(self):
+        db = createDatabase()
+        category = db.getCategory('news')
+        expected = getCounts(category)
+        meta = getMeta(category)
+        split = db.splitTermsList(texts)
+        hash_prefix = category._hash_prefix
+        for buckets, old_prefix in ((64, category._lexicon_prefix), 
+                                    (7, hash_prefix + '64:'),
+                                    (0, hash_prefix + '7:')):
+            self.assertEqual(category.migrate(buckets, scan_size=100), 
+                             len(expected))
+            self.assertEqual(category.buckets, buckets)
+            self.assertEqual(getCounts(category), expected)
+            self.assertEqual(getMeta(category), meta)
+            self.assertEqual(db.splitTermsList(texts), split)
+            # keys of old layout are deleted
+            self.assertEqual([key for key in db.backend.data 
+                              if key.startswith(old_prefix)], [])
+        self.assertEqual(category.migrate(0), 0)
+
+    def testRerun(self):
+        # counts copied by a failed migration are not added again
+        db = createDatabase(backend=RepeatingBackend())
+        category = db.getCategory('news')
+        expected = getCounts(category)
+        pipe = db.backend.pipeline()
+        for term, count in sorted(expected.iteritems())[:50]:
+            category._queueSet(pipe, term, count, 16)
+        pipe.execute()
+        category.migrate(16, scan_size=100)
+        self.assertEqual(getCounts(category), expected)
+
+    def testLoad(self):
+        # loading keeps layout of the category
+        path = os.path.join(tempfile.mkdtemp(), 'news.txt')
+        try:
+            db = createDatabase()
+            category = db.getCategory('news')
+            with codecs.open(path, 'wt', encoding='utf8') as file:
+                category.dump(file)
+            expected = getCounts(category)
+            category.migrate(32)
+            for mode in ('replace', 'merge'):
+                with codecs.open(path, 'rt', encoding='utf8') as file:
+                    category.load(file, mode)
+                self.assertEqual(category.buckets, 32)
+            self.assertEqual(getCounts(category), 
+                             dict((term, count*2) for term, count 
+                                  in expected.iteritems()))
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+
+class TestMerged(unittest.TestCase):
+
+    def setUp(self):
+        self.texts = dict(news=corpus, blog=makeText(3000, seed=3),
+                          forum=makeText(2000, seed=4))
+        self.sample = makeText(1000, seed=1)
+
+    def createDatabase(self, **kwargs):
+        db = lexicon.LexiconDatabase(MemoryBackend(), **kwargs)
+        builder = lexicon.LexiconBuilder(db, 4)
+        for name, text in self.texts.iteritems():
+            builder.feed(name, text)
+        return db
+
+    def getScores(self, db, names):
+        terms = set()
+        for n in xrange(1, 5):
+            terms.update(lexicon.iterTerms(n, self.sample))
+        terms.add(u'不在詞庫')
+        categories = [db.getCategory(name) for name in names]
+        return db._getTermScores(terms, categories)
+
+    def testScores(self):
+        names = ['news', 'blog', 'forum']
+        for buckets in (0, 16):
+            db = self.createDatabase(buckets=buckets)
+            live = self.getScores(db, names)
+            split = db.splitTermsList(texts, names)
+            self.assertEqual(db.mergeCategories(names), 
+                             len(set(t for name in names for t, _ 
+                                     in db.getCategory(name).iterTermCounts())))
+            merged = db._loadMerged()[tuple(sorted(names))]
+            self.assertEqual(merged.buckets, buckets)
+            scores = merged.getScores(live.keys())
+            self.assertEqual(sorted(scores), sorted(live))
+            for term, score in live.iteritems():
+                self.assertAlmostEqual(scores[term], score, places=12)
+            self.assertEqual(db.splitTermsList(texts, names), split)
+            
+    def testInvalidate(self):
+        names = ['news', 'blog']
+        db = self.createDatabase()
+        db.mergeCategories(names)
+        merged = db._loadMerged()[tuple(sorted(names))]
+        self.assertNotEqual(merged.getScores([u'中']), None)
+        # scores come from live counts after one of categories is fed
+        other = self.createDatabase()
+        for d in (db, other):
+            lexicon.LexiconBuilder(d, 4).feed('blog', self.sample)
+        self.assertEqual(merged.getScores([u'中']), None)
+        self.assertEqual(self.getScores(db, names), 
+                         self.getScores(other, names))
+        db.mergeCategories(names)
+        self.assertNotEqual(merged.getScores([u'中']), None)
+        db.dropMerged(names)
+        self.assertEqual(db._loadMerged(), {})
+        self.assertEqual([key for key in db.backend.data 
+                          if key.startswith(merged.prefix)], [])
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        backend = MemoryBackend()
+        # two processes share one backend
+        self.db = lexicon.LexiconDatabase(backend)
+        self.other = lexicon.LexiconDatabase(backend)
+
+    def testAdd(self):
+        self.assertEqual(self.other.getCategoryList(), set())
+        self.assertEqual(self.other.getCategory('news'), None)
+        lexicon.LexiconBuilder(self.db, 4).feed('news', corpus)
+        # names not in the cached registry are looked up again
+        self.assertNotEqual(self.other.getCategory('news'), None)
+        self.assertEqual(self.other.splitTermsList(texts), 
+                         self.db.splitTermsList(texts))
+        # cached registry is dropped when a request sees the new version
+        self.db.getCategory('news').clean()
+        self.other.splitTermsList(texts)
+        self.assertEqual(self.other.getCategoryList(), set())
+
+    def testUnknown(self):
+        lexicon.LexiconBuilder(self.db, 4).feed('news', corpus)
+        news = self.other.getCategory('news')
+        # objects of unchanged categories are kept when the registry reloads
+        self.assertEqual(self.other.getCategory('blog'), None)
+        self.assertTrue(self.other.getCategory('news') is news)
+        # a name known to be missing doesn't reload until the version changes
+        registry = self.other._registry
+        self.assertEqual(self.other.getCategory('blog'), None)
+        self.assertTrue(self.other._registry is registry)
+        lexicon.LexiconBuilder(self.db, 4).feed('blog', corpus[:500])
+        self.assertNotEqual(self.other.getCategory('blog'), None)
+        self.assertTrue(self.other.getCategory('news') is news)
+        # objects are kept when only counts change, dropped when the layout
+        # changes
+        lexicon.LexiconBuilder(self.db, 4).feed('news', corpus[:500])
+        self.other.getVersion()
+        self.assertTrue(self.other.getCategory('news') is news)
+        self.db.getCategory('news').migrate(16)
+        self.other.getVersion()
+        self.assertFalse(self.other.getCategory('news') is news)
+
+    def testMigrate(self):
+        lexicon.LexiconBuilder(self.db, 4).feed('news', corpus)
+        split = self.other.splitTermsList(texts)
+        self.assertEqual(self.other.getCategory('news').buckets, 0)
+        # keys read by the other database are deleted by migrate
+        self.db.getCategory('news').migrate(16)
+        self.assertEqual(self.other.splitTermsList(texts), split)
+        self.assertEqual(self.other.getCategory('news').buckets, 16)
+        cached = lexicon.LexiconDatabase(self.db.backend, cache_size=10000)
+        self.assertEqual(cached.splitTermsList(texts), split)
+        self.db.getCategory('news').migrate(0)
+        self.assertEqual(cached.splitTermsList(texts), split)
+
+    def testFinalize(self):
+        lexicon.LexiconBuilder(self.db, 4).feed('news', corpus)
+        cached = lexicon.LexiconDatabase(self.db.backend, cache_size=10000)
+        split = self.other.splitTermsList(texts)
+        self.assertEqual(cached.splitTermsList(texts), split)
+        # previous generations read by other databases are deleted
+        for i in xrange(2):
+            self.db.getCategory('news').finalize()
+            self.assertEqual(self.other.splitTermsList(texts), split)
+            self.assertEqual(cached.splitTermsList(texts), split)
+        self.assertEqual(self.other.getCategory('news').scoreTable, 
+                         self.db.getCategory('news').scoreTable)
+
+    def testMerged(self):
+        builder = lexicon.LexiconBuilder(self.db, 4)
+        builder.feed('news', corpus)
+        builder.feed('blog', makeText(3000, seed=3))
+        # scores are added in the same order as in the merged category
+        names = ['blog', 'news']
+        split = self.other.splitTermsList(texts, names)
+        self.assertEqual(self.other._loadMerged(), {})
+        self.db.mergeCategories(names)
+        self.assertEqual(self.other.splitTermsList(texts, names), split)
+        self.assertEqual(self.other._loadMerged().keys(), 
+                         [tuple(sorted(names))])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+# -*- coding: utf8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+from loso import frozen
+from loso import lexicon
+from loso.backends import MemoryBackend
+from loso.test import makeText, iterChinese
+
+counts = {
+    u'中': 5,
+    u'中文': 3,
+    u'文': 4,
+    u'斷詞': 2,
+    'Eblock': 7,
+    u'一二三四': 1,
+}
+
+dump = u"""gram 4
+1-gram-sum 9
+1-gram-variety 2
+2-gram-sum 5
+2-gram-variety 2
+3-gram-sum 0
+3-gram-variety 0
+4-gram-sum 1
+4-gram-variety 1
+
+5 中
+3 中文
+4 文
+2 斷詞
+7 Eblock
+None 空的
+1 一二三四
+""".encode('utf8')
+
+class TestFrozen(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'news.lex')
+        sums = {1: 9, 2: 5, 4: 1}
+        varieties = {1: 2, 2: 2, 4: 1}
+        with open(self.path, 'wb') as file:
+            written = frozen.writeFrozen(file, 4, sums, varieties,
+                                         counts.iteritems())
+        self.assertEqual(written, len(counts))
+        self.category = frozen.FrozenCategory('news', self.path)
+
+    def tearDown(self):
+        self.category.close()
+        shutil.rmtree(self.dir)
+
+    def testLookup(self):
+        category = self.category
+        self.assertEqual(len(category), len(counts))
+        self.assertEqual(category.gram, 4)
+        for term, count in counts.iteritems():
+            self.assertEqual(category.getTerm(term), count)
+            # terms can be given as UTF-8 bytes
+            self.assertEqual(category.getTerm(term.encode('utf8')), count)
+        self.assertEqual(category.getTerm(u'不存在'), None)
+        self.assertEqual(category.getTerm(u''), None)
+        self.assertEqual(category.getTerms(u'中', u'不存在', u'斷詞'),
+                         [5, None, 2])
+        self.assertEqual(category.getTermList(),
+                         sorted(term.encode('utf8') for term in counts))
+
+    def testMeta(self):
+        category = self.category
+        self.assertEqual([category.getGramSum(n) for n in xrange(1, 5)],
+                         [9, 5, 0, 1])
+        self.assertEqual([category.getGramVariety(n) for n in xrange(1, 5)],
+                         [2, 2, 0, 1])
+
+    def testExportDump(self):
+        # terms without count are skipped
+        path = os.path.join(self.dir, 'dump.lex')
+        with open(path, 'wb') as file:
+            frozen.exportDump(StringIO(dump), file)
+        with open(path, 'rb') as file:
+            dumped = file.read()
+        with open(self.path, 'rb') as file:
+            self.assertEqual(dumped, file.read())
+
+    def testBadFile(self):
+        path = os.path.join(self.dir, 'bad.lex')
+        with open(path, 'wb') as file:
+            file.write('NOTALEXICON' + '\0'*32)
+        self.assertRaises(ValueError, frozen.FrozenCategory, 'bad', path)
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = lexicon.LexiconDatabase(MemoryBackend())
+        lexicon.LexiconBuilder(self.db, 4).feed('news', makeText(5000))
+        self.live = self.db.getCategory('news')
+        self.path = os.path.join(self.dir, 'news.lex')
+        with open(self.path, 'wb') as file:
+            frozen.exportCategory(self.live, file)
+        self.texts = list(iterChinese(makeText(1000, seed=1)))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testCounts(self):
+        category = frozen.FrozenCategory('news', self.path)
+        try:
+            terms = self.live.getTermList()
+            self.assertEqual(len(category), len(terms))
+            self.assertEqual(category.getTerms(*terms),
+                             map(int, self.live.getTerms(*terms)))
+            self.assertEqual(category.gram, self.live.gram)
+            for n in xrange(1, category.gram + 1):
+                self.assertEqual(category.getGramSum(n),
+                                 self.live.getGramSum(n))
+                self.assertEqual(category.getGramVariety(n),
+                                 self.live.getGramVariety(n))
+        finally:
+            category.close()
+
+    def testSplitTerms(self):
+        # frozen category overrides the live one with the same results
+        expected = self.db.splitTermsList(self.texts)
+        category = self.db.attachFrozen('news', self.path)
+        try:
+            self.assertEqual(self.db._getCategories(), [category])
+            self.assertEqual(self.db.splitTermsList(self.texts), expected)
+        finally:
+            category.close()
+
+if __name__ == '__main__':
+    unittest.main()
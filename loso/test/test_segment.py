@@ -0,0 +1,153 @@
+# -*- coding: utf8 -*-
+import math
+import random
+import unittest
+
+from loso import util
+from loso import lexicon
+from loso import vectorized
+from loso.backends import MemoryBackend
+from loso.test import makeText, iterChinese
+
+corpus = makeText(5000, seed=0)
+sample = makeText(1000, seed=1)
+
+def createDatabase(**kwargs):
+    db = lexicon.LexiconDatabase(MemoryBackend(), **kwargs)
+    lexicon.LexiconBuilder(db, 4).feed('news', corpus)
+    return db
+
+def makeGrams(rand, size, ngram=4):
+    """Make grams of a sentence of size items with random scores, so that
+    there is no tie
+
+    """
+    grams = []
+    for n in xrange(1, ngram + 1):
+        grams.append([((i, n), rand.uniform(0.001, 1.0))
+                      for i in xrange(size - n + 1)])
+    return grams
+
+class TestEngines(unittest.TestCase):
+
+    def testRandomScores(self):
+        rand = random.Random(0)
+        for _ in xrange(300):
+            grams = makeGrams(rand, rand.randint(1, 12))
+            terms, score = lexicon.findBestSegment(grams)
+            path_terms, log_score = lexicon.findBestPath(grams)
+            self.assertEqual(path_terms, terms)
+            self.assertAlmostEqual(log_score, math.log(score))
+
+    def testLongSentence(self):
+        # products of scores underflow, but log scores don't
+        grams = makeGrams(random.Random(0), 2000)
+        terms, log_score = lexicon.findBestPath(grams)
+        self.assertEqual(sum(n for _, n in terms), 2000)
+        scores = dict(item for n_grams in grams for item in n_grams)
+        self.assertAlmostEqual(log_score, 
+                               sum(math.log(scores[term]) for term in terms))
+
+    def testFedData(self):
+        # unknown terms score the same, so segmentations of a text may tie,
+        # engines pick one of the best segmentations
+        db = createDatabase()
+        self.assertEqual(db.engine, 'table')
+        texts = list(iterChinese(sample))
+        table = db.splitTermsList(texts)
+        path = createDatabase(engine='viterbi').splitTermsList(texts)
+        terms = set()
+        for text_terms in table + path:
+            terms.update(text_terms)
+        scores = db._getTermScores(terms, db._getCategories())
+        for table_terms, path_terms in zip(table, path):
+            self.assertEqual(u''.join(path_terms), u''.join(table_terms))
+            self.assertAlmostEqual(
+                sum(math.log(scores[term]) for term in path_terms),
+                sum(math.log(scores[term]) for term in table_terms))
+
+@unittest.skipUnless(vectorized.available, 'NumPy is not installed')
+class TestVectorized(unittest.TestCase):
+
+    def testRandomScores(self):
+        rand = random.Random(0)
+        for _ in xrange(300):
+            grams = makeGrams(rand, rand.randint(1, 12))
+            terms, log_score = lexicon.findBestPath(grams)
+            array_terms, array_score = vectorized.findBestPathArray(grams)
+            self.assertEqual(array_terms, terms)
+            self.assertAlmostEqual(array_score, log_score)
+
+    def testFedData(self):
+        texts = list(iterChinese(sample)) + [u'', sample[:1]]
+        expected = createDatabase(engine='viterbi').splitTermsList(texts)
+        db = createDatabase(engine='numpy')
+        self.assertEqual(db.engine, 'numpy')
+        self.assertEqual(db.splitTermsList(texts), expected)
+        self.assertEqual(db.splitTermsList([]), [])
+        db.getCategory('news').finalize()
+        self.assertEqual(db.splitTermsList(texts), expected)
+
+class TestFinalize(unittest.TestCase):
+
+    def getTerms(self, texts):
+        terms = set()
+        for text in texts:
+            for n in xrange(1, 5):
+                terms.update(util.ngram(n, text))
+        return terms
+
+    def testScores(self):
+        texts = list(iterChinese(sample))
+        terms = self.getTerms(texts)
+        for buckets in (0, 16):
+            db = createDatabase(buckets=buckets)
+            categories = db._getCategories()
+            live = db._getTermScores(terms, categories)
+            expected = db.splitTermsList(texts)
+            
+            db.getCategory('news').finalize(scan_size=100)
+            categories = db._getCategories()
+            counts = db._getTermCounts(list(terms), categories)[0]
+            # scores are read from the score table
+            self.assertEqual([factors for _, _, factors in counts], [None])
+            scores = db._getTermScores(terms, categories)
+            self.assertEqual(sorted(scores), sorted(live))
+            for term in terms:
+                self.assertAlmostEqual(scores[term], live[term], places=12)
+            self.assertEqual(db.splitTermsList(texts), expected)
+
+    def testFeed(self):
+        # scores change with feeding only if the builder refinalizes
+        texts = list(iterChinese(sample))
+        db = createDatabase()
+        category = db.getCategory('news')
+        category.finalize()
+        generation = category.scoreTable[0]
+        lexicon.LexiconBuilder(db, 4).feed('news', sample)
+        self.assertEqual(category.scoreTable[0], generation)
+        expected = createDatabase()
+        lexicon.LexiconBuilder(expected, 4).feed('news', sample)
+        lexicon.LexiconBuilder(db, 4, refinalize=True).feed('news', u'中文')
+        lexicon.LexiconBuilder(expected, 4).feed('news', u'中文')
+        self.assertEqual(db.getCategory('news').scoreTable[0], generation + 1)
+        self.assertEqual(db.splitTermsList(texts), 
+                         expected.splitTermsList(texts))
+
+    def testClean(self):
+        db = createDatabase()
+        category = db.getCategory('news')
+        category.finalize()
+        prefix = category._score_prefix
+        generation = category.scoreTable[0]
+        # the previous generation is deleted
+        category.finalize()
+        self.assertEqual(category.scoreTable[0], generation + 1)
+        self.assertEqual([key for key in db.backend.data if key.startswith(
+            '%s%d:' % (prefix, generation))], [])
+        category.clean()
+        self.assertEqual([key for key in db.backend.data 
+                          if key.startswith(prefix)], [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+# -*- coding: utf8 -*-
+import json
+import socket
+import threading
+import unittest
+
+from loso.client import JSONLineClient, RemoteError
+from loso.server import JSONLineServer
+from loso.service import SegumentService
+from loso.test import makeText
+
+corpus = makeText(5000, seed=0)
+sample = makeText(1000, seed=1)
+
+class TestJSONLineServer(unittest.TestCase):
+
+    def setUp(self):
+        config = dict(lexicon=dict(backend='memory'))
+        self.service = SegumentService(config)
+        self.service.feed('news', corpus)
+        self.startServer(threads=4)
+        self.clients = []
+
+    def startServer(self, threads, idle_timeout=30):
+        self.server = JSONLineServer(('127.0.0.1', 0), threads=threads,
+                                     idle_timeout=idle_timeout)
+        self.server.setService(self.service)
+        self.server.startThreads()
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       kwargs=dict(poll_interval=0.05))
+        self.thread.daemon = True
+        self.thread.start()
+        self.port = self.server.socket.getsockname()[1]
+
+    def stopServer(self):
+        self.server.shutdown()
+        self.server.stopThreads()
+        self.server.server_close()
+        self.thread.join()
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.stopServer()
+
+    def createClient(self):
+        client = JSONLineClient('127.0.0.1', self.port, timeout=10)
+        self.clients.append(client)
+        return client
+
+    def testCalls(self):
+        client = self.createClient()
+        self.assertEqual(client.splitTerms(sample),
+                         self.service.splitTerms(sample))
+        self.assertEqual(client.splitTerms(sample, ['news']),
+                         self.service.splitTerms(sample, ['news']))
+        texts = [sample, u'', sample[:100]]
+        self.assertEqual(client.splitTermsBatch(texts),
+                         self.service.splitTermsBatch(texts))
+        self.assertEqual(client.call('splitNgramTerms', u'中文'),
+                         [u'中', u'文', u'中文'])
+
+    def testErrors(self):
+        client = self.createClient()
+        for method in ('missing', '_splitSentences', 'ngram'):
+            try:
+                client.call(method)
+            except RemoteError, e:
+                self.assertEqual(e.type, 'AttributeError')
+            else:
+                self.fail('%s is called' % method)
+        self.assertRaises(RemoteError, client.splitTerms)
+        # the connection is still usable after errors
+        self.assertEqual(client.splitNgramTerms(u'中'), [u'中'])
+
+    def testBadLine(self):
+        connection = socket.create_connection(('127.0.0.1', self.port), 10)
+        file = connection.makefile('rb')
+        try:
+            connection.sendall('not json\n\n{"id": 7, "method": "splitTerms"'
+                               ', "params": ["\\u4e2d"]}\n')
+            error = json.loads(file.readline())
+            self.assertEqual(error['id'], None)
+            self.assertEqual(error['error']['type'], 'ValueError')
+            self.assertEqual(json.loads(file.readline()),
+                             dict(id=7, result=[u'中']))
+        finally:
+            file.close()
+            connection.close()
+
+    def testConcurrentClients(self):
+        expected = self.service.splitTerms(sample)
+        results = []
+        def run():
+            client = self.createClient()
+            for _ in xrange(5):
+                results.append(client.splitTerms(sample) == expected)
+        threads = [threading.Thread(target=run) for _ in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [True]*20)
+
+    def testBusyThreads(self):
+        # a connection is not accepted while all threads are busy
+        self.stopServer()
+        self.startServer(threads=1)
+        client = self.createClient()
+        self.assertEqual(client.splitNgramTerms(u'中'), [u'中'])
+        connection = socket.create_connection(('127.0.0.1', self.port), 10)
+        file = connection.makefile('rb')
+        try:
+            connection.sendall('{"id": 1, "method": "splitNgramTerms", '
+                               '"params": ["\\u4e2d"]}\n')
+            connection.settimeout(0.3)
+            self.assertRaises(socket.timeout, file.readline)
+            # it is handled after the thread is free
+            client.close()
+            connection.settimeout(10)
+            self.assertEqual(json.loads(file.readline()),
+                             dict(id=1, result=[u'中']))
+        finally:
+            file.close()
+            connection.close()
+
+    def testIdleTimeout(self):
+        # an idle connection doesn't hold the thread
+        self.stopServer()
+        self.startServer(threads=1, idle_timeout=0.2)
+        client = self.createClient()
+        self.assertEqual(client.splitNgramTerms(u'中'), [u'中'])
+        other = self.createClient()
+        self.assertEqual(other.splitNgramTerms(u'文'), [u'文'])
+        # the client connects again after its connection is closed
+        self.assertEqual(client.splitNgramTerms(u'中'), [u'中'])
+
+if __name__ == '__main__':
+    unittest.main()
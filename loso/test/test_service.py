@@ -0,0 +1,149 @@
+# -*- coding: utf8 -*-
+import unittest
+
+from loso import lexicon
+from loso.service import SegumentService
+from loso.backends import MemoryBackend
+from loso.test.test_cache import Clock
+from loso.test import makeText
+
+corpus = makeText(5000, seed=0)
+more = makeText(5000, seed=2)
+sample = makeText(1000, seed=1)
+
+def createService(backend=None, **kwargs):
+    config = dict(lexicon=dict(backend='memory', **kwargs))
+    return SegumentService(config, backend=backend)
+
+class CountingBackend(MemoryBackend):
+    """Memory backend counts commands
+
+    """
+
+    def __init__(self):
+        MemoryBackend.__init__(self)
+        self.calls = 0
+
+    def get(self, key):
+        self.calls += 1
+        return MemoryBackend.get(self, key)
+
+    def mget(self, keys):
+        self.calls += 1
+        return MemoryBackend.mget(self, keys)
+
+class TestSegmentCache(unittest.TestCase):
+
+    def testSplitTerms(self):
+        service = createService()
+        cached = createService(segment_cache_size=1000)
+        for s in (service, cached):
+            s.feed('news', corpus)
+        expected = service.splitTerms(sample)
+        self.assertEqual(cached.splitTerms(sample), expected)
+        misses = cached.segment_cache.getStats()['misses']
+        self.assertEqual(cached.splitTerms(sample), expected)
+        stats = cached.segment_cache.getStats()
+        self.assertEqual(stats['misses'], misses)
+        self.assertTrue(stats['hits'] > 0)
+        # results with other categories are not mixed up
+        self.assertEqual(cached.splitTerms(sample, ['news']),
+                         service.splitTerms(sample, ['news']))
+
+    def testFeed(self):
+        service = createService()
+        cached = createService(segment_cache_size=1000)
+        for s in (service, cached):
+            s.feed('news', corpus)
+        before = cached.splitTerms(sample)
+        cached.splitTerms(sample, ['news'])
+        # results are split again with fed data
+        for s in (service, cached):
+            s.feed('news', more)
+        self.assertNotEqual(service.splitTerms(sample), before)
+        self.assertEqual(cached.splitTerms(sample), service.splitTerms(sample))
+        self.assertEqual(cached.splitTerms(sample, ['news']),
+                         service.splitTerms(sample, ['news']))
+
+    def testOtherProcess(self):
+        # a feed by other process on the same backend clears the cache
+        service = createService()
+        cached = createService(segment_cache_size=1000, segment_cache_check=0)
+        for s in (service, cached):
+            s.feed('news', corpus)
+        cached.splitTerms(sample)
+        other = lexicon.LexiconDatabase(cached.db.backend)
+        lexicon.LexiconBuilder(other, 4).feed('news', more)
+        service.feed('news', more)
+        self.assertEqual(cached.splitTerms(sample), service.splitTerms(sample))
+        # unchanged results are cached again
+        hits = cached.segment_cache.getStats()['hits']
+        self.assertEqual(cached.splitTerms(sample), service.splitTerms(sample))
+        self.assertTrue(cached.segment_cache.getStats()['hits'] > hits)
+
+    def testCheckInterval(self):
+        clock = Clock()
+        backend = CountingBackend()
+        cached = createService(backend, segment_cache_size=1000, 
+                               segment_cache_check=10)
+        cached.db.timer = clock
+        cached.feed('news', corpus)
+        expected = cached.splitTerms(sample)
+        # no round trip for cached results
+        calls = backend.calls
+        clock.now = 5
+        self.assertEqual(cached.splitTerms(sample), expected)
+        self.assertEqual(backend.calls, calls)
+        # feeds of other processes are seen after the interval
+        other = lexicon.LexiconDatabase(backend)
+        lexicon.LexiconBuilder(other, 4).feed('news', more)
+        self.assertEqual(cached.splitTerms(sample), expected)
+        clock.now = 20
+        self.assertNotEqual(cached.splitTerms(sample), expected)
+
+    def testCategories(self):
+        # only results split with changed categories are discarded
+        cached = createService(segment_cache_size=1000, segment_cache_check=0)
+        cached.feed('news', corpus)
+        cached.feed('blog', more)
+        for categories in (None, ['news'], ['blog']):
+            cached.splitTerms(sample, categories)
+        other = lexicon.LexiconDatabase(cached.db.backend)
+        lexicon.LexiconBuilder(other, 4).feed('news', sample)
+        cache = cached.segment_cache
+        misses = cache.getStats()['misses']
+        cached.splitTerms(sample, ['blog'])
+        self.assertEqual(cache.getStats()['misses'], misses)
+        for categories in (None, ['news']):
+            cached.splitTerms(sample, categories)
+            self.assertTrue(cache.getStats()['misses'] > misses)
+            misses = cache.getStats()['misses']
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.service = createService()
+        self.service.feed('news', corpus)
+        # repeated texts and sentences, an empty text
+        self.texts = [sample, more[:300], u'', sample, 
+                      more[:300] + u'。' + sample[:200]]
+
+    def testSplitTermsBatch(self):
+        service = self.service
+        for categories in (None, ['news']):
+            self.assertEqual(
+                service.splitTermsBatch(self.texts, categories),
+                [service.splitTerms(text, categories) 
+                 for text in self.texts])
+        self.assertEqual(service.splitTermsBatch([]), [])
+
+    def testSplitNgramTermsBatch(self):
+        service = self.service
+        self.assertEqual(service.splitNgramTermsBatch(self.texts),
+                         [service.splitNgramTerms(text) 
+                          for text in self.texts])
+        terms = service.splitNgramTerms(u'中文 Block')
+        self.assertEqual(terms, [u'中', u'文', u'中文', u'Eblock'])
+
+if __name__ == '__main__':
+    unittest.main()
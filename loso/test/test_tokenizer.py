@@ -0,0 +1,101 @@
+# -*- coding: utf8 -*-
+"""Tokenizer gives the same sentences and mixed terms as the original
+character loop and regular expressions
+
+"""
+import re
+import unittest
+
+from loso import lexicon
+from loso.test import makeText
+
+def oldSplitSentence(text, delimiters=None):
+    if delimiters is None:
+        delimiters = lexicon.default_delimiters
+    sentence = []
+    for c in text:
+        if c in delimiters:
+            yield ''.join(sentence)
+            sentence = []
+        else:
+            sentence.append(c)
+    yield ''.join(sentence)
+
+def oldIterMixTerms(text, eng_prefix='E'):
+    terms = []
+    for part in text.split():
+        last = 0
+        for match in re.finditer(lexicon.eng_term_pattern, part):
+            previous_term = part[last:match.start()]
+            if previous_term:
+                terms.append(previous_term)
+            if eng_prefix:
+                terms.append(eng_prefix + match.group(0).lower())
+            else:
+                terms.append(match.group(0).lower())
+            last = match.end()
+        final_term = part[last:]
+        if final_term:
+            terms.append(final_term)
+    return terms
+
+def oldIterEnglishTerms(text):
+    terms = []
+    for part in text.split():
+        for term in re.finditer(lexicon.eng_term_pattern, part):
+            terms.append(term.group(0))
+    return terms
+
+texts = [
+    u'',
+    u'。',
+    u'請問一下為什麼我的ip會block ?',
+    u'C1C2C3C4 E1 E2 C5C6',
+    u"我不知道 don't know，Wi-Fi 壞了。\n\n今天NBA  3D\t電影（好看）",
+    u'　全形空白　 和 a b',
+    u'結尾是英文abc',
+    'plain str, with ASCII only. and-dash',
+    makeText(5000, seed=2),
+]
+
+class TestTokenizer(unittest.TestCase):
+
+    def testSplitSentence(self):
+        for text in texts:
+            self.assertEqual(lexicon.splitSentence(text),
+                             list(oldSplitSentence(text)))
+
+    def testDelimiters(self):
+        for delimiters in (set(u'，。'), set(u' a'), set()):
+            for text in texts:
+                self.assertEqual(
+                    lexicon.splitSentence(text, delimiters),
+                    list(oldSplitSentence(text, delimiters)))
+                self.assertEqual(
+                    list(lexicon.iterSentenceTerms(text, delimiters)),
+                    [(sentence, oldIterMixTerms(sentence)) for sentence
+                     in oldSplitSentence(text, delimiters)])
+
+    def testMixTerms(self):
+        for text in texts:
+            for prefix in ('E', '', None):
+                self.assertEqual(lexicon.iterMixTerms(text, prefix),
+                                 oldIterMixTerms(text, prefix))
+        self.assertEqual(lexicon.iterMixTerms(u'請問一下為什麼我的ip會block ?'),
+                         [u'請問一下為什麼我的', u'Eip', u'會', u'Eblock', u'?'])
+
+    def testEnglishTerms(self):
+        for text in texts:
+            self.assertEqual(lexicon.iterEnglishTerms(text),
+                             oldIterEnglishTerms(text))
+
+    def testSentenceTerms(self):
+        for text in texts:
+            for prefix in ('E', ''):
+                self.assertEqual(
+                    list(lexicon.iterSentenceTerms(text, eng_prefix=prefix)),
+                    [(sentence, oldIterMixTerms(sentence, prefix))
+                     for sentence in oldSplitSentence(text)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+# -*- coding: utf8 -*-
+"""Segmentation engine on NumPy arrays, it gives the same terms as the
+viterbi engine. Counts of distinct candidate terms are held in a (categories
+x terms) array and scored in one expression per category, then log scores of
+candidates of all texts are gathered into a (texts x n x positions) array,
+and the best-path recurrence runs on all texts together, one position at a
+time. NumPy is optional, available is False when it is not installed
+
+"""
+import itertools
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+available = numpy is not None
+
+def scoreTerms(terms, counts, smoothing, ngram):
+    """Get scores of distinct terms as an array, counts is a list of
+    (terms, counts, factors) of every category returned by
+    LexiconDatabase._getTermCounts, counts of a category without factors are
+    finalized scores
+
+    """
+    index = None
+    lengths = numpy.fromiter(itertools.imap(len, terms), numpy.intp, 
+                             len(terms))
+    scores = numpy.empty(len(terms))
+    scores.fill(smoothing)
+    for c_terms, c_counts, factors in counts:
+        if not c_terms:
+            continue
+        # counts are strings from backend, they are parsed by NumPy
+        values = numpy.array([count or 0 for count in c_counts])
+        values = values.astype(numpy.float64)
+        # factor of n-gram at n, factors of missing n are never used, scores
+        # of finalized categories are divided by ones
+        factor_table = numpy.ones(ngram + 1)
+        for n, factor in (factors or {}).iteritems():
+            if n <= ngram:
+                factor_table[n] = factor
+        if c_terms is terms:
+            scores += values / factor_table[lengths]
+            continue
+        # only terms in bloom filter of the category
+        if index is None:
+            index = dict((term, i) for i, term in enumerate(terms))
+        positions = numpy.fromiter((index[term] for term in c_terms),
+                                   numpy.intp, len(c_terms))
+        scores[positions] += values / factor_table[lengths[positions]]
+    return scores
+
+def _logTable(texts, ngram, index, logs):
+    """Gather log scores of candidate terms of texts into a (texts x n x
+    positions) array, positions without a candidate are -inf
+
+    """
+    size = max(len(text) for text in texts)
+    # the last one is log score of no candidate
+    logs = numpy.append(logs, -numpy.inf)
+    missing = len(logs) - 1
+    indexes = numpy.empty((len(texts), ngram, size), numpy.intp)
+    indexes.fill(missing)
+    for i, text in enumerate(texts):
+        length = len(text)
+        for n in xrange(1, min(ngram, length) + 1):
+            indexes[i, n-1, :length-n+1] = [index[text[j:j+n]]
+                                            for j in xrange(length-n+1)]
+    return logs[indexes]
+
+def findBestPaths(texts, ngram, table):
+    """Find the best segmentation of every text with log scores gathered by
+    _logTable, return a list of (terms, log score)
+
+    """
+    count, _, size = table.shape
+    rows = numpy.arange(count)
+    # best[:, i] is the log score of best solution for first i items, and
+    # lengths[:, i] is the length of last term in that solution
+    best = numpy.zeros((count, size + 1))
+    lengths = numpy.zeros((count, size + 1), numpy.intp)
+    candidates = numpy.empty((count, ngram))
+    for end in xrange(1, size + 1):
+        candidates.fill(-numpy.inf)
+        for length in xrange(1, min(ngram, end) + 1):
+            candidates[:, length-1] = best[:, end-length] + \
+                table[:, length-1, end-length]
+        # on ties, prefer the longer last term like findBestPath, the
+        # reversed argmax is the last of maximums
+        choices = ngram - 1 - candidates[:, ::-1].argmax(axis=1)
+        best[:, end] = candidates[rows, choices]
+        lengths[:, end] = choices + 1
+
+    best = best.tolist()
+    lengths = lengths.tolist()
+    results = []
+    for i, text in enumerate(texts):
+        terms = []
+        end = len(text)
+        while end > 0:
+            length = lengths[i][end]
+            terms.append(text[end-length:end])
+            end -= length
+        terms.reverse()
+        results.append((terms, best[i][len(text)]))
+    return results
+
+def splitTexts(texts, ngram, terms, scores):
+    """Split texts into terms with scores of distinct candidate terms,
+    scores is an array aligned with terms, return a list of (terms, log
+    score)
+
+    """
+    results = [([], 0.0) for text in texts]
+    # empty texts have no candidate
+    indexes = [i for i, text in enumerate(texts) if text]
+    if not indexes:
+        return results
+    texts = [texts[i] for i in indexes]
+    index = dict((term, i) for i, term in enumerate(terms))
+    table = _logTable(texts, ngram, index, numpy.log(scores))
+    for i, result in zip(indexes, findBestPaths(texts, ngram, table)):
+        results[i] = result
+    return results
+
+def findBestPathArray(grams):
+    """Find the best segmentation of grams like findBestPath, return (terms,
+    log score)
+
+    """
+    ngram = len(grams)
+    size = len(grams[0])
+    table = numpy.empty((1, ngram, size))
+    table.fill(-numpy.inf)
+    for n, terms in enumerate(grams):
+        if terms:
+            table[0, n, :len(terms)] = numpy.log([score for _, score
+                                                  in terms])
+    results = findBestPaths([range(size)], ngram, table)
+    terms, score = results[0]
+    # items were positions, map them back to terms
+    return [grams[term[-1] - term[0]][term[0]][0] for term in terms], score
@@ -16,7 +16,14 @@ else:
         'reset': scripts.ResetCommand,
         'serve': scripts.ServeCommand,
         'dump': scripts.DumpCommand,
-        'info': scripts.InfoCommand
+        'load': scripts.LoadCommand,
+        'migrate': scripts.MigrateCommand,
+        'merge': scripts.MergeCommand,
+        'bloom': scripts.BloomCommand,
+        'finalize': scripts.FinalizeCommand,
+        'freeze': scripts.FreezeCommand,
+        'info': scripts.InfoCommand,
+        'benchmark': scripts.BenchmarkCommand
     }
 
 setup(
@@ -27,7 +34,7 @@ setup(
     author_email='opensource@plurk.com',
     description='Chinese segmentation library',
     long_description=__doc__,
-    packages=['loso'],
+    packages=['loso', 'loso.benchmark'],
     install_requires=[
         'redis',
         'pyyaml',